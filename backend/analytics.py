@@ -0,0 +1,254 @@
+"""
+Columnar in-memory copy of the expense history for vectorised analytics.
+
+Only the fields analytics need are kept: day, month, amount and a category
+code, each as a numpy array. Writes are applied incrementally by id, and
+group-bys are a mask plus np.bincount over the arrays rather than a loop over
+model objects.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def _utc(date: datetime) -> datetime:
+    return date.astimezone(timezone.utc) if date.tzinfo is not None else date
+
+
+def day_number(date: datetime) -> int:
+    return _utc(date).toordinal() - EPOCH_ORDINAL
+
+
+def month_number(date: datetime) -> int:
+    date = _utc(date)
+    return (date.year - 1970) * 12 + date.month - 1
+
+
+def _value(value: Any) -> Any:
+    return getattr(value, "value", value)
+
+
+class ExpenseColumns:
+    """Expense (day, month, amount, category) columns addressed by expense id.
+
+    Deleted rows are tombstoned through the `alive` mask and reclaimed by
+    compacting once they make up half of the arrays.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.min_capacity = capacity
+        self.loaded = False
+        self.backlog: Optional[List[Tuple[Any, Any]]] = None
+        self.size = 0
+        self.tombstones = 0
+        self.category_names: List[str] = []
+        self._category_codes: Dict[str, int] = {}
+        self._rows: Dict[str, int] = {}
+        self._row_ids: List[Optional[str]] = []
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        self.days = np.zeros(capacity, dtype=np.int64)
+        self.months = np.zeros(capacity, dtype=np.int32)
+        self.amounts = np.zeros(capacity, dtype=np.float64)
+        self.categories = np.zeros(capacity, dtype=np.int16)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self.days)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ("days", "months", "amounts", "categories", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _category_code(self, category: Any) -> int:
+        category = _value(category)
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self.category_names)
+            self.category_names.append(category)
+        return code
+
+    def start_loading(self) -> None:
+        """Queue changes from here until load() so none are lost while a snapshot is read."""
+        self.loaded = False
+        self.backlog = []
+
+    def load(self, rows: Iterable[Tuple[str, datetime, float, Any]]) -> None:
+        """Replace the contents with (id, date, amount, category) rows and replay queued changes."""
+        ids, days, months, amounts, categories = [], [], [], [], []
+        for expense_id, date, amount, category in rows:
+            ids.append(expense_id)
+            days.append(day_number(date))
+            months.append(month_number(date))
+            amounts.append(amount)
+            categories.append(self._category_code(category))
+
+        self._allocate(max(len(ids) * 2, self.min_capacity))
+        count = len(ids)
+        self.days[:count] = days
+        self.months[:count] = months
+        self.amounts[:count] = amounts
+        self.categories[:count] = categories
+        self.alive[:count] = True
+        self.size = count
+        self.tombstones = 0
+        self._row_ids = list(ids)
+        self._rows = {expense_id: row for row, expense_id in enumerate(ids)}
+        self.loaded = True
+        backlog, self.backlog = self.backlog or [], None
+        self.apply_changes(backlog)
+
+    def upsert(self, expense_id: str, date: datetime, amount: float, category: Any) -> None:
+        row = self._rows.get(expense_id)
+        if row is None:
+            self._grow(self.size + 1)
+            row = self.size
+            self.size += 1
+            self._rows[expense_id] = row
+            self._row_ids.append(expense_id)
+        self.days[row] = day_number(date)
+        self.months[row] = month_number(date)
+        self.amounts[row] = amount
+        self.categories[row] = self._category_code(category)
+        self.alive[row] = True
+
+    def remove(self, expense_id: str) -> None:
+        row = self._rows.pop(expense_id, None)
+        if row is None:
+            return
+        self.alive[row] = False
+        self.amounts[row] = 0.0
+        self._row_ids[row] = None
+        self.tombstones += 1
+        if self.tombstones * 2 > self.size:
+            self.compact()
+
+    def compact(self) -> None:
+        keep = np.nonzero(self.alive[:self.size])[0]
+        for name in ("days", "months", "amounts", "categories", "alive"):
+            column = getattr(self, name)
+            column[:len(keep)] = column[keep]
+            column[len(keep):self.size] = 0
+        self._row_ids = [self._row_ids[row] for row in keep]
+        self._rows = {expense_id: row for row, expense_id in enumerate(self._row_ids)}
+        self.size = len(keep)
+        self.tombstones = 0
+
+    def apply_changes(self, changes: Iterable[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> None:
+        """Apply (old, new) expense document pairs as written to the database."""
+        if not self.loaded:
+            if self.backlog is not None:
+                self.backlog.extend(changes)
+            return
+        for old, new in changes:
+            if old and (not new or old["id"] != new["id"]):
+                self.remove(old["id"])
+            if new:
+                self.upsert(new["id"], new["date"], new["amount"], new["category"])
+
+    def __len__(self) -> int:
+        return self.size - self.tombstones
+
+    def _bincount(self, values: np.ndarray, offset: int, step: int, n_buckets: int, n_groups: int = 1,
+                  groups: Optional[np.ndarray] = None, keep_later: bool = False) -> np.ndarray:
+        """Sum amounts into buckets (values - offset) // step, per group.
+
+        Out-of-range values are clipped into spill buckets that are dropped
+        (or, with keep_later, folded into the last bucket), so no boolean mask
+        copies every column; removed rows have a zero amount and add nothing.
+        """
+        index = values.astype(np.intp)
+        index -= offset
+        if step > 1:
+            index //= step
+        index += 1
+        np.clip(index, 0, n_buckets if keep_later else n_buckets + 1, out=index)
+        index *= n_groups
+        if groups is not None:
+            index += groups
+        totals = np.bincount(index, weights=self.amounts[:self.size], minlength=(n_buckets + 2) * n_groups)
+        return totals[n_groups:(n_buckets + 1) * n_groups]
+
+    def month_category_matrix(self, first_month: int, last_month: int) -> np.ndarray:
+        """Totals per (month, category) from first_month to last_month.
+
+        One extra trailing row collects everything dated after last_month.
+        """
+        n_months = last_month - first_month + 1
+        n_categories = max(len(self.category_names), 1)
+        totals = self._bincount(
+            self.months[:self.size], first_month, 1, n_months + 1,
+            n_categories, self.categories[:self.size], keep_later=True,
+        )
+        return totals.reshape(n_months + 1, n_categories)
+
+    def bucket_totals(self, starts: Sequence[datetime], granularity: str) -> np.ndarray:
+        """Totals per trend bucket; buckets are consecutive days, ISO weeks or months."""
+        if granularity == "monthly":
+            return self._bincount(self.months[:self.size], month_number(starts[0]), 1, len(starts))
+        step = 7 if granularity == "weekly" else 1
+        return self._bincount(self.days[:self.size], day_number(starts[0]), step, len(starts))
+
+
+class UserExpenseColumns:
+    """One ExpenseColumns per user, loaded together from a single snapshot.
+
+    Each user's analytics read only that user's arrays, so their cost follows
+    the size of one expense history rather than everyone's. Only writes
+    applied in this process are seen, so it needs a single worker.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.backlog: Optional[List[Tuple[Any, Any]]] = None
+        self.users: Dict[str, ExpenseColumns] = {}
+
+    def start_loading(self) -> None:
+        """Queue changes from here until load() so none are lost while a snapshot is read."""
+        self.loaded = False
+        self.backlog = []
+
+    def load(self, rows: Iterable[Tuple[str, str, datetime, float, Any]]) -> None:
+        """Replace the contents with (user_id, id, date, amount, category) rows and replay queued changes."""
+        by_user: Dict[str, List[Tuple[str, datetime, float, Any]]] = {}
+        for user_id, expense_id, date, amount, category in rows:
+            by_user.setdefault(user_id, []).append((expense_id, date, amount, category))
+        self.users = {}
+        for user_id, user_rows in by_user.items():
+            self._user(user_id).load(user_rows)
+        self.loaded = True
+        backlog, self.backlog = self.backlog or [], None
+        self.apply_changes(backlog)
+
+    def _user(self, user_id: str) -> ExpenseColumns:
+        columns = self.users.get(user_id)
+        if columns is None:
+            columns = self.users[user_id] = ExpenseColumns(capacity=64)
+            columns.loaded = True
+        return columns
+
+    def for_user(self, user_id: str) -> ExpenseColumns:
+        return self.users.get(user_id) or ExpenseColumns(capacity=1)
+
+    def apply_changes(self, changes: Iterable[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> None:
+        """Apply (old, new) expense document pairs, each to its owner's columns."""
+        if not self.loaded:
+            if self.backlog is not None:
+                self.backlog.extend(changes)
+            return
+        for old, new in changes:
+            if old or new:
+                self._user((new or old)["user_id"]).apply_changes([(old, new)])
+
+    def __len__(self) -> int:
+        return sum(len(columns) for columns in self.users.values())
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks and scaling curves for the pure analytics functions.
+
+    python backend/benchmark_analytics.py                    # 1k to 1M rows
+    python backend/benchmark_analytics.py --max-rows 100000 --output analytics.json
+    python backend/benchmark_analytics.py --check            # exits 1 on superlinear scaling
+
+Each case is timed at 1k, 10k, 100k and 1M rows (best of a few runs for the
+small sizes). The scaling exponent is the log-log slope between the two
+largest sizes. Linear work is about 1.0, and an O(N²) regression shows up
+well above it. A second curve grows the trend window at a fixed row count:
+trends cost should barely depend on it, so an O(months·N) loop shows up as
+an exponent near 1.
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nbntracker_benchmark")
+
+from analytics import ExpenseColumns
+from forecast import project_cash_flow
+from server import (
+    BillingFrequency, ExpenseCategory, RecurringExpenseFrequency, SubscriptionCategory, TrendGranularity,
+    calculate_next_due_date, calculate_next_expense_date, dashboard_from_facets, get_monthly_cost,
+    get_spending_trends,
+)
+
+SIZES = [1000, 10000, 100000, 1000000]
+TREND_MONTHS = [6, 24, 60, 120]
+TREND_MONTHS_ROWS = 100000
+MAX_SCALING_EXPONENT = 1.3
+MAX_MONTHS_EXPONENT = 0.5  # Trend cost should barely depend on the window length
+NOW = datetime(2026, 6, 15, 12, 0)
+
+
+def synthetic_subscriptions(count: int) -> List[Dict[str, Any]]:
+    frequencies = [frequency.value for frequency in BillingFrequency]
+    categories = [category.value for category in SubscriptionCategory]
+    subscriptions = []
+    for i in range(count):
+        created_at = NOW - timedelta(days=random.randint(0, 3650))
+        is_active = random.random() > 0.2
+        subscriptions.append({
+            "id": str(i),
+            "name": f"Subscription {i}",
+            "cost": round(random.uniform(50, 2000), 2),
+            "billing_frequency": random.choice(frequencies),
+            "next_due_date": NOW + timedelta(days=random.randint(0, 365)),
+            "category": random.choice(categories),
+            "is_active": is_active,
+            "cancelled_at": None if is_active else created_at + (NOW - created_at) * random.random(),
+            "created_at": created_at,
+        })
+    return subscriptions
+
+
+def synthetic_expenses(count: int, years: int = 10) -> List[Dict[str, Any]]:
+    categories = [category.value for category in ExpenseCategory]
+    span_minutes = years * 365 * 24 * 60
+    return [
+        {
+            "id": str(i),
+            "amount": round(random.lognormvariate(5, 1), 2),
+            "category": random.choice(categories),
+            "date": NOW - timedelta(minutes=random.randint(0, span_minutes)),
+        }
+        for i in range(count)
+    ]
+
+
+def synthetic_facets(count: int) -> Dict[str, Any]:
+    """$facet output for a dashboard with `count` subscriptions and upcoming expenses."""
+    subscriptions = synthetic_subscriptions(count)
+    expenses = synthetic_expenses(count)
+    categories = {}
+    for sub in subscriptions:
+        if sub["is_active"]:
+            categories[sub["category"]] = categories.get(sub["category"], 0) + get_monthly_cost(
+                sub["cost"], sub["billing_frequency"]
+            )
+    return {
+        "subscription_categories": [{"_id": category, "total": total} for category, total in categories.items()],
+        "upcoming_subscriptions": [sub for sub in subscriptions if sub["is_active"]],
+        "trend_subscriptions": subscriptions,
+        "expense_totals": [{"month": 12000.0, "year": 96000.0, "last_month": 15000.0}],
+        "expense_categories": [{"_id": category.value, "total": 1500.0} for category in ExpenseCategory],
+        "expense_trends": [{"_id": f"2026-{month:02d}", "total": 1000.0 * month} for month in range(1, 7)],
+        "upcoming_expenses": [
+            {**exp, "name": f"Expense {exp['id']}", "is_recurring": True, "recurring_frequency": "monthly"}
+            for exp in expenses
+        ],
+        "budgets": [
+            {"id": "annual", "type": "annual", "amount": 100000.0, "period": "yearly"},
+            {"id": "food", "type": "category", "amount": 1000.0, "category": "food", "period": "monthly"},
+        ],
+    }
+
+
+def column_store(expenses: List[Dict[str, Any]]) -> ExpenseColumns:
+    columns = ExpenseColumns()
+    columns.load((exp["id"], exp["date"], exp["amount"], exp["category"]) for exp in expenses)
+    return columns
+
+
+# name -> (build input for n rows, run on that input)
+CASES: Dict[str, Any] = {
+    "get_monthly_cost": (
+        lambda n: [(random.uniform(50, 2000), random.choice(list(BillingFrequency))) for _ in range(n)],
+        lambda rows: [get_monthly_cost(cost, frequency) for cost, frequency in rows],
+    ),
+    "calculate_next_due_date": (
+        lambda n: [(NOW - timedelta(days=random.randint(0, 3650)), random.choice(list(BillingFrequency))) for _ in range(n)],
+        lambda rows: [calculate_next_due_date(date, frequency) for date, frequency in rows],
+    ),
+    "calculate_next_expense_date": (
+        lambda n: [
+            (NOW - timedelta(days=random.randint(0, 3650)), random.choice(list(RecurringExpenseFrequency)))
+            for _ in range(n)
+        ],
+        lambda rows: [calculate_next_expense_date(date, frequency) for date, frequency in rows],
+    ),
+    "get_spending_trends[expenses]": (
+        lambda n: (synthetic_subscriptions(100), synthetic_expenses(n)),
+        lambda data: get_spending_trends(data[0], data[1], months=12, now=NOW),
+    ),
+    "get_spending_trends[subscriptions]": (
+        lambda n: (synthetic_subscriptions(n), []),
+        lambda data: get_spending_trends(data[0], data[1], months=12, now=NOW),
+    ),
+    "get_spending_trends[daily]": (
+        lambda n: (synthetic_subscriptions(100), synthetic_expenses(n)),
+        lambda data: get_spending_trends(data[0], data[1], months=6, granularity=TrendGranularity.DAILY, now=NOW),
+    ),
+    "dashboard_from_facets": (
+        synthetic_facets,
+        lambda facets: dashboard_from_facets(facets, NOW),
+    ),
+    "ExpenseColumns.month_category_matrix": (
+        lambda n: column_store(synthetic_expenses(n)),
+        lambda columns: columns.month_category_matrix(columns.months[:columns.size].max() - 12, columns.months[:columns.size].max()),
+    ),
+    "project_cash_flow": (
+        lambda n: synthetic_subscriptions(n),
+        lambda subs: project_cash_flow(
+            anchors=[sub["next_due_date"] for sub in subs],
+            frequencies=[sub["billing_frequency"] for sub in subs],
+            amounts=[sub["cost"] for sub in subs],
+            categories=[sub["category"] for sub in subs],
+            is_subscription=[True] * len(subs),
+            start=NOW,
+            months=12,
+        ),
+    ),
+}
+
+
+def best_time(run: Callable[[], Any], repeats: int) -> float:
+    """Fastest of `repeats` runs, with the garbage collector paused like timeit does."""
+    timings = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+    finally:
+        gc.enable()
+    return min(timings)
+
+
+def scaling_exponent(points: List[Dict[str, float]], key: str) -> float:
+    """log-log slope between the two largest measurements."""
+    if len(points) < 2:
+        return float("nan")
+    a, b = points[-2], points[-1]
+    if a["seconds"] <= 0 or b["seconds"] <= 0:
+        return float("nan")
+    return math.log(b["seconds"] / a["seconds"]) / math.log(b[key] / a[key])
+
+
+def run_case(name: str, sizes: List[int]) -> Dict[str, Any]:
+    build, run = CASES[name]
+    points = []
+    for n in sizes:
+        data = build(n)
+        seconds = best_time(lambda: run(data), repeats=5 if n <= 10000 else 3 if n <= 100000 else 1)
+        points.append({"rows": n, "seconds": seconds, "ns_per_row": seconds / n * 1e9})
+        print(f"  {n:>9,} rows  {seconds * 1000:>10.2f} ms  {seconds / n * 1e9:>9.0f} ns/row", flush=True)
+    exponent = scaling_exponent(points, "rows")
+    print(f"  scaling exponent {exponent:.2f}")
+    return {"points": points, "scaling_exponent": exponent}
+
+
+def run_trend_months(rows: int) -> Dict[str, Any]:
+    subscriptions, expenses = synthetic_subscriptions(100), synthetic_expenses(rows)
+    points = []
+    for months in TREND_MONTHS:
+        seconds = best_time(lambda: get_spending_trends(subscriptions, expenses, months=months, now=NOW), repeats=3)
+        points.append({"months": months, "seconds": seconds})
+        print(f"  {months:>9} months {seconds * 1000:>9.2f} ms", flush=True)
+    exponent = scaling_exponent(points, "months")
+    print(f"  scaling exponent {exponent:.2f}")
+    return {"rows": rows, "points": points, "scaling_exponent": exponent}
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-rows", type=int, default=SIZES[-1], help="Largest row count to time")
+    parser.add_argument("--cases", help=f"Comma-separated cases to run (default: all of {', '.join(CASES)})")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--check", action="store_true", help="Exit 1 on superlinear scaling")
+    args = parser.parse_args(argv)
+
+    random.seed(42)
+    sizes = [n for n in SIZES if n <= args.max_rows]
+    results = {"sizes": sizes, "cases": {}}
+    for name in (args.cases.split(",") if args.cases else CASES):
+        print(name)
+        results["cases"][name] = run_case(name, sizes)
+
+    if not args.cases:
+        print(f"get_spending_trends[months] at {min(TREND_MONTHS_ROWS, args.max_rows):,} expenses")
+        results["trend_months"] = run_trend_months(min(TREND_MONTHS_ROWS, args.max_rows))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    superlinear = [
+        name for name, curve in results["cases"].items() if curve["scaling_exponent"] > MAX_SCALING_EXPONENT
+    ]
+    if results.get("trend_months", {}).get("scaling_exponent", 0) > MAX_MONTHS_EXPONENT:
+        superlinear.append("get_spending_trends[months]")
+    if superlinear:
+        print(f"\n❌ Superlinear scaling: {', '.join(superlinear)}")
+        return 1 if args.check else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the API: seed a synthetic dataset, then drive the read
+endpoints concurrently and report latency percentiles and throughput.
+
+    python backend/benchmark_load.py                                  # in-process mongomock
+    python backend/benchmark_load.py --mongo-url mongodb://localhost:27017
+    python backend/benchmark_load.py --sqlite /tmp/nbntracker_benchmark.db
+    python backend/benchmark_load.py --expenses 200000 --years 5 --output results.json
+    python backend/benchmark_load.py --compare results.json          # p95 change per endpoint
+
+The app runs in-process behind httpx's ASGI transport, so only the database
+is external. Without --mongo-url a mongomock-motor stand-in is used; it lacks
+$unionWith and $indexOfCP, so the dashboard, suggestions and search
+endpoints are only measured against a real mongod. mongomock is also far
+slower than mongod, so its numbers are only comparable with other mongomock
+runs. --sqlite measures the embedded SQLite backend instead, which needs no
+server and runs every endpoint. The --db-name database (default
+nbntracker_benchmark) or --sqlite file is dropped and reseeded, so never
+point it at real data. Against mongod the client takes the
+same MONGO_* pool and timeout settings as the server, so pool sizes can be
+compared run by run; the pool section of the results shows connection churn
+and check-out waits.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nbntracker_benchmark")
+
+import httpx
+
+import server
+
+SEED_BATCH_SIZE = 5000
+USER_ID = "benchmark"
+EXPENSE_NAMES = ["Groceries", "Fuel", "Dinner out", "Electricity bill", "Pharmacy", "Books", "Movie night", "Taxi"]
+SUBSCRIPTION_NAMES = ["Netflix", "Spotify", "iCloud", "Gym", "Newspaper", "VPN", "Cloud backup", "Music lessons"]
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# (name, path, params, unsupported by mongomock)
+ENDPOINTS = [
+    ("list_expenses", "/api/expenses", {}, False),
+    ("list_expenses[category]", "/api/expenses", {"category": "food"}, False),
+    ("list_expenses[sparse]", "/api/expenses", {"fields": "name,amount,date"}, False),
+    ("list_expenses[sort=amount]", "/api/expenses", {"sort": "amount"}, False),
+    ("top_expenses", "/api/expenses", {"top": 10}, False),
+    ("search_expenses", "/api/expenses", {"search": "groc"}, True),
+    ("list_subscriptions", "/api/subscriptions", {}, False),
+    ("top_subscriptions", "/api/subscriptions", {"top": 5, "by": "monthly_cost"}, False),
+    ("list_budgets", "/api/budgets", {}, False),
+    ("trends", "/api/trends", {"months": 12}, False),
+    ("trends[weekly]", "/api/trends", {"months": 6, "granularity": "weekly"}, False),
+    ("forecast", "/api/forecast", {"months": 12}, False),
+    ("dashboard", "/api/dashboard", {}, True),
+    ("suggestions", "/api/suggestions", {}, True),
+]
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscriptions", type=int, default=200, help="Subscriptions to seed")
+    parser.add_argument("--expenses", type=int, default=50000, help="Expenses to seed")
+    parser.add_argument("--years", type=float, default=3, help="Years the expenses are spread over")
+    parser.add_argument("--mongo-url", help="Run against this mongod instead of mongomock-motor")
+    parser.add_argument("--sqlite", metavar="PATH", help="Run against a SQLite file at PATH (STORAGE_BACKEND=sqlite)")
+    parser.add_argument("--db-name", default="nbntracker_benchmark", help="Database to drop and seed")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight per endpoint")
+    parser.add_argument("--no-cache", action="store_true", help="Clear the response cache before every request")
+    parser.add_argument("--endpoints", help="Comma-separated endpoint names to run (default: all)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the dataset")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Results JSON from an earlier run to compare p95 latency against")
+    return parser.parse_args(argv)
+
+
+def connect(mongo_url: Optional[str]):
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(
+            mongo_url, event_listeners=[server.pool_metrics], **server.mongo_client_options()
+        ), "mongod"
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("mongomock-motor is not installed; pass --mongo-url or pip install mongomock-motor")
+    return AsyncMongoMockClient(), "mongomock"
+
+
+def synthetic_subscriptions(count: int, now: datetime) -> List[Dict[str, Any]]:
+    frequencies = list(server.BillingFrequency)
+    categories = list(server.SubscriptionCategory)
+    docs = []
+    for i in range(count):
+        subscription = server.Subscription(
+            name=f"{random.choice(SUBSCRIPTION_NAMES)} {i}",
+            cost=round(random.uniform(50, 2000), 2),
+            billing_frequency=random.choice(frequencies),
+            next_due_date=now + timedelta(days=random.randint(0, 365)),
+            category=random.choice(categories),
+            is_active=random.random() > 0.1,
+            created_at=now - timedelta(days=random.randint(0, 1000)),
+        )
+        docs.append(server.subscription_document(subscription, USER_ID))
+    return docs
+
+
+def synthetic_expenses(count: int, years: float, now: datetime):
+    """Yield expense documents in batches, dated uniformly over the last `years`."""
+    categories = list(server.ExpenseCategory)
+    frequencies = list(server.RecurringExpenseFrequency)
+    span_minutes = int(years * 365 * 24 * 60)
+    batch = []
+    for i in range(count):
+        is_recurring = random.random() < 0.05
+        expense = server.new_expense(server.ExpenseCreate(
+            name=f"{random.choice(EXPENSE_NAMES)} {i}",
+            amount=round(random.lognormvariate(5, 1), 2),
+            category=random.choice(categories),
+            tags=["benchmark"] if i % 4 == 0 else [],
+            notes="Synthetic" if i % 10 == 0 else None,
+            date=now - timedelta(minutes=random.randint(0, span_minutes)),
+            is_recurring=is_recurring,
+            recurring_frequency=random.choice(frequencies) if is_recurring else None,
+        ))
+        batch.append(server.expense_document(expense, USER_ID))
+        if len(batch) == SEED_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def inserts(docs: List[Dict[str, Any]]) -> List[tuple]:
+    return [("insert", doc) for doc in docs]
+
+
+async def seed(storage, args: argparse.Namespace) -> Dict[str, Any]:
+    random.seed(args.seed)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+
+    mongo = isinstance(storage, server.MongoStorage)
+    if mongo:
+        for collection_name in server.ALL_COLLECTIONS + ("monthly_rollups",):
+            await storage.database[collection_name].drop()
+        try:
+            await server.reconcile_indexes(storage.database)
+        except Exception as e:  # mongomock does not support every index option
+            print(f"⚠️  Index reconciliation skipped: {e}")
+
+    if args.subscriptions:
+        await storage.subscriptions.write_many(USER_ID, inserts(synthetic_subscriptions(args.subscriptions, now)))
+    for batch in synthetic_expenses(args.expenses, args.years, now):
+        await storage.expenses.write_many(USER_ID, inserts(batch))
+    await storage.budgets.write_many(USER_ID, inserts([
+        server.budget_document(server.Budget(type=server.BudgetType.ANNUAL, amount=500000, period="yearly"), USER_ID),
+        server.budget_document(server.Budget(type=server.BudgetType.CATEGORY, amount=20000, category="food"), USER_ID),
+    ]))
+    if mongo:
+        await server.rebuild_rollups(storage.database)
+
+    return {"seconds": round(time.perf_counter() - started, 2)}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def drive(http: httpx.AsyncClient, path: str, params: Dict[str, Any], args: argparse.Namespace) -> Dict[str, Any]:
+    """Send args.requests requests with args.concurrency in flight; latencies in ms."""
+    latencies = []
+    statuses: Dict[str, int] = {}
+    payload_bytes = 0
+    remaining = iter(range(args.requests))
+
+    async def worker():
+        nonlocal payload_bytes
+        for _ in remaining:
+            if args.no_cache:
+                server.response_cache.invalidate()
+            started = time.perf_counter()
+            response = await http.get(path, params=params)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+            payload_bytes += len(response.content)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "statuses": statuses,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "avg_payload_bytes": round(payload_bytes / len(latencies)) if latencies else 0,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    header = f"{'endpoint':<28} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'bytes':>9}"
+    if baseline:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+    for name, stats in results["endpoints"].items():
+        if "skipped" in stats:
+            print(f"{name:<28} skipped: {stats['skipped']}")
+            continue
+        line = (
+            f"{name:<28} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}"
+            f" {stats['throughput_rps']:>9.1f} {stats['avg_payload_bytes']:>9}"
+        )
+        previous = (baseline or {}).get("endpoints", {}).get(name, {})
+        if previous.get("p95_ms"):
+            line += f" {(stats['p95_ms'] / previous['p95_ms'] - 1) * 100:>+11.1f}%"
+        errors = {status: count for status, count in stats["statuses"].items() if not status.startswith("2")}
+        if errors:
+            line += f"  ❌ {errors}"
+        print(line)
+
+
+async def main(args: argparse.Namespace) -> int:
+    if args.sqlite:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.sqlite + suffix):
+                os.remove(args.sqlite + suffix)
+        server.storage = server.SQLiteStorage(args.sqlite)
+        backend = "sqlite"
+    else:
+        client, backend = connect(args.mongo_url)
+        server.install_client(client, args.db_name)
+
+    wanted = set(args.endpoints.split(",")) if args.endpoints else None
+    print(f"Seeding {args.subscriptions} subscriptions and {args.expenses} expenses over {args.years} years ({backend})...")
+    seeding = await seed(server.storage, args)
+    server.response_cache.invalidate()
+    server.record_write(None, *server.ALL_COLLECTIONS)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "backend": backend,
+            "subscriptions": args.subscriptions,
+            "expenses": args.expenses,
+            "years": args.years,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "response_cache": not args.no_cache,
+            "seed_seconds": seeding["seconds"],
+            "mongo_client_options": server.mongo_client_options(),
+        },
+        "endpoints": {},
+    }
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://benchmark", headers={server.USER_ID_HEADER: USER_ID}, timeout=None
+    ) as http:
+        for name, path, params, unsupported_by_mongomock in ENDPOINTS:
+            if wanted and name not in wanted:
+                continue
+            if unsupported_by_mongomock and backend == "mongomock":
+                results["endpoints"][name] = {"skipped": "needs a real mongod"}
+                continue
+            await http.get(path, params=params)  # Warm up
+            results["endpoints"][name] = await drive(http, path, params, args)
+    results["pool"] = server.pool_snapshot()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    for address, pool in results["pool"].items():
+        waited = pool["checkout_wait_seconds"] / pool["checkouts"] * 1000 if pool["checkouts"] else 0
+        print(
+            f"\nPool {address}: {pool['created']:.0f} connections opened, {pool['closed']:.0f} closed, "
+            f"{pool['checkout_failures']:.0f} failed check-outs, {waited:.2f} ms mean check-out wait"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    server.close_storage()
+    failed = any(
+        not status.startswith("2")
+        for stats in results["endpoints"].values()
+        for status in stats.get("statuses", {})
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args(sys.argv[1:]))))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Compare per-row cost of the model-validated and trusted-document list paths.
+
+    python backend/benchmark_serialization.py [rows ...]
+
+The validated path is what list endpoints did before: build a model per
+stored document, then let FastAPI validate and encode the response_model
+again. The trusted path projects documents to the model's fields and encodes
+them with orjson; the sparse path does the same for `fields=name,amount,date`.
+No database is needed; documents are generated in memory.
+
+The two changes are timed apart. "validated projected" runs the old
+validation on the trusted path's projected documents, so `validation` is
+the gain from skipping models on identical input, and `projection` is what
+dropping the stored-only fields (user_id, search_terms, _id) saves the old path.
+"""
+
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from server import (
+    Expense, ExpenseCategory, ExpenseCreate, expense_document, new_expense, select_fields, trusted_documents,
+)
+
+DEFAULT_ROWS = [1000, 10000, 100000]
+REPEATS = 3
+SPARSE_FIELDS = "name,amount,date"
+
+
+def generate_documents(count: int) -> List[dict]:
+    now = datetime.utcnow().replace(microsecond=0)
+    categories = [category.value for category in ExpenseCategory]
+    docs = []
+    for i in range(count):
+        expense = new_expense(
+            ExpenseCreate(
+                name=f"Expense {i}",
+                amount=round(random.uniform(1, 5000), 2),
+                category=random.choice(categories),
+                tags=["bench"] if i % 3 == 0 else [],
+                notes="Generated" if i % 5 == 0 else None,
+                date=now - timedelta(days=random.randint(0, 3650)),
+            ),
+            id=str(uuid.uuid4()),
+        )
+        doc = expense_document(expense, "benchmark")
+        doc["_id"] = i
+        docs.append(doc)
+    return docs
+
+
+async def validated_body(docs: List[dict], field) -> bytes:
+    content = await serialize_response(field=field, response_content=[Expense(**doc) for doc in docs])
+    return JSONResponse(content).body
+
+
+def trusted_body(docs: List[dict], fields: Optional[List[str]] = None) -> bytes:
+    return ORJSONResponse(trusted_documents(Expense, docs, fields)).body
+
+
+def best_of(run) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main(sizes: List[int]) -> int:
+    field = create_response_field(name="Response_get_expenses", type_=List[Expense])
+    loop = asyncio.new_event_loop()
+
+    sparse_fields = select_fields(Expense, SPARSE_FIELDS)
+
+    print(
+        f"{'rows':>8} {'validated µs/row':>17} {'validated projected':>20} {'trusted µs/row':>15}"
+        f" {'projection':>11} {'validation':>11} {'total':>7}"
+        f" {'sparse µs/row':>14} {'bytes/row':>10} {'sparse bytes/row':>17}"
+    )
+    for rows in sizes:
+        docs = generate_documents(rows)
+        # Projected documents have no _id or search_terms, as fetch_page returns them
+        projected = [{key: value for key, value in doc.items() if key in Expense.model_fields} for doc in docs]
+
+        if json.loads(loop.run_until_complete(validated_body(projected, field))) != json.loads(trusted_body(projected)):
+            print("❌ Trusted and validated responses differ")
+            return 1
+
+        sparse_docs = [{key: doc[key] for key in sparse_fields} for doc in docs]
+
+        validated = best_of(lambda: loop.run_until_complete(validated_body(docs, field)))
+        validated_projected = best_of(lambda: loop.run_until_complete(validated_body(projected, field)))
+        trusted = best_of(lambda: trusted_body(projected))
+        sparse = best_of(lambda: trusted_body(sparse_docs, sparse_fields))
+        print(
+            f"{rows:>8} {validated / rows * 1e6:>17.2f} {validated_projected / rows * 1e6:>20.2f}"
+            f" {trusted / rows * 1e6:>15.2f} {validated / validated_projected:>10.1f}x"
+            f" {validated_projected / trusted:>10.1f}x {validated / trusted:>6.1f}x"
+            f" {sparse / rows * 1e6:>14.2f} {len(trusted_body(projected)) / rows:>10.0f}"
+            f" {len(trusted_body(sparse_docs, sparse_fields)) / rows:>17.0f}"
+        )
+
+    loop.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main([int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS))
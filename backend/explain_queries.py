@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Print the explain() plan for every query shape server.py issues.
+
+Exits non-zero if any of them falls back to a COLLSCAN, so CI can run:
+
+    python backend/explain_queries.py [--reconcile]
+"""
+
+import asyncio
+import sys
+
+from server import close_mongo, explain_queries, open_mongo, reconcile_indexes
+
+
+async def main(reconcile: bool) -> int:
+    db = open_mongo()
+    if reconcile:
+        await reconcile_indexes(db)
+
+    plans = await explain_queries(db)
+    for plan in plans:
+        marker = "❌" if plan["collscan"] else "✅"
+        print(f"{marker} {plan['name']:<32} {plan['collection']:<14} {' -> '.join(plan['stages'])}")
+
+    collscans = [plan["name"] for plan in plans if plan["collscan"]]
+    if collscans:
+        print(f"\nCOLLSCAN detected in: {', '.join(collscans)}")
+        return 1
+    print("\nNo collection scans")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(asyncio.run(main("--reconcile" in sys.argv[1:])))
+    finally:
+        close_mongo()
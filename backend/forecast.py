@@ -0,0 +1,150 @@
+"""
+Vectorised recurrence expansion and cash-flow projection.
+
+Recurring items are expanded with numpy datetime64 arithmetic instead of
+stepping one relativedelta at a time. Month-based steps clamp to month end
+the same way repeated `relativedelta(months=...)` does: once a date has been
+clamped (Jan 31 -> Feb 28) later occurrences keep the clamped day, which is
+a running minimum over the days-in-month of every step so far.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Frequency -> step in calendar months
+MONTH_STEPS = {"monthly": 1, "yearly": 12}
+# Frequency -> step in days
+DAY_STEPS = {"weekly": 7}
+
+
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def to_day_numbers(values: Sequence[datetime]) -> np.ndarray:
+    """Days since 1970-01-01; much cheaper than letting numpy parse datetime objects."""
+    if isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.datetime64):
+        return values.astype("datetime64[D]").astype(np.int64)
+    return np.fromiter((value.toordinal() for value in values), dtype=np.int64, count=len(values)) - EPOCH_ORDINAL
+
+
+def factorize(values: Sequence[str]) -> Tuple[np.ndarray, List[str]]:
+    """Integer codes for string labels; a dict pass beats numpy string comparisons."""
+    lookup: Dict[str, int] = {}
+    codes = np.fromiter(
+        (lookup.setdefault(value, len(lookup)) for value in values), dtype=np.int64, count=len(values)
+    )
+    return codes, list(lookup)
+
+
+def _expand_month_steps(anchors: np.ndarray, step: int, end: int) -> np.ndarray:
+    """Occurrence grid (items x steps), in day numbers, for anchors repeating every `step` months."""
+    anchor_months = anchors.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    first_month = anchor_months.min()
+    end_month = np.int64(end).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    offsets = np.arange((end_month - first_month) // step + 2) * step
+
+    # Calendar lookups happen once per month in range, not once per grid cell
+    table = np.arange(first_month, anchor_months.max() + offsets[-1] + 2).astype("datetime64[M]")
+    table_starts = table.astype("datetime64[D]").astype(np.int64)
+    days_in_month = np.diff(table_starts)
+
+    anchor_days = anchors - table_starts[anchor_months - first_month] + 1
+    month_index = (anchor_months - first_month)[:, None] + offsets[None, :]
+    days = np.minimum.accumulate(np.minimum(days_in_month[month_index], anchor_days[:, None]), axis=1)
+    return table_starts[month_index] + days - 1
+
+
+def _expand_day_steps(anchors: np.ndarray, step: int, end: int) -> np.ndarray:
+    offsets = np.arange((end - anchors.min()) // step + 2) * step
+    return anchors[:, None] + offsets[None, :]
+
+
+def expand_recurrences(
+    anchors: Sequence[datetime],
+    frequencies: Sequence[str],
+    start: datetime,
+    end: datetime,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """All occurrences in [start, end) of items first due on `anchors`.
+
+    Returns (item index, occurrence date as datetime64[D]) arrays of equal length.
+    """
+    anchor_days = to_day_numbers(anchors)
+    frequency_codes, frequency_names = factorize(frequencies)
+    start_day, end_day = to_day_numbers([start, end])
+
+    item_indexes = [np.empty(0, dtype=np.int64)]
+    dates = [np.empty(0, dtype=np.int64)]
+    for code, frequency in enumerate(frequency_names):
+        indexes = np.nonzero(frequency_codes == code)[0]
+        if frequency in MONTH_STEPS:
+            grid = _expand_month_steps(anchor_days[indexes], MONTH_STEPS[frequency], end_day)
+        elif frequency in DAY_STEPS:
+            grid = _expand_day_steps(anchor_days[indexes], DAY_STEPS[frequency], end_day)
+        else:
+            raise ValueError(f"Unknown frequency '{frequency}'")
+        rows, cols = np.nonzero((grid >= start_day) & (grid < end_day))
+        item_indexes.append(indexes[rows])
+        dates.append(grid[rows, cols])
+    return np.concatenate(item_indexes), np.concatenate(dates).view("datetime64[D]")
+
+
+def project_cash_flow(
+    anchors: Sequence[datetime],
+    frequencies: Sequence[str],
+    amounts: Sequence[float],
+    categories: Sequence[str],
+    is_subscription: Sequence[bool],
+    start: datetime,
+    months: int,
+) -> Dict[str, Any]:
+    """Projected spend per calendar month and category from `start` for `months` months.
+
+    The first month only counts occurrences on or after `start`.
+    """
+    first_month = np.datetime64(start, "M")
+    end = (first_month + np.timedelta64(months, "M")).astype("datetime64[D]").astype(datetime)
+    item_index, dates = expand_recurrences(anchors, frequencies, start, end)
+
+    category_codes, category_names = factorize(categories)
+    n_categories = max(len(category_names), 1)
+    weights = np.asarray(amounts, dtype=np.float64)[item_index] if len(item_index) else np.empty(0)
+    month_starts = (first_month + np.arange(months + 1)).astype("datetime64[D]").astype(np.int64)
+    month_index = np.searchsorted(month_starts, dates.view(np.int64), side="right") - 1
+
+    by_category = np.bincount(
+        month_index * n_categories + category_codes[item_index] if len(item_index) else np.empty(0, dtype=np.int64),
+        weights=weights,
+        minlength=months * n_categories,
+    ).reshape(months, n_categories)
+    subscription_flags = np.asarray(is_subscription, dtype=bool)[item_index] if len(item_index) else np.empty(0, dtype=bool)
+    subscription_totals = np.bincount(
+        month_index[subscription_flags], weights=weights[subscription_flags], minlength=months
+    )
+    totals = by_category.sum(axis=1)
+
+    result_months: List[Dict[str, Any]] = []
+    for i in range(months):
+        month = (first_month + np.timedelta64(i, "M")).astype(datetime)
+        result_months.append({
+            "month": month.strftime("%Y-%m"),
+            "label": month.strftime("%b %Y"),
+            "subscription_spending": float(subscription_totals[i]),
+            "expense_spending": float(totals[i] - subscription_totals[i]),
+            "total_spending": float(totals[i]),
+            "category_breakdown": {
+                str(name): float(by_category[i, j])
+                for j, name in enumerate(category_names) if by_category[i, j]
+            },
+        })
+
+    category_totals = by_category.sum(axis=0)
+    return {
+        "months": result_months,
+        "category_totals": {
+            str(name): float(category_totals[j]) for j, name in enumerate(category_names) if category_totals[j]
+        },
+        "total_spending": float(totals.sum()),
+    }
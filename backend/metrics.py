@@ -0,0 +1,312 @@
+"""
+Request and database metrics, exposed in Prometheus text format.
+
+The HTTP middleware in server.py opens a RequestStats for each request and
+publishes it through `current_request`. Motor runs pymongo calls on executor
+threads with the caller's context copied, so CommandMetrics (a pymongo
+CommandListener) can charge each command's time and documents to the request
+that issued it. Commands issued outside a request, such as those from the
+recurrence scheduler, are labelled route="background".
+
+PoolMetrics (a ConnectionPoolListener) tracks each server's connection pool:
+open and checked-out connections, connection churn, and how long requests
+waited to check a connection out.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+BACKGROUND_ROUTE = "background"
+
+_lock = threading.Lock()
+
+
+class RequestStats:
+    """Database work attributed to one request."""
+
+    __slots__ = ("route", "db_seconds", "db_commands", "db_documents")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.db_seconds = 0.0
+        self.db_commands = 0
+        self.db_documents = 0
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1.0) -> None:
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with _lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (last is +Inf), sum]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with _lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self.series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.label_names, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str):
+        self.request_seconds = Histogram(
+            f"{prefix}_http_request_duration_seconds", "Time until the response headers were sent.",
+            ("method", "route", "status"), LATENCY_BUCKETS,
+        )
+        self.response_bytes = Histogram(
+            f"{prefix}_http_response_size_bytes", "Response body size.",
+            ("method", "route"), SIZE_BUCKETS,
+        )
+        self.request_db_seconds = Histogram(
+            f"{prefix}_http_request_db_seconds", "MongoDB command time per request.",
+            ("method", "route"), LATENCY_BUCKETS,
+        )
+        self.mongo_commands = Counter(
+            f"{prefix}_mongo_commands_total", "MongoDB commands completed.", ("route", "command"),
+        )
+        self.mongo_failures = Counter(
+            f"{prefix}_mongo_command_failures_total", "MongoDB commands that failed.", ("route", "command"),
+        )
+        self.mongo_seconds = Counter(
+            f"{prefix}_mongo_command_seconds_total", "Time spent in MongoDB commands.", ("route", "command"),
+        )
+        self.mongo_documents = Counter(
+            f"{prefix}_mongo_documents_total", "Documents returned or written by MongoDB commands.",
+            ("route", "command"),
+        )
+
+        self.pool_connections = Gauge(
+            f"{prefix}_mongo_pool_connections", "Open connections in the pool.", ("address",),
+        )
+        self.pool_connections_in_use = Gauge(
+            f"{prefix}_mongo_pool_connections_in_use", "Connections checked out of the pool.", ("address",),
+        )
+        self.pool_connections_created = Counter(
+            f"{prefix}_mongo_pool_connections_created_total", "Connections opened.", ("address",),
+        )
+        self.pool_connections_closed = Counter(
+            f"{prefix}_mongo_pool_connections_closed_total", "Connections closed.", ("address", "reason"),
+        )
+        self.pool_checkout_seconds = Histogram(
+            f"{prefix}_mongo_pool_checkout_wait_seconds", "Time spent waiting to check out a connection.",
+            ("address",), LATENCY_BUCKETS,
+        )
+        self.pool_checkout_failures = Counter(
+            f"{prefix}_mongo_pool_checkout_failures_total", "Connection check-outs that failed.",
+            ("address", "reason"),
+        )
+        self.pool_cleared = Counter(
+            f"{prefix}_mongo_pool_cleared_total", "Times the pool was cleared after a server error.", ("address",),
+        )
+
+    def observe_request(self, method: str, status: int, seconds: float, size: int, stats: RequestStats) -> None:
+        self.request_seconds.observe((method, stats.route, str(status)), seconds)
+        self.response_bytes.observe((method, stats.route), size)
+        self.request_db_seconds.observe((method, stats.route), stats.db_seconds)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (
+            self.request_seconds, self.response_bytes, self.request_db_seconds,
+            self.mongo_commands, self.mongo_failures, self.mongo_seconds, self.mongo_documents,
+            self.pool_connections, self.pool_connections_in_use, self.pool_connections_created,
+            self.pool_connections_closed, self.pool_checkout_seconds, self.pool_checkout_failures,
+            self.pool_cleared,
+        ):
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry("nbntracker")
+
+
+def _reply_documents(reply) -> int:
+    """Documents a command returned (cursor batches) or wrote (`n`)."""
+    cursor = reply.get("cursor")
+    if cursor:
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    return int(reply.get("n", 0) or 0)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        stats = current_request.get()
+        seconds = event.duration_micros / 1e6
+        documents = _reply_documents(event.reply)
+        if stats is not None:
+            stats.db_seconds += seconds
+            stats.db_commands += 1
+            stats.db_documents += documents
+        labels = (stats.route if stats else BACKGROUND_ROUTE, event.command_name)
+        registry.mongo_commands.inc(labels)
+        registry.mongo_seconds.inc(labels, seconds)
+        registry.mongo_documents.inc(labels, documents)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        stats = current_request.get()
+        seconds = event.duration_micros / 1e6
+        if stats is not None:
+            stats.db_seconds += seconds
+            stats.db_commands += 1
+        labels = (stats.route if stats else BACKGROUND_ROUTE, event.command_name)
+        registry.mongo_failures.inc(labels)
+        registry.mongo_seconds.inc(labels, seconds)
+
+
+def _address(address) -> str:
+    host, port = address
+    return f"{host}:{port}"
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool gauges and check-out wait times, per server address.
+
+    A check-out starts and finishes on the same driver thread, so the start
+    time is kept in a thread local.
+    """
+
+    def __init__(self):
+        self._checkout = threading.local()
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        pass
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        registry.pool_cleared.inc((_address(event.address),))
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        pass
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        registry.pool_connections_created.inc((_address(event.address),))
+        registry.pool_connections.inc((_address(event.address),))
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        registry.pool_connections_closed.inc((_address(event.address), event.reason))
+        registry.pool_connections.inc((_address(event.address),), -1)
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None:
+        self._checkout.started = time.perf_counter()
+
+    def _waited(self, address: str) -> None:
+        started = getattr(self._checkout, "started", None)
+        if started is not None:
+            registry.pool_checkout_seconds.observe((address,), time.perf_counter() - started)
+            self._checkout.started = None
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        self._waited(_address(event.address))
+        registry.pool_checkout_failures.inc((_address(event.address), event.reason))
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        self._waited(_address(event.address))
+        registry.pool_connections_in_use.inc((_address(event.address),))
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        registry.pool_connections_in_use.inc((_address(event.address),), -1)
+
+
+def pool_snapshot() -> Dict[str, Dict[str, float]]:
+    """Current pool figures per server address, for the debug endpoint."""
+    pools: Dict[str, Dict[str, float]] = {}
+
+    def add(address: str, key: str, value: float) -> None:
+        pool = pools.setdefault(address, {
+            "connections": 0, "in_use": 0, "created": 0, "closed": 0, "checkouts": 0,
+            "checkout_wait_seconds": 0.0, "checkout_failures": 0, "cleared": 0,
+        })
+        pool[key] += value
+
+    with _lock:
+        for key, metric in (
+            ("connections", registry.pool_connections), ("in_use", registry.pool_connections_in_use),
+            ("created", registry.pool_connections_created), ("closed", registry.pool_connections_closed),
+            ("checkout_failures", registry.pool_checkout_failures), ("cleared", registry.pool_cleared),
+        ):
+            for labels, value in metric.values.items():
+                add(labels[0], key, value)
+        for (address,), (counts, total) in registry.pool_checkout_seconds.series.items():
+            add(address, "checkouts", sum(counts))
+            add(address, "checkout_wait_seconds", total)
+    return pools
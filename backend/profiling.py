@@ -0,0 +1,138 @@
+"""
+Opt-in request profiling.
+
+Two capture modes, both off unless configured:
+
+* A StackSampler thread samples the event loop thread's stack every few
+  milliseconds into a short ring buffer. When a request takes longer than the
+  slow threshold, the samples taken during it are summarised into hot frames.
+  Sampling costs little, so every request can be watched.
+* A request carrying the admin token is wrapped in cProfile for exact call
+  counts and times.
+
+Both observe the event loop thread as a whole, so work from concurrent
+requests interleaved on the loop shows up in the same profile.
+"""
+
+import cProfile
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+Frame = Tuple[str, int, str]  # file, line, function
+Sample = Tuple[float, Tuple[Frame, ...]]  # monotonic time, stack from leaf to root
+
+MAX_STACK_DEPTH = 64
+
+
+class StackSampler:
+    """Background thread sampling one thread's stack at a fixed interval."""
+
+    def __init__(self, interval: float, retention: float = 60.0):
+        self.interval = interval
+        self.samples: Deque[Sample] = deque(maxlen=max(int(retention / interval), 1))
+        self.target_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, target_thread: int) -> None:
+        self.target_thread = target_thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append((code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+            self.samples.append((time.monotonic(), tuple(stack)))
+
+    def samples_between(self, start: float, end: float) -> List[Tuple[Frame, ...]]:
+        return [stack for taken_at, stack in list(self.samples) if start <= taken_at <= end]
+
+
+def summarize_samples(stacks: List[Tuple[Frame, ...]], top_n: int) -> List[Dict[str, Any]]:
+    """Hot functions by self samples (on top of the stack), with inclusive counts."""
+    self_counts: Dict[Tuple[str, str], int] = {}
+    total_counts: Dict[Tuple[str, str], int] = {}
+    for stack in stacks:
+        if not stack:
+            continue
+        leaf = (stack[0][0], stack[0][2])
+        self_counts[leaf] = self_counts.get(leaf, 0) + 1
+        for key in {(filename, function) for filename, _, function in stack}:
+            total_counts[key] = total_counts.get(key, 0) + 1
+
+    rows = [
+        {
+            "file": filename,
+            "function": function,
+            "self_samples": self_counts.get((filename, function), 0),
+            "total_samples": total,
+            "self_percent": round(self_counts.get((filename, function), 0) * 100 / len(stacks), 1),
+        }
+        for (filename, function), total in total_counts.items()
+    ]
+    rows.sort(key=lambda row: (row["self_samples"], row["total_samples"]), reverse=True)
+    return rows[:top_n]
+
+
+def summarize_cprofile(profile: cProfile.Profile, top_n: int) -> List[Dict[str, Any]]:
+    """Hot functions by own time, as pstats reports them."""
+    stats = pstats.Stats(profile)
+    rows = [
+        {
+            "file": filename,
+            "line": line,
+            "function": function,
+            "calls": calls,
+            "self_seconds": round(self_time, 6),
+            "cumulative_seconds": round(cumulative, 6),
+        }
+        for (filename, line, function), (_, calls, self_time, cumulative, _) in stats.stats.items()
+    ]
+    rows.sort(key=lambda row: row["self_seconds"], reverse=True)
+    return rows[:top_n]
+
+
+class ProfileStore:
+    """The most recent captured profiles, newest first."""
+
+    def __init__(self, max_profiles: int):
+        self.profiles: Deque[Dict[str, Any]] = deque(maxlen=max_profiles)
+
+    def add(self, method: str, path: str, status: int, seconds: float, mode: str,
+            frames: List[Dict[str, Any]], samples: Optional[int] = None) -> Dict[str, Any]:
+        profile = {
+            "id": str(uuid.uuid4()),
+            "captured_at": datetime.utcnow().isoformat(),
+            "method": method,
+            "path": path,
+            "status": status,
+            "duration_ms": round(seconds * 1000, 1),
+            "mode": mode,
+            "samples": samples,
+            "frames": frames,
+        }
+        self.profiles.appendleft(profile)
+        return profile
+
+    def list(self) -> List[Dict[str, Any]]:
+        return list(self.profiles)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Rebuild or verify the monthly_rollups collection against raw expenses.
+
+    python backend/rollups.py verify    # exits non-zero on drift
+    python backend/rollups.py rebuild
+"""
+
+import asyncio
+import sys
+
+from server import close_mongo, open_mongo, rebuild_rollups, verify_rollups
+
+
+async def main(command: str) -> int:
+    db = open_mongo()
+    if command == "rebuild":
+        rows = await rebuild_rollups(db)
+        print(f"✅ Rebuilt monthly_rollups: {rows} (user, month, category) rows")
+        return 0
+
+    if command == "verify":
+        mismatches = await verify_rollups(db)
+        for row in mismatches:
+            print(
+                f"❌ {row['user_id']} {row['month']} {row['category']:<16} "
+                f"total {row['actual_total']:,.2f} (expected {row['expected_total']:,.2f}), "
+                f"count {row['actual_count']} (expected {row['expected_count']})"
+            )
+        if mismatches:
+            print(f"\n{len(mismatches)} rollup rows out of date; run 'rebuild' to fix")
+            return 1
+        print("✅ monthly_rollups matches expenses")
+        return 0
+
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "")))
+    finally:
+        close_mongo()
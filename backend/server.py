@@ -1,28 +1,279 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, DeleteOne, IndexModel, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError, create_model
+from typing import List, Optional, Dict, Any, Iterable, Tuple, Type, Union
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
+from forecast import project_cash_flow
+from analytics import ExpenseColumns, UserExpenseColumns, month_number
+from metrics import CommandMetrics, PoolMetrics, RequestStats, current_request, pool_snapshot, registry as metrics_registry
+from profiling import ProfileStore, StackSampler, summarize_cprofile, summarize_samples
+from sqlite_store import (
+    TEXT, Expression, SQLiteStore, Table, and_where, column_kind, delete_rows, insert_row, query_plan,
+    select_documents, to_sql, transaction, update_rows, where_clause,
+)
 from enum import Enum
 import json
+import hashlib
+import base64
+import re
+import shlex
+import sys
+import csv
+import io
+import tempfile
+import asyncio
+import bisect
+import time
+import threading
+import cProfile
+import sqlite3
+from abc import ABC, abstractmethod
+from secrets import compare_digest
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection. The client is opened and closed by the app's lifespan;
+# pool size, timeouts and write concern come from the MONGO_* variables
+# below, and anything unset falls back to MONGO_URL's options and the driver
+# defaults. Neither is needed with STORAGE_BACKEND=sqlite (see Storage backends).
+mongo_url = os.environ.get('MONGO_URL')
+DB_NAME = os.environ.get('DB_NAME')
+
+MONGO_CLIENT_OPTIONS = {  # env var -> (client option, parser)
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),  # Kept open and warm, so bursts do not pay for new connections
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_MAX_CONNECTING": ("maxConnecting", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),  # Fail instead of queueing for a connection forever
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_TIMEOUT_MS": ("timeoutMS", int),  # Overall budget per operation
+    "MONGO_WRITE_CONCERN": ("w", lambda value: int(value) if value.isdigit() else value),
+    "MONGO_WRITE_JOURNAL": ("journal", lambda value: value.lower() in ("1", "true", "yes")),
+    "MONGO_WRITE_TIMEOUT_MS": ("wTimeoutMS", int),
+}
+
+READ_PREFERENCE_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+def mongo_client_options() -> Dict[str, Any]:
+    return {
+        option: parse(os.environ[name])
+        for name, (option, parse) in MONGO_CLIENT_OPTIONS.items()
+        if os.environ.get(name)
+    }
+
+def analytics_read_preference():
+    """Read preference for the analytics endpoints (dashboard, trends, forecast, suggestions).
+
+    They read the primary by default, so a write is reflected in the next
+    response. Setting MONGO_ANALYTICS_READ_PREFERENCE to a secondary mode
+    (e.g. "secondaryPreferred") takes aggregation load off the primary, but
+    results may then trail recent writes by the replication lag, bounded by
+    MONGO_ANALYTICS_MAX_STALENESS_SECONDS if set. The response cache and
+    ETags are invalidated when the write happens, so a lagging read taken
+    just after it is cached and served until the next write or the TTL.
+    """
+    mode = os.environ.get("MONGO_ANALYTICS_READ_PREFERENCE", "primary")
+    if mode == "primary":
+        return Primary()
+    if mode not in READ_PREFERENCE_MODES:
+        raise ValueError(f"Unknown MONGO_ANALYTICS_READ_PREFERENCE '{mode}'")
+    return READ_PREFERENCE_MODES[mode](max_staleness=int(os.environ.get("MONGO_ANALYTICS_MAX_STALENESS_SECONDS", "-1")))
+
+ANALYTICS_READ_PREFERENCE = analytics_read_preference()
+pool_metrics = PoolMetrics()
+client = None
+db = None  # Reads and writes on the primary
+analytics_db = None  # The same database, read with ANALYTICS_READ_PREFERENCE
+storage = None  # What the endpoints read and write through; see Storage backends
+
+def install_client(new_client, db_name: str = DB_NAME):
+    """Point the module's databases and storage at `new_client`; returns the primary database."""
+    global client, db, analytics_db, storage
+    client = new_client
+    db = client[db_name]
+    analytics_db = client.get_database(db_name, read_preference=ANALYTICS_READ_PREFERENCE)
+    storage = MongoStorage(db, analytics_db)
+    return db
+
+def open_mongo():
+    """Create the client unless one is already installed; returns the primary database."""
+    if client is None:
+        if not mongo_url or not DB_NAME:
+            raise RuntimeError("MONGO_URL and DB_NAME must be set unless STORAGE_BACKEND=sqlite")
+        install_client(AsyncIOMotorClient(
+            mongo_url, event_listeners=[CommandMetrics(), pool_metrics], **mongo_client_options()
+        ))
+    return db
+
+def close_mongo() -> None:
+    global client, db, analytics_db, storage
+    if client is not None:
+        client.close()
+    client = db = analytics_db = storage = None
+
+# Indexes backing every query shape issued below, reconciled at startup. Per-user
+# queries lead on user_id so each one only walks that user's slice of the index;
+# the recurrence scheduler works across users and keeps its own global indexes.
+INDEX_SPECS = {
+    "subscriptions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("next_due_date", ASCENDING), ("id", ASCENDING)],
+            name="user_id_next_due_date_id",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("is_active", ASCENDING), ("next_due_date", ASCENDING), ("id", ASCENDING)],
+            name="user_id_is_active_next_due_date_id",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("is_active", ASCENDING), ("category", ASCENDING),
+             ("next_due_date", ASCENDING), ("id", ASCENDING)],
+            name="user_id_is_active_category_next_due_date_id",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("is_active", ASCENDING), ("cost", ASCENDING), ("id", ASCENDING)],
+            name="user_id_is_active_cost_id",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("is_active", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)],
+            name="user_id_is_active_name_id",
+        ),
+        IndexModel([("user_id", ASCENDING), ("search_terms", ASCENDING)], name="user_id_search_terms"),
+        IndexModel([("user_id", ASCENDING), ("cancelled_at", ASCENDING)], name="user_id_cancelled_at"),
+        IndexModel(
+            [("is_active", ASCENDING), ("next_due_date", ASCENDING), ("id", ASCENDING)],
+            name="is_active_next_due_date_id",
+        ),
+    ],
+    "expenses": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)],
+            name="user_id_date_id",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("category", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)],
+            name="user_id_category_date_id",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("is_recurring", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)],
+            name="user_id_is_recurring_date_id",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("is_recurring", ASCENDING), ("next_due_date", ASCENDING)],
+            name="user_id_is_recurring_next_due_date",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("amount", DESCENDING), ("id", DESCENDING)],
+            name="user_id_amount_id",
+        ),
+        IndexModel([("user_id", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)], name="user_id_name_id"),
+        IndexModel([("user_id", ASCENDING), ("search_terms", ASCENDING)], name="user_id_search_terms"),
+        IndexModel(
+            [("is_recurring", ASCENDING), ("next_due_date", ASCENDING)],
+            name="is_recurring_next_due_date",
+        ),
+    ],
+    "budgets": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("type", ASCENDING), ("category", ASCENDING)],
+            name="user_id_type_category",
+        ),
+    ],
+    "monthly_rollups": [
+        IndexModel(
+            [("user_id", ASCENDING), ("month", ASCENDING), ("category", ASCENDING)],
+            name="user_id_month_category", unique=True,
+        ),
+    ],
+}
+
+# Indexes from before per-user scoping, dropped once their replacements exist.
+# month_category must go: it is unique across users.
+RETIRED_INDEXES = {
+    "subscriptions": [
+        "next_due_date_id", "is_active_category_next_due_date_id", "is_active_cost_id", "is_active_name_id",
+        "search_terms", "cancelled_at",
+    ],
+    "expenses": ["date_id", "category_date_id", "is_recurring_date_id", "amount_id", "name_id", "search_terms"],
+    "budgets": ["type_category"],
+    "monthly_rollups": ["month_category"],
+}
+
+def _normalize_index_key(key) -> List[Tuple[str, Any]]:
+    items = key.items() if hasattr(key, "items") else key
+    return [(field, int(kind) if isinstance(kind, (int, float)) else kind) for field, kind in items]
+
+def _index_matches(existing: Dict[str, Any], spec: IndexModel) -> bool:
+    wanted = spec.document
+    return (
+        _normalize_index_key(existing["key"]) == _normalize_index_key(wanted["key"])
+        and bool(existing.get("unique")) == bool(wanted.get("unique"))
+    )
+
+async def reconcile_indexes(database) -> Dict[str, List[str]]:
+    """Create missing indexes, rebuild ones whose definition drifted and drop retired ones.
+
+    Indexes listed in neither INDEX_SPECS nor RETIRED_INDEXES are left
+    untouched, so running this repeatedly is a no-op once the collections are
+    in shape.
+    """
+    changed = {}
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = database[collection_name]
+        existing = await collection.index_information()
+        to_create = []
+        for spec in specs:
+            name = spec.document["name"]
+            current = existing.get(name)
+            if current and _index_matches(current, spec):
+                continue
+            if current:
+                await collection.drop_index(name)
+            to_create.append(spec)
+        if to_create:
+            await collection.create_indexes(to_create)
+            changed[collection_name] = [spec.document["name"] for spec in to_create]
+        for name in RETIRED_INDEXES.get(collection_name, []):
+            if name in existing:
+                await collection.drop_index(name)
+                changed.setdefault(collection_name, []).append(f"{name} (dropped)")
+    return changed
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # start_app and stop_app are defined at the end of this module
+    await start_app(app)
+    try:
+        yield
+    finally:
+        await stop_app(app)
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -61,6 +312,31 @@ class RecurringExpenseFrequency(str, Enum):
     MONTHLY = "monthly"
     YEARLY = "yearly"
 
+class TrendGranularity(str, Enum):
+    DAILY = "daily"
+    WEEKLY = "weekly"
+    MONTHLY = "monthly"
+
+class SortOrder(str, Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+class SubscriptionSortField(str, Enum):
+    NEXT_DUE_DATE = "next_due_date"
+    COST = "cost"
+    MONTHLY_COST = "monthly_cost"  # Computed, see MONTHLY_COST_EXPR
+    NAME = "name"
+
+class ExpenseSortField(str, Enum):
+    DATE = "date"
+    AMOUNT = "amount"
+    NAME = "name"
+
+class DataFormat(str, Enum):
+    JSON = "json"
+    NDJSON = "ndjson"
+    CSV = "csv"
+
 # Models
 class Subscription(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -70,6 +346,8 @@ class Subscription(BaseModel):
     next_due_date: datetime
     category: SubscriptionCategory
     is_active: bool = True
+    cancelled_at: Optional[datetime] = None  # Set when deactivated, for trend history
+    version: int = 1  # Bumped on every update for optimistic concurrency
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class SubscriptionCreate(BaseModel):
@@ -86,6 +364,7 @@ class SubscriptionUpdate(BaseModel):
     next_due_date: Optional[datetime] = None
     category: Optional[SubscriptionCategory] = None
     is_active: Optional[bool] = None
+    version: Optional[int] = None  # Expected current version; 409 if it changed
 
 class Expense(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -98,6 +377,8 @@ class Expense(BaseModel):
     is_recurring: bool = False
     recurring_frequency: Optional[RecurringExpenseFrequency] = None
     next_due_date: Optional[datetime] = None
+    recurrence_of: Optional[str] = None  # Id of the recurring expense this occurrence came from
+    version: int = 1
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ExpenseCreate(BaseModel):
@@ -119,6 +400,7 @@ class ExpenseUpdate(BaseModel):
     date: Optional[datetime] = None
     is_recurring: Optional[bool] = None
     recurring_frequency: Optional[RecurringExpenseFrequency] = None
+    version: Optional[int] = None
 
 class Budget(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -126,6 +408,7 @@ class Budget(BaseModel):
     amount: float
     category: Optional[str] = None  # Only for category budgets
     period: str = "monthly"  # monthly, yearly
+    version: int = 1
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class BudgetCreate(BaseModel):
@@ -137,6 +420,18 @@ class BudgetCreate(BaseModel):
 class BudgetUpdate(BaseModel):
     amount: Optional[float] = None
     period: Optional[str] = None
+    version: Optional[int] = None
+
+def partial_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    """`model` with every field optional, for list responses trimmed with `fields=`."""
+    return create_model(
+        f"Partial{model.__name__}",
+        **{name: (Optional[field.annotation], None) for name, field in model.model_fields.items()},
+    )
+
+PartialSubscription = partial_model(Subscription)
+PartialExpense = partial_model(Expense)
+PartialBudget = partial_model(Budget)
 
 class SpendingTrend(BaseModel):
     month: str
@@ -157,6 +452,19 @@ class DashboardStats(BaseModel):
     savings_this_month: float
     spending_trends: List[SpendingTrend]
 
+class ForecastMonth(BaseModel):
+    month: str
+    label: str
+    subscription_spending: float
+    expense_spending: float
+    total_spending: float
+    category_breakdown: Dict[str, float]
+
+class Forecast(BaseModel):
+    months: List[ForecastMonth]
+    category_totals: Dict[str, float]
+    total_spending: float
+
 class ExportData(BaseModel):
     subscriptions: List[Subscription]
     expenses: List[Expense]
@@ -164,6 +472,43 @@ class ExportData(BaseModel):
     export_date: datetime
     total_records: int
 
+class BatchOperationType(str, Enum):
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+
+class BatchOperation(BaseModel):
+    op: BatchOperationType
+    id: Optional[str] = None  # Required for update and delete
+    data: Optional[Dict[str, Any]] = None  # Create/update payload
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+class BatchItemResult(BaseModel):
+    index: int
+    op: BatchOperationType
+    id: Optional[str] = None
+    status: int
+    error: Optional[str] = None
+
+class BatchResult(BaseModel):
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    failed: int = 0
+    results: List[BatchItemResult] = []
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportResult(BaseModel):
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+
 # Utility functions
 def calculate_next_due_date(last_due: datetime, frequency: BillingFrequency) -> datetime:
     if frequency == BillingFrequency.MONTHLY:
@@ -179,126 +524,1745 @@ def calculate_next_expense_date(last_date: datetime, frequency: RecurringExpense
     else:  # YEARLY
         return last_date + relativedelta(years=1)
 
+# Mongo expression mirroring get_monthly_cost for server-side aggregation
+MONTHLY_COST_EXPR = {
+    "$cond": [
+        {"$eq": ["$billing_frequency", BillingFrequency.YEARLY.value]},
+        {"$divide": ["$cost", 12]},
+        "$cost",
+    ]
+}
+
+# The same in SQL, for STORAGE_BACKEND=sqlite
+MONTHLY_COST_SQL: Expression = (
+    'CASE WHEN "billing_frequency" = ? THEN "cost" / 12.0 ELSE "cost" END', [BillingFrequency.YEARLY.value]
+)
+
 def get_monthly_cost(cost: float, frequency: BillingFrequency) -> float:
     if frequency == BillingFrequency.MONTHLY:
         return cost
     else:  # YEARLY
         return cost / 12
 
-def get_spending_trends(subscriptions: List[Subscription], expenses: List[Expense]) -> List[SpendingTrend]:
-    trends = []
-    now = datetime.utcnow()
+# Spending trends
+MAX_TREND_MONTHS = 120
+TrendBucket = Tuple[str, str, datetime, datetime]  # key, label, start, end (exclusive)
+
+def _field(obj: Any, name: str, default: Any = None) -> Any:
+    return obj.get(name, default) if isinstance(obj, dict) else getattr(obj, name, default)
+
+def trend_bucket_key(date: datetime, granularity: TrendGranularity) -> str:
+    # Must match TREND_KEY_FORMATS so Python and Mongo bucket identically
+    if granularity == TrendGranularity.DAILY:
+        return date.strftime("%Y-%m-%d")
+    if granularity == TrendGranularity.WEEKLY:
+        year, week, _ = date.isocalendar()
+        return f"{year}-W{week:02d}"
+    return date.strftime("%Y-%m")
+
+TREND_KEY_FORMATS = {
+    TrendGranularity.DAILY: "%Y-%m-%d",
+    TrendGranularity.WEEKLY: "%G-W%V",
+    TrendGranularity.MONTHLY: "%Y-%m",
+}
+
+def build_trend_buckets(now: datetime, months: int, granularity: TrendGranularity) -> List[TrendBucket]:
+    """Consecutive buckets covering the last `months` calendar months up to `now`."""
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    window_start = month_start - relativedelta(months=months - 1)
     
-    for i in range(6):  # Last 6 months
-        month_date = now - relativedelta(months=i)
-        month_start = month_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        month_end = month_start + relativedelta(months=1) - timedelta(seconds=1)
-        
-        # Calculate subscription spending (monthly equivalent)
-        subscription_spending = sum(
-            get_monthly_cost(sub.cost, sub.billing_frequency) 
-            for sub in subscriptions if sub.is_active
-        )
+    if granularity == TrendGranularity.MONTHLY:
+        starts = [window_start + relativedelta(months=i) for i in range(months)]
+        return [
+            (trend_bucket_key(start, granularity), start.strftime("%b %Y"), start, start + relativedelta(months=1))
+            for start in starts
+        ]
+    
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == TrendGranularity.WEEKLY:
+        step = timedelta(weeks=1)
+        start = window_start - timedelta(days=window_start.weekday())  # ISO weeks start on Monday
+        label_format = "Week of %d %b %Y"
+    else:
+        step = timedelta(days=1)
+        start = window_start
+        label_format = "%d %b %Y"
+    
+    buckets = []
+    while start <= today:
+        buckets.append((trend_bucket_key(start, granularity), start.strftime(label_format), start, start + step))
+        start += step
+    return buckets
+
+def subscription_bucket_costs(
+    subscriptions, buckets: List[TrendBucket], granularity: TrendGranularity
+) -> List[float]:
+    """Subscription spend per bucket, counting each subscription only while it was active.
+
+    A subscription is active from created_at until cancelled_at. Each one
+    adds its rate to a difference array over the buckets it overlaps, so the
+    cost is O(S log B + B) rather than O(S * B).
+    """
+    if not buckets:
+        return []
+    starts = [bucket[2] for bucket in buckets]
+    window_end = buckets[-1][3]
+    diff = [0.0] * (len(buckets) + 1)
+    
+    for sub in subscriptions:
+        cancelled_at = _field(sub, "cancelled_at")
+        if not _field(sub, "is_active", True) and cancelled_at is None:
+            continue  # Deactivated before cancellation dates were recorded
+        created_at = _field(sub, "created_at") or starts[0]
+        if created_at >= window_end:
+            continue
         
-        # Calculate expense spending for this month
-        expense_spending = sum(
-            exp.amount for exp in expenses 
-            if month_start <= exp.date <= month_end
-        )
+        first = max(bisect.bisect_right(starts, created_at) - 1, 0)
+        last = len(buckets) - 1 if cancelled_at is None else bisect.bisect_right(starts, cancelled_at) - 1
+        if last < first:
+            continue
         
+        rate = get_monthly_cost(_field(sub, "cost"), _field(sub, "billing_frequency"))
+        if granularity != TrendGranularity.MONTHLY:
+            rate = rate * 12 / 365  # Per day
+        diff[first] += rate
+        diff[last + 1] -= rate
+    
+    costs = []
+    running = 0.0
+    for (_, _, start, end), change in zip(buckets, diff):
+        running += change
+        days = 1 if granularity == TrendGranularity.MONTHLY else (end - start).days
+        costs.append(running * days)
+    return costs
+
+def assemble_trends(
+    buckets: List[TrendBucket], expense_by_key: Dict[str, float], subscription_costs: List[float]
+) -> List[SpendingTrend]:
+    trends = []
+    for (key, label, _, _), subscription_spending in zip(buckets, subscription_costs):
+        expense_spending = expense_by_key.get(key, 0)
         trends.append(SpendingTrend(
-            month=month_date.strftime("%b %Y"),
+            month=label,
             subscription_spending=subscription_spending,
             expense_spending=expense_spending,
             total_spending=subscription_spending + expense_spending
         ))
+    return trends
+
+def get_spending_trends(
+    subscriptions: List[Subscription],
+    expenses: List[Expense],
+    months: int = 6,
+    granularity: TrendGranularity = TrendGranularity.MONTHLY,
+    now: Optional[datetime] = None,
+) -> List[SpendingTrend]:
+    """Bucket expenses in a single pass and attribute subscriptions by their active period."""
+    buckets = build_trend_buckets(now or datetime.utcnow(), months, granularity)
+    
+    expense_by_key = {}
+    for exp in expenses:
+        key = trend_bucket_key(_field(exp, "date"), granularity)
+        expense_by_key[key] = expense_by_key.get(key, 0) + _field(exp, "amount")
+    
+    return assemble_trends(
+        buckets, expense_by_key, subscription_bucket_costs(subscriptions, buckets, granularity)
+    )
+
+# Pagination helpers
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = MAX_PAGE_SIZE  # Unparameterised lists return what they did before paging
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+SortSpec = List[Tuple[str, int]]
+MAX_TOP_N = 100
+
+def build_sort(field: str, order: SortOrder) -> SortSpec:
+    """Sort on `field` with `id` as the tie-breaker, both in the same direction.
+
+    Each index backing a sortable field is (field, id), which serves either
+    direction when walked forwards or backwards.
+    """
+    direction = 1 if order == SortOrder.ASC else -1
+    return [(field, direction), ("id", direction)]
+
+def top_n_pipeline(
+    filter_dict: Dict[str, Any],
+    sort: SortSpec,
+    n: int,
+    computed: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """$sort+$limit pipeline returning only the first `n` rows.
+
+    Mongo coalesces the two stages into a top-k sort, so it never holds more
+    than `n` documents even when the sort key is computed.
+    """
+    pipeline = [{"$match": filter_dict}]
+    if computed:
+        pipeline.append({"$addFields": computed})
+    pipeline += [{"$sort": dict(sort)}, {"$limit": n}]
+    if projection:
+        pipeline.append({"$project": projection})
+    return pipeline
+
+def _cursor_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+def encode_cursor(values: List[Any]) -> str:
+    payload = json.dumps([_cursor_value(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        return [
+            datetime.fromisoformat(value["$date"]) if isinstance(value, dict) else value
+            for value in values
+        ]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(sort: SortSpec, cursor: Optional[str]) -> Dict[str, Any]:
+    """Filter selecting documents strictly after `cursor` in `sort` order."""
+    if not cursor:
+        return {}
+    values = decode_cursor(cursor)
+    if len(values) != len(sort):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prefix_field: value for (prefix_field, _), value in zip(sort[:i], values[:i])}
+        clause[field] = {"$gt" if direction > 0 else "$lt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+async def fetch_page(
+    collection,
+    filter_dict: Dict[str, Any],
+    sort: SortSpec,
+    limit: int,
+    cursor: Optional[str] = None,
+    computed: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Fetch one keyset page; returns the documents and the cursor for the next page.
+
+    `sort` must end in a unique field (`id`). Sort keys listed in `computed`
+    are evaluated with $addFields, which switches the query to a pipeline.
+    An inclusion `projection` must keep the sort fields; computed ones are
+    kept automatically.
+    """
+    after = keyset_filter(sort, cursor)
+    
+    if computed:
+        pipeline = [{"$match": filter_dict}, {"$addFields": computed}]
+        if after:
+            pipeline.append({"$match": after})
+        pipeline += [{"$sort": dict(sort)}, {"$limit": limit + 1}]
+        if projection:
+            pipeline.append({"$project": {**projection, **{field: 1 for field in computed}}})
+        docs = await collection.aggregate(pipeline).to_list(limit + 1)
+    else:
+        if after:
+            filter_dict = {"$and": [filter_dict, after]} if filter_dict else after
+        docs = await collection.find(filter_dict, projection).sort(sort).limit(limit + 1).to_list(limit + 1)
+    return trim_page(docs, sort, limit)
+
+def trim_page(docs: List[Dict[str, Any]], sort: SortSpec, limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Split up to `limit` + 1 fetched documents into the page and the next page's cursor."""
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor([docs[-1].get(field) for field, _ in sort])
+
+# Name search
+MAX_SEARCH_PREFIX = 15
+SEARCH_SCORE_FIELD = "_search_score"
+
+def normalize_search_text(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+def name_search_terms(name: str) -> List[str]:
+    """Lowercase word prefixes of `name`, stored in the indexed `search_terms` field."""
+    terms = set()
+    for word in normalize_search_text(name):
+        for length in range(1, min(len(word), MAX_SEARCH_PREFIX) + 1):
+            terms.add(word[:length])
+    return sorted(terms)
+
+def name_search_text(name: str) -> str:
+    """Words of `name` after a leading space each, so SQL matches a word prefix with instr(text, ' ' || prefix)."""
+    return "".join(" " + word for word in normalize_search_text(name))
+
+def name_search_filter(search: str) -> Dict[str, Any]:
+    """Every word of `search` must prefix a word of the name."""
+    words = [word[:MAX_SEARCH_PREFIX] for word in normalize_search_text(search)]
+    if not words:
+        return {}
+    return {"search_terms": {"$all": words}}
+
+def name_search_score(search: str) -> Dict[str, Any]:
+    """Rank exact name matches first, then names starting with the query."""
+    query = " ".join(normalize_search_text(search))
+    name = {"$toLower": "$name"}
+    return {SEARCH_SCORE_FIELD: {"$switch": {
+        "branches": [
+            {"case": {"$eq": [name, query]}, "then": 2},
+            {"case": {"$eq": [{"$indexOfCP": [name, query]}, 0]}, "then": 1},
+        ],
+        "default": 0,
+    }}}
+
+# Tenancy. Authentication happens in front of the API, which passes the
+# caller's id in X-User-Id. Every document carries the owner's user_id and
+# every query on user data is filtered through owned_by(). The API trusts
+# the header as given and CORS allows any origin, so a multi-user deployment
+# must sit behind a proxy that strips X-User-Id from incoming requests and
+# sets it from the authenticated session. Requests without the header act as
+# DEFAULT_USER_ID, the single user that legacy documents were backfilled to;
+# set DEFAULT_USER_ID="" to reject them with 401 instead.
+USER_ID_HEADER = "X-User-Id"
+DEFAULT_USER_ID = os.environ.get("DEFAULT_USER_ID", "default")
+LEGACY_USER_ID = DEFAULT_USER_ID or "default"  # Owner of documents written before tenancy
+MAX_USER_ID_LENGTH = 128
+
+def request_user_id(request: Request) -> str:
+    return request.headers.get(USER_ID_HEADER) or DEFAULT_USER_ID
+
+def get_user_id(request: Request) -> str:
+    """Dependency resolving the user a request acts for."""
+    user_id = request_user_id(request)
+    if not user_id:
+        raise HTTPException(status_code=401, detail=f"{USER_ID_HEADER} header required")
+    if len(user_id) > MAX_USER_ID_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{USER_ID_HEADER} is longer than {MAX_USER_ID_LENGTH} characters")
+    return user_id
+
+def owned_by(user_id: str, filter_dict: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """`filter_dict` restricted to one user's documents, user_id first like the indexes."""
+    return {"user_id": user_id, **(filter_dict or {})}
+
+# Document helpers
+def subscription_document(subscription: Subscription, user_id: str) -> Dict[str, Any]:
+    doc = subscription.dict()
+    doc["user_id"] = user_id
+    doc["search_terms"] = name_search_terms(subscription.name)
+    return doc
+
+def new_expense(expense_data: ExpenseCreate, **extra) -> Expense:
+    # `extra` only fills fields ExpenseCreate lacks (id, created_at, next_due_date)
+    expense_dict = {**extra, **expense_data.dict()}
+    
+    # Set next due date for recurring expenses
+    if (expense_dict.get("is_recurring") and expense_dict.get("recurring_frequency")
+            and not expense_dict.get("next_due_date")):
+        expense_dict["next_due_date"] = calculate_next_expense_date(
+            expense_dict["date"], 
+            expense_dict["recurring_frequency"]
+        )
+    
+    return Expense(**expense_dict)
+
+def expense_document(expense: Expense, user_id: str) -> Dict[str, Any]:
+    doc = expense.dict()
+    doc["user_id"] = user_id
+    doc["search_terms"] = name_search_terms(expense.name)
+    return doc
+
+def budget_document(budget: Budget, user_id: str) -> Dict[str, Any]:
+    return {**budget.dict(), "user_id": user_id}
+
+# Documents read back from Mongo were validated on the way in, so hot read
+# paths project them to the model's fields and return them through
+# ORJSONResponse instead of building a model per row for FastAPI to validate
+# and encode a second time.
+def model_projection(model: Type[BaseModel], fields: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    return {"_id": 0, **{field: 1 for field in (fields or model.model_fields)}}
+
+def select_fields(model: Type[BaseModel], fields: Optional[str]) -> List[str]:
+    """Model fields named in a comma-separated `fields=` parameter, in model order.
+
+    `id` is always included so clients can still address the rows.
+    """
+    if not fields:
+        return list(model.model_fields)
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = sorted(requested - set(model.model_fields))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return [field for field in model.model_fields if field in requested or field == "id"]
+
+def model_defaults(model: Type[BaseModel]) -> Dict[str, Any]:
+    """Static defaults, for fields documents written by older versions may lack."""
+    return {
+        name: field.default
+        for name, field in model.model_fields.items()
+        if not field.is_required() and field.default_factory is None
+    }
+
+def trusted_documents(
+    model: Type[BaseModel], docs: List[Dict[str, Any]], fields: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """Shape stored documents like `model`, or just its `fields`, without validating them."""
+    defaults = model_defaults(model)
+    fields = fields or list(model.model_fields)
+    return [{field: doc.get(field, defaults.get(field)) for field in fields} for doc in docs]
+
+def build_update_dict(update_data: BaseModel) -> Dict[str, Any]:
+    update_dict = {k: v for k, v in update_data.dict().items() if v is not None and k != "version"}
+    if "name" in update_dict:
+        update_dict["search_terms"] = name_search_terms(update_dict["name"])
+    if "is_active" in update_dict:  # Subscriptions only
+        update_dict["cancelled_at"] = None if update_dict["is_active"] else datetime.utcnow()
+    return update_dict
+
+def soft_delete_update(now: datetime) -> List[Dict[str, Any]]:
+    """Pipeline update deactivating a subscription, keeping the first cancellation date."""
+    return [{"$set": {
+        "is_active": False,
+        "cancelled_at": {"$ifNull": ["$cancelled_at", now]},
+        "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+    }}]
+
+def versioned_changes(changes: Dict[str, Any]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+    """Mongo update applying build_update_dict changes and bumping the version.
+
+    Deactivating keeps an earlier cancelled_at like soft_delete_update, which
+    takes the pipeline form, with the new values as literals.
+    """
+    if changes.get("is_active") is False:
+        return [{"$set": {
+            **{field: {"$literal": value} for field, value in changes.items() if field != "cancelled_at"},
+            "cancelled_at": {"$ifNull": ["$cancelled_at", changes["cancelled_at"]]},
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+        }}]
+    return {"$set": changes, "$inc": {"version": 1}}
+
+def versioned_update(user_id: str, doc_id: str, update_data: BaseModel) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Filter and changes for an update, guarded by the expected version if given."""
+    filter_dict = owned_by(user_id, {"id": doc_id})
+    if update_data.version is not None:
+        filter_dict["version"] = update_data.version
+    return filter_dict, build_update_dict(update_data)
+
+def apply_update_locally(doc: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, Any]:
+    """The document as versioned_changes(changes) leaves it."""
+    updated = {**doc, **changes}
+    if changes.get("is_active") is False and doc.get("cancelled_at"):
+        updated["cancelled_at"] = doc["cancelled_at"]
+    updated["version"] = doc.get("version", 0) + 1
+    return updated
+
+async def apply_update(
+    collection, user_id: str, doc_id: str, update_data: BaseModel, label: str, previous: Optional[list] = None
+) -> Dict[str, Any]:
+    """Update a document in one round trip and return it as stored afterwards.
+
+    When `previous` is given, the pre-update document is appended to it; the
+    write then returns the BEFORE image and the result is derived locally.
+    """
+    filter_dict, changes = versioned_update(user_id, doc_id, update_data)
+    update = versioned_changes(changes) if changes else None
+    if update and previous is not None:
+        before = await collection.find_one_and_update(
+            filter_dict, update, return_document=ReturnDocument.BEFORE
+        )
+        updated = apply_update_locally(before, changes) if before else None
+        if before:
+            previous.append(before)
+    elif update:
+        updated = await collection.find_one_and_update(
+            filter_dict, update, return_document=ReturnDocument.AFTER
+        )
+    else:
+        updated = await collection.find_one(filter_dict)
     
-    return list(reversed(trends))
+    if updated is None:
+        # Only the failure path pays for telling a stale version from a missing document
+        if "version" in filter_dict and await collection.count_documents(owned_by(user_id, {"id": doc_id}), limit=1):
+            raise HTTPException(status_code=409, detail=f"{label} was modified by another request")
+        raise HTTPException(status_code=404, detail=f"{label} not found")
+    return updated
+
+async def backfill_versions(database) -> int:
+    """Give documents written before versioning a starting version."""
+    updated = 0
+    for collection_name in ("subscriptions", "expenses", "budgets"):
+        result = await database[collection_name].update_many(
+            {"version": {"$exists": False}}, {"$set": {"version": 1}}
+        )
+        updated += result.modified_count
+    return updated
+
+async def backfill_user_ids(database, user_id: str) -> int:
+    """Hand documents written before tenancy to `user_id`."""
+    updated = 0
+    for collection_name in ("subscriptions", "expenses", "budgets"):
+        result = await database[collection_name].update_many(
+            {"user_id": {"$exists": False}}, {"$set": {"user_id": user_id}}
+        )
+        updated += result.modified_count
+    return updated
+
+async def backfill_search_terms(database) -> int:
+    """Populate `search_terms` on documents written before name search was indexed."""
+    updated = 0
+    for collection_name in ("subscriptions", "expenses"):
+        collection = database[collection_name]
+        cursor = collection.find({"search_terms": {"$exists": False}}, {"_id": 0, "id": 1, "name": 1})
+        batch = []
+        async for doc in cursor:
+            batch.append(UpdateOne(
+                {"id": doc["id"]}, {"$set": {"search_terms": name_search_terms(doc.get("name", ""))}}
+            ))
+            if len(batch) >= 1000:
+                updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+# Monthly rollups
+ANALYTICS_ENGINE = os.environ.get("ANALYTICS_ENGINE", "mongo")  # "columnar" answers analytics from memory
+expense_columns = UserExpenseColumns()
+ROLLUP_FIELDS = ["user_id", "id", "date", "amount", "category"]
+
+def month_key(date: datetime) -> str:
+    """The UTC month of `date`, as $dateToString and stored dates see it."""
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return date.strftime("%Y-%m")
+
+def _enum_value(value: Any) -> Any:
+    return value.value if isinstance(value, Enum) else value
+
+def rollup_deltas(changes) -> Dict[Tuple[str, str, str], List[float]]:
+    """Net (amount, count) change per (user, month, category) for (old, new) expense pairs."""
+    deltas = {}
+    for old, new in changes:
+        for doc, sign in ((old, -1), (new, 1)):
+            if not doc:
+                continue
+            key = (doc["user_id"], month_key(doc["date"]), _enum_value(doc["category"]))
+            delta = deltas.setdefault(key, [0.0, 0])
+            delta[0] += sign * doc["amount"]
+            delta[1] += sign
+    return deltas
+
+async def apply_rollup_changes(database, changes) -> None:
+    """$inc the monthly_rollups rows touched by a set of expense writes."""
+    writes = [
+        UpdateOne(
+            {"user_id": user_id, "month": month, "category": category},
+            {"$inc": {"total": amount, "count": count}},
+            upsert=True,
+        )
+        for (user_id, month, category), (amount, count) in rollup_deltas(changes).items()
+        if count or abs(amount) > 1e-9
+    ]
+    if writes:
+        await database.monthly_rollups.bulk_write(writes, ordered=False)
+    if ANALYTICS_ENGINE == "columnar":
+        expense_columns.apply_changes(changes)
+
+async def refresh_rollups(database, changes) -> None:
+    """Recompute the monthly_rollups rows a set of expense writes touched from raw expenses.
+
+    For writes that may already have been counted, where $inc-ing their
+    deltas again could count them twice.
+    """
+    keys = {
+        (doc["user_id"], month_key(doc["date"]), _enum_value(doc["category"]))
+        for pair in changes for doc in pair if doc
+    }
+    if not keys:
+        return
+    months = sorted({month for _, month, _ in keys})
+    first = datetime.strptime(months[0], "%Y-%m")
+    end = datetime.strptime(months[-1], "%Y-%m") + relativedelta(months=1)
+    pipeline = [{"$match": {
+        "user_id": {"$in": sorted({user_id for user_id, _, _ in keys})},
+        "category": {"$in": sorted({category for _, _, category in keys})},
+        "date": {"$gte": first, "$lt": end},
+    }}] + rollup_group_pipeline()
+    totals = {
+        (row["user_id"], row["month"], row["category"]): row
+        async for row in database.expenses.aggregate(pipeline)
+    }
+    await database.monthly_rollups.bulk_write([
+        ReplaceOne(
+            {"user_id": user_id, "month": month, "category": category},
+            {
+                "user_id": user_id, "month": month, "category": category,
+                "total": totals.get((user_id, month, category), {}).get("total", 0.0),
+                "count": totals.get((user_id, month, category), {}).get("count", 0),
+            },
+            upsert=True,
+        )
+        for user_id, month, category in sorted(keys)
+    ], ordered=False)
+
+def rollup_group_pipeline() -> List[Dict[str, Any]]:
+    return [
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}},
+                "category": "$category",
+            },
+            "total": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": 0, "user_id": "$_id.user_id", "month": "$_id.month", "category": "$_id.category",
+            "total": 1, "count": 1,
+        }},
+    ]
+
+async def load_expense_columns(storage) -> int:
+    """Fill expense_columns from the expenses collection.
+
+    Writes made while the snapshot is being read are queued by the store and
+    replayed once it is loaded; replaying a write the snapshot already saw is
+    harmless because rows are keyed by expense id.
+    """
+    expense_columns.start_loading()
+    rows = [
+        (doc["user_id"], doc["id"], doc["date"], doc["amount"], doc["category"])
+        async for doc in storage.expenses.scan(None, ROLLUP_FIELDS, 10000)
+    ]
+    expense_columns.load(rows)
+    return len(expense_columns)
+
+def month_label(month: int) -> str:
+    return f"{1970 + month // 12}-{month % 12 + 1:02d}"
+
+def columnar_expense_facets(columns: ExpenseColumns, windows: Dict[str, datetime]) -> Dict[str, List[Dict[str, Any]]]:
+    """The expense facets of build_dashboard_pipeline, computed from one user's columns."""
+    month = month_number(windows["current_month_start"])
+    year_start = month_number(windows["current_year_start"])
+    last_month = month_number(windows["last_month_start"])
+    trend_start = month_number(windows["trend_start"])
+    earliest = min(year_start, last_month, trend_start)
+    
+    # Rows earliest..month, then one row for anything dated after this month
+    matrix = columns.month_category_matrix(earliest, month)
+    per_month = matrix.sum(axis=1)
+    current = matrix[month - earliest:].sum(axis=0)
+    return {
+        "expense_totals": [{
+            "month": float(per_month[month - earliest:].sum()),
+            "year": float(per_month[year_start - earliest:].sum()),
+            "last_month": float(per_month[last_month - earliest]),
+        }],
+        "expense_categories": [
+            {"_id": name, "total": float(total)}
+            for name, total in zip(columns.category_names, current)
+            if total
+        ],
+        "expense_trends": [
+            {"_id": month_label(trend_month), "total": float(per_month[trend_month - earliest])}
+            for trend_month in range(trend_start, month + 1)
+        ],
+    }
+
+def rollup_expense_facets(rows, windows: Dict[str, datetime]) -> Dict[str, List[Dict[str, Any]]]:
+    """The expense facets of build_dashboard_pipeline, from (month, category, total) rows."""
+    month = month_key(windows["current_month_start"])
+    year_start = month_key(windows["current_year_start"])
+    last_month = month_key(windows["last_month_start"])
+    trend_start = month_key(windows["trend_start"])
+    
+    totals = {"month": 0.0, "year": 0.0, "last_month": 0.0}
+    categories = {}
+    trends = {}
+    for row in rows:
+        if row["month"] >= month:
+            totals["month"] += row["total"]
+            categories[row["category"]] = categories.get(row["category"], 0.0) + row["total"]
+        if row["month"] >= year_start:
+            totals["year"] += row["total"]
+        if row["month"] == last_month:
+            totals["last_month"] += row["total"]
+        if trend_start <= row["month"] <= month:
+            trends[row["month"]] = trends.get(row["month"], 0.0) + row["total"]
+    return {
+        "expense_totals": [totals],
+        "expense_categories": [{"_id": category, "total": total} for category, total in categories.items()],
+        "expense_trends": [{"_id": trend_month, "total": total} for trend_month, total in trends.items()],
+    }
+
+async def rebuild_rollups(database) -> int:
+    """Recompute monthly_rollups from raw expenses, replacing it atomically."""
+    await database.expenses.aggregate(rollup_group_pipeline() + [{"$out": "monthly_rollups"}]).to_list(None)
+    return await database.monthly_rollups.count_documents({})
+
+async def verify_rollups(database, tolerance: float = 0.005) -> List[Dict[str, Any]]:
+    """Rows where monthly_rollups disagrees with the raw expenses."""
+    expected = {
+        (row["user_id"], row["month"], row["category"]): row
+        async for row in database.expenses.aggregate(rollup_group_pipeline())
+    }
+    actual = {
+        (row.get("user_id"), row["month"], row["category"]): row
+        async for row in database.monthly_rollups.find({}, {"_id": 0})
+    }
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):  # user_id may be missing on stale rows
+        want = expected.get(key, {"total": 0, "count": 0})
+        have = actual.get(key, {"total": 0, "count": 0})
+        if want["count"] != have.get("count", 0) or abs(want["total"] - have.get("total", 0)) > tolerance:
+            mismatches.append({
+                "user_id": key[0],
+                "month": key[1],
+                "category": key[2],
+                "expected_total": want["total"],
+                "actual_total": have.get("total", 0),
+                "expected_count": want["count"],
+                "actual_count": have.get("count", 0),
+            })
+    return mismatches
+
+# Recurring materialisation
+RECURRENCE_INTERVAL_SECONDS = float(os.environ.get("RECURRENCE_INTERVAL_SECONDS", "300"))
+RECURRENCE_BATCH_SIZE = int(os.environ.get("RECURRENCE_BATCH_SIZE", "500"))
+MAX_OCCURRENCES_PER_PASS = 520  # Ten years of weekly charges; the rest follow on the next pass
+MAX_RECURRENCE_BATCHES_PER_TICK = 100
+
+def occurrence_id(template_id: str, occurrence_date: datetime) -> str:
+    # Deterministic, so re-running a half-finished tick inserts nothing twice
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{template_id}:{occurrence_date.isoformat()}"))
+
+def expand_expense_occurrences(template: Dict[str, Any], now: datetime) -> Tuple[List[Dict[str, Any]], datetime]:
+    """Occurrence documents due by `now`, and the template's next due date after them."""
+    occurrences = []
+    due = template["next_due_date"]
+    frequency = RecurringExpenseFrequency(template["recurring_frequency"])
+    while due <= now and len(occurrences) < MAX_OCCURRENCES_PER_PASS:
+        occurrence = Expense(
+            id=occurrence_id(template["id"], due),
+            name=template["name"],
+            amount=template["amount"],
+            category=template["category"],
+            tags=template.get("tags", []),
+            notes=template.get("notes"),
+            date=due,
+            recurrence_of=template["id"],
+        )
+        occurrences.append(expense_document(occurrence, template["user_id"]))
+        due = calculate_next_expense_date(due, frequency)
+    return occurrences, due
+
+def advance_subscription_due_date(due: datetime, frequency: str, now: datetime) -> datetime:
+    frequency = BillingFrequency(frequency)
+    while due <= now:
+        due = calculate_next_due_date(due, frequency)
+    return due
+
+async def materialise_recurring_expenses(storage, now: datetime) -> Dict[str, int]:
+    """Insert missed occurrences of due recurring expenses and advance them.
+
+    Occurrences are inserted before the template moves, and the template
+    update is conditional on the due date it was read with, so a crash or a
+    concurrent worker only ever repeats work that is then a no-op. An
+    occurrence that already exists may come from a run that stopped before
+    updating the rollups, so the rows it falls in are recounted instead.
+    """
+    stats = {"occurrences": 0, "expenses_advanced": 0}
+    due_filter = {
+        "is_recurring": True,
+        "next_due_date": {"$lte": now},
+        "recurring_frequency": {"$ne": None},
+    }
+    for _ in range(MAX_RECURRENCE_BATCHES_PER_TICK):
+        templates = await storage.expenses.find(
+            None, due_filter, sort=[("next_due_date", 1)], limit=RECURRENCE_BATCH_SIZE
+        )
+        if not templates:
+            break
+        
+        occurrences = []
+        advances = []
+        for template in templates:
+            generated, next_due = expand_expense_occurrences(template, now)
+            occurrences += generated
+            advances.append((
+                "update", template["id"], {"next_due_date": template["next_due_date"]}, {"next_due_date": next_due}
+            ))
+        
+        duplicates = set()
+        for start in range(0, len(occurrences), RECURRENCE_BATCH_SIZE):
+            chunk = occurrences[start:start + RECURRENCE_BATCH_SIZE]
+            result = await storage.expenses.write_many(None, [("insert", doc) for doc in chunk])
+            for index, (status, message) in result.errors.items():
+                if status != 409:
+                    raise RuntimeError(message)
+                duplicates.add(start + index)
+        inserted = [doc for i, doc in enumerate(occurrences) if i not in duplicates]
+        await storage.apply_rollup_changes([(None, doc) for doc in inserted])
+        if duplicates:
+            existing = await storage.expenses.find(
+                None, {"id": {"$in": [occurrences[i]["id"] for i in duplicates]}}, ROLLUP_FIELDS
+            )
+            await storage.reconcile_rollup_changes([(None, doc) for doc in existing])
+        
+        result = await storage.expenses.write_many(None, advances)
+        stats["occurrences"] += len(inserted)
+        stats["expenses_advanced"] += result.updated
+        await asyncio.sleep(0)  # Let requests in between batches
+    return stats
+
+async def advance_due_subscriptions(storage, now: datetime) -> int:
+    """Roll next_due_date forward on active subscriptions whose charge has passed.
+
+    Subscriptions are already counted at their monthly equivalent, so no
+    expense rows are generated for them.
+    """
+    advanced = 0
+    due_filter = {"is_active": True, "next_due_date": {"$lte": now}}
+    for _ in range(MAX_RECURRENCE_BATCHES_PER_TICK):
+        subscriptions = await storage.subscriptions.find(
+            None, due_filter, ["id", "next_due_date", "billing_frequency"],
+            sort=[("next_due_date", 1)], limit=RECURRENCE_BATCH_SIZE,
+        )
+        if not subscriptions:
+            break
+        
+        result = await storage.subscriptions.write_many(None, [
+            (
+                "update", sub["id"], {"next_due_date": sub["next_due_date"]},
+                {"next_due_date": advance_subscription_due_date(sub["next_due_date"], sub["billing_frequency"], now)},
+            )
+            for sub in subscriptions
+        ])
+        advanced += result.updated
+        await asyncio.sleep(0)
+    return advanced
+
+async def run_recurrence_tick(storage, now: Optional[datetime] = None) -> Dict[str, int]:
+    now = now or datetime.utcnow()
+    stats = await materialise_recurring_expenses(storage, now)
+    stats["subscriptions_advanced"] = await advance_due_subscriptions(storage, now)
+    # Ticks touch many users at once, so they invalidate everyone's caches
+    if stats["occurrences"] or stats["expenses_advanced"]:
+        record_write(None, "expenses")
+    if stats["subscriptions_advanced"]:
+        record_write(None, "subscriptions")
+    return stats
+
+async def run_recurrence_scheduler(storage) -> None:
+    while True:
+        try:
+            stats = await run_recurrence_tick(storage)
+            if any(stats.values()):
+                logger.info(f"Recurrence tick: {stats}")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Recurrence tick failed")
+        await asyncio.sleep(RECURRENCE_INTERVAL_SECONDS)
+
+# Storage backends. Endpoints reach user data through `storage`, whose
+# repositories hide the query language: MongoStorage issues the queries above
+# through Motor, while STORAGE_BACKEND=sqlite keeps everything in one embedded
+# SQLite file (SQLITE_PATH), for single-node deployments and local runs
+# without a mongod.
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", str(ROOT_DIR / "nbntracker.db"))
+
+# Writes for Repository.write_many:
+#   ("insert", doc)
+#   ("replace", doc)                         upsert by id among the user's documents
+#   ("update", id, expected, changes)        set `changes` and bump the version if `expected` fields still match
+#   ("deactivate", id)                       soft delete, see soft_delete_update
+#   ("delete", id)
+Write = Tuple[Any, ...]
+
+TARGETED_WRITES = ("update", "deactivate", "delete")
+
+class WriteResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0  # Matched by a replace, update or deactivate
+        self.errors: Dict[int, Tuple[int, str]] = {}  # write index -> (HTTP status, message)
+        self.unmatched: set = set()  # Indexes of TARGETED_WRITES whose id and expected fields matched nothing
+        self.uncertain: set = set()  # Indexes of deletes that may or may not have matched anything
+
+class Repository(ABC):
+    """One collection of user-owned documents; subclass to plug in another store.
+
+    Filters use the subset of Mongo's query language every backend
+    understands: equality, $gt/$gte/$lt/$lte/$ne/$in and $and/$or. Calls are
+    scoped to `user_id`; None reaches every user's documents and is only for
+    background jobs.
+    """
+    
+    @abstractmethod
+    async def insert(self, doc: Dict[str, Any]) -> None:
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def find_one(self, user_id: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def find(
+        self,
+        user_id: Optional[str],
+        filter_dict: Optional[Dict[str, Any]] = None,
+        fields: Optional[List[str]] = None,
+        sort: Optional[SortSpec] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Matching documents with just `fields` (default: all), in `sort` order."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def scan(self, user_id: Optional[str], fields: List[str], batch_size: int):
+        """Async iterator over every document, read `batch_size` at a time."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def page(
+        self,
+        user_id: str,
+        filter_dict: Dict[str, Any],
+        sort: SortSpec,
+        fields: List[str],
+        limit: int,
+        cursor: Optional[str] = None,
+        search: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One keyset page and the cursor for the next, like fetch_page.
+
+        With `search`, only documents whose name matches are returned, best
+        matches first.
+        """
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def top(
+        self,
+        user_id: str,
+        filter_dict: Dict[str, Any],
+        sort: SortSpec,
+        fields: List[str],
+        n: int,
+        search: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """The first `n` documents in `sort` order, searched like page()."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def update(
+        self, user_id: str, doc_id: str, update_data: BaseModel, label: str, previous: Optional[list] = None
+    ) -> Dict[str, Any]:
+        """Apply an update model and return the stored document, like apply_update."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def deactivate(self, user_id: str, doc_id: str) -> bool:
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def delete(self, user_id: str, doc_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Delete a document and return it, or None if there was none."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def delete_many(self, user_id: str, filter_dict: Dict[str, Any]) -> int:
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def write_many(self, user_id: Optional[str], writes: List[Write]) -> WriteResult:
+        """Apply `writes` unordered; a failed write does not stop the others."""
+        raise NotImplementedError
+
+class MongoRepository(Repository):
+    def __init__(self, collection, computed: Optional[Dict[str, Any]] = None):
+        self.collection = collection
+        self.computed = computed or {}  # Field -> aggregation expression, for sort-only fields like monthly_cost
+    
+    def _scope(self, user_id: Optional[str], filter_dict: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return owned_by(user_id, filter_dict) if user_id is not None else dict(filter_dict or {})
+    
+    def _projection(self, fields: Optional[List[str]]) -> Dict[str, int]:
+        return {"_id": 0, **{field: 1 for field in fields or []}}
+    
+    def _query(self, user_id, filter_dict, sort, fields, search):
+        """Filter, sort, computed fields and projection for page() and top()."""
+        filter_dict = owned_by(user_id, filter_dict)
+        sort = list(sort)
+        if search:
+            filter_dict.update(name_search_filter(search))
+            sort.insert(0, (SEARCH_SCORE_FIELD, -1))
+        fields = fields + [field for field, _ in sort]
+        computed = {field: self.computed[field] for field in fields if field in self.computed}
+        if search:
+            computed.update(name_search_score(search))
+        return filter_dict, sort, computed or None, self._projection(fields)
+    
+    async def insert(self, doc):
+        await self.collection.insert_one(doc)
+    
+    async def find_one(self, user_id, doc_id):
+        return await self.collection.find_one(owned_by(user_id, {"id": doc_id}), {"_id": 0})
+    
+    async def find(self, user_id, filter_dict=None, fields=None, sort=None, limit=None):
+        cursor = self.collection.find(self._scope(user_id, filter_dict), self._projection(fields))
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(limit)
+    
+    async def scan(self, user_id, fields, batch_size):
+        async for doc in self.collection.find(self._scope(user_id), self._projection(fields)).batch_size(batch_size):
+            yield doc
+    
+    async def page(self, user_id, filter_dict, sort, fields, limit, cursor=None, search=None):
+        filter_dict, sort, computed, projection = self._query(user_id, filter_dict, sort, fields, search)
+        return await fetch_page(self.collection, filter_dict, sort, limit, cursor, computed, projection)
+    
+    async def top(self, user_id, filter_dict, sort, fields, n, search=None):
+        filter_dict, sort, computed, projection = self._query(user_id, filter_dict, sort, fields, search)
+        return await self.collection.aggregate(top_n_pipeline(filter_dict, sort, n, computed, projection)).to_list(n)
+    
+    async def update(self, user_id, doc_id, update_data, label, previous=None):
+        return await apply_update(self.collection, user_id, doc_id, update_data, label, previous)
+    
+    async def deactivate(self, user_id, doc_id):
+        result = await self.collection.update_one(
+            owned_by(user_id, {"id": doc_id}), soft_delete_update(datetime.utcnow())
+        )
+        return result.matched_count > 0
+    
+    async def delete(self, user_id, doc_id, fields=None):
+        return await self.collection.find_one_and_delete(
+            owned_by(user_id, {"id": doc_id}), projection=self._projection(fields)
+        )
+    
+    async def delete_many(self, user_id, filter_dict):
+        return (await self.collection.delete_many(owned_by(user_id, filter_dict))).deleted_count
+    
+    def _operation(self, user_id: Optional[str], write: Write):
+        kind, *args = write
+        if kind == "insert":
+            return InsertOne(args[0])
+        if kind == "replace":
+            return ReplaceOne(self._scope(user_id, {"id": args[0]["id"]}), args[0], upsert=True)
+        if kind == "update":
+            doc_id, expected, changes = args
+            return UpdateOne(self._scope(user_id, {"id": doc_id, **expected}), versioned_changes(changes))
+        if kind == "deactivate":
+            return UpdateOne(self._scope(user_id, {"id": args[0]}), soft_delete_update(datetime.utcnow()))
+        if kind == "delete":
+            return DeleteOne(self._scope(user_id, {"id": args[0]}))
+        raise ValueError(f"Unknown write '{kind}'")
+    
+    async def _unmatched_updates(self, user_id: Optional[str], writes: List[Write], indexes: List[int]) -> set:
+        """Which of the update and deactivate writes at `indexes` matched nothing, judged by one re-read.
+
+        A write matched unless its document is gone or, for an update, the
+        document no longer carries the version and values the update set.
+        """
+        fields = {"id", "version"}
+        for index in indexes:
+            if writes[index][0] == "update":
+                fields.update(writes[index][3])
+        stored = {
+            doc["id"]: doc
+            for doc in await self.find(user_id, {"id": {"$in": [writes[index][1] for index in indexes]}}, list(fields))
+        }
+        unmatched = set()
+        for index in indexes:
+            kind, doc_id, *args = writes[index]
+            doc = stored.get(doc_id)
+            if doc is None:
+                unmatched.add(index)
+            elif kind == "update":
+                expected, changes = args
+                if "version" in expected and doc.get("version") != expected["version"] + 1:
+                    unmatched.add(index)
+                elif any(
+                    doc.get(field) != value for field, value in changes.items()
+                    if field != "cancelled_at"  # Deactivating keeps an earlier one
+                ):
+                    unmatched.add(index)
+        return unmatched
+    
+    async def write_many(self, user_id, writes):
+        result = WriteResult()
+        if not writes:
+            return result
+        try:
+            outcome = (await self.collection.bulk_write(
+                [self._operation(user_id, write) for write in writes], ordered=False
+            )).bulk_api_result
+        except BulkWriteError as e:
+            outcome = e.details
+            for write_error in outcome.get("writeErrors", []):
+                result.errors[write_error["index"]] = (
+                    409 if write_error.get("code") == 11000 else 400,
+                    write_error.get("errmsg", "Write failed"),
+                )
+        result.created = outcome.get("nInserted", 0) + outcome.get("nUpserted", 0)
+        result.updated = outcome.get("nMatched", 0)
+        
+        # bulk_write only reports aggregate counts, so the writes are only
+        # sorted into matched and unmatched when the counts fall short
+        def applied(*kinds):
+            return [index for index, write in enumerate(writes) if write[0] in kinds and index not in result.errors]
+        
+        replaced = len(applied("replace")) - outcome.get("nUpserted", 0)
+        updates = applied("update", "deactivate")
+        if result.updated - replaced < len(updates):
+            result.unmatched |= await self._unmatched_updates(user_id, writes, updates)
+        deletes = applied("delete")
+        removed = outcome.get("nRemoved", 0)
+        if removed < len(deletes):
+            # A deleted id reads as absent whether or not this batch removed
+            # it, so only a batch that removed nothing can be attributed
+            if removed:
+                result.uncertain.update(deletes)
+            else:
+                result.unmatched.update(deletes)
+        return result
+
+# SQLite keeps a column per model field, plus the owner's user_id and, for
+# named documents, search_text (see name_search_text) in place of the
+# search_terms array. Indexes follow INDEX_SPECS, minus id_unique (id is the
+# primary key) and the search_terms ones.
+BUMP_VERSION: Expression = ('"version" = COALESCE("version", 0) + 1', [])
+SEARCH_SCORE_SQL = 'CASE WHEN lower("name") = ? THEN 2 WHEN instr(lower("name"), ?) = 1 THEN 1 ELSE 0 END'
+
+def sqlite_table(name: str, model: Type[BaseModel], computed: Optional[Dict[str, Expression]] = None) -> Table:
+    columns = {"user_id": TEXT}
+    columns.update({field: column_kind(info.annotation) for field, info in model.model_fields.items()})
+    if "name" in columns:
+        columns["search_text"] = TEXT
+    indexes = {}
+    for spec in INDEX_SPECS[name]:
+        key = list(spec.document["key"].items())
+        if not spec.document.get("unique") and all(field in columns for field, _ in key):
+            indexes[spec.document["name"]] = key
+    return Table(name, columns, indexes, computed)
+
+class SQLiteRepository(Repository):
+    def __init__(self, engine: SQLiteStore, table_name: str):
+        self.engine = engine
+        self.table = engine.tables[table_name]
+    
+    def _where(self, user_id: Optional[str], filter_dict: Optional[Dict[str, Any]] = None) -> Expression:
+        return where_clause(self.table, owned_by(user_id, filter_dict) if user_id is not None else filter_dict or {})
+    
+    def _values(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        values = self.table.values(doc)
+        if "name" in doc and "search_text" in self.table.columns:
+            values["search_text"] = name_search_text(doc["name"])
+        return values
+    
+    def _query(self, user_id, filter_dict, sort, fields, search):
+        """WHERE clause, sort, selected fields and per-query expressions for page() and top()."""
+        sort = list(sort)
+        extra = {}
+        if search:
+            query = " ".join(normalize_search_text(search))
+            extra[SEARCH_SCORE_FIELD] = (SEARCH_SCORE_SQL, [query, query])
+            sort.insert(0, (SEARCH_SCORE_FIELD, -1))
+        where = where_clause(self.table, owned_by(user_id, filter_dict), extra)
+        # Every word of `search` must prefix a word of the name, as in name_search_filter
+        for word in normalize_search_text(search or ""):
+            where = and_where(where, ('instr("search_text", ?) > 0', [" " + word[:MAX_SEARCH_PREFIX]]))
+        selected = list(dict.fromkeys(fields + [field for field, _ in sort]))
+        return where, sort, selected, extra
+    
+    async def insert(self, doc):
+        values = self._values(doc)
+        await self.engine.run(lambda connection: insert_row(connection, self.table, values))
+    
+    async def find_one(self, user_id, doc_id):
+        docs = await self.find(user_id, {"id": doc_id}, limit=1)
+        return docs[0] if docs else None
+    
+    async def find(self, user_id, filter_dict=None, fields=None, sort=None, limit=None):
+        where = self._where(user_id, filter_dict)
+        return await self.engine.run(
+            lambda connection: select_documents(connection, self.table, where, fields, sort, limit)
+        )
+    
+    async def scan(self, user_id, fields, batch_size):
+        # Keyset on the primary key, so each batch is one short read
+        fields = fields if "id" in fields else fields + ["id"]
+        after = None
+        while True:
+            docs = await self.find(
+                user_id, {"id": {"$gt": after}} if after else None, fields, [("id", 1)], batch_size
+            )
+            for doc in docs:
+                yield doc
+            if len(docs) < batch_size:
+                return
+            after = docs[-1]["id"]
+    
+    async def page(self, user_id, filter_dict, sort, fields, limit, cursor=None, search=None):
+        where, sort, selected, extra = self._query(user_id, filter_dict, sort, fields, search)
+        after = keyset_filter(sort, cursor)
+        if after:
+            where = and_where(where, where_clause(self.table, after, extra))
+        docs = await self.engine.run(
+            lambda connection: select_documents(connection, self.table, where, selected, sort, limit + 1, extra)
+        )
+        return trim_page(docs, sort, limit)
+    
+    async def top(self, user_id, filter_dict, sort, fields, n, search=None):
+        where, sort, selected, extra = self._query(user_id, filter_dict, sort, fields, search)
+        return await self.engine.run(
+            lambda connection: select_documents(connection, self.table, where, selected, sort, n, extra)
+        )
+    
+    async def update(self, user_id, doc_id, update_data, label, previous=None):
+        where = self._where(user_id, {"id": doc_id})
+        changes = build_update_dict(update_data)
+        
+        def work(connection):
+            with transaction(connection):
+                found = select_documents(connection, self.table, where, limit=1)
+                if not found:
+                    return None, None
+                if update_data.version is not None and found[0].get("version") != update_data.version:
+                    return found[0], None
+                if not changes:
+                    return found[0], found[0]
+                self._update(connection, where, changes)
+                return found[0], select_documents(connection, self.table, where, limit=1)[0]
+        
+        before, updated = await self.engine.run(work)
+        if updated is None:
+            if before is not None:
+                raise HTTPException(status_code=409, detail=f"{label} was modified by another request")
+            raise HTTPException(status_code=404, detail=f"{label} not found")
+        if changes and previous is not None:
+            previous.append(before)
+        return updated
+    
+    def _update(self, connection, where: Expression, changes: Dict[str, Any]) -> int:
+        """Apply build_update_dict changes; deactivating keeps an earlier cancelled_at like _deactivate."""
+        expressions = [BUMP_VERSION]
+        if changes.get("is_active") is False:
+            changes = dict(changes)
+            cancelled_at = to_sql(changes.pop("cancelled_at"))
+            expressions.append(('"cancelled_at" = COALESCE("cancelled_at", ?)', [cancelled_at]))
+        return update_rows(connection, self.table, where, self._values(changes), expressions)
+    
+    def _deactivate(self, connection, where: Expression) -> int:
+        cancelled_at = ('"cancelled_at" = COALESCE("cancelled_at", ?)', [to_sql(datetime.utcnow())])
+        return update_rows(connection, self.table, where, {"is_active": 0}, [cancelled_at, BUMP_VERSION])
+    
+    async def deactivate(self, user_id, doc_id):
+        where = self._where(user_id, {"id": doc_id})
+        return await self.engine.run(lambda connection: self._deactivate(connection, where)) > 0
+    
+    async def delete(self, user_id, doc_id, fields=None):
+        where = self._where(user_id, {"id": doc_id})
+        
+        def work(connection):
+            with transaction(connection):
+                found = select_documents(connection, self.table, where, fields, limit=1)
+                if found:
+                    delete_rows(connection, self.table, where)
+            return found[0] if found else None
+        return await self.engine.run(work)
+    
+    async def delete_many(self, user_id, filter_dict):
+        where = self._where(user_id, filter_dict)
+        return await self.engine.run(lambda connection: delete_rows(connection, self.table, where))
+    
+    def _write(self, connection, user_id: Optional[str], write: Write, result: WriteResult) -> int:
+        """Apply one write; returns the number of rows it matched."""
+        kind, *args = write
+        if kind == "insert":
+            insert_row(connection, self.table, self._values(args[0]))
+            result.created += 1
+            return 1
+        if kind == "replace":
+            values = self._values(args[0])
+            if update_rows(connection, self.table, self._where(user_id, {"id": args[0]["id"]}), values):
+                result.updated += 1
+            else:
+                insert_row(connection, self.table, values)
+                result.created += 1
+            return 1
+        if kind == "update":
+            doc_id, expected, changes = args
+            where = self._where(user_id, {"id": doc_id, **expected})
+            matched = self._update(connection, where, changes)
+        elif kind == "deactivate":
+            matched = self._deactivate(connection, self._where(user_id, {"id": args[0]}))
+        elif kind == "delete":
+            return delete_rows(connection, self.table, self._where(user_id, {"id": args[0]}))
+        else:
+            raise ValueError(f"Unknown write '{kind}'")
+        result.updated += matched
+        return matched
+    
+    async def write_many(self, user_id, writes):
+        def work(connection):
+            result = WriteResult()
+            with transaction(connection):
+                for index, write in enumerate(writes):
+                    try:
+                        if not self._write(connection, user_id, write, result):
+                            result.unmatched.add(index)
+                    except sqlite3.IntegrityError as e:  # Only the failing statement is rolled back
+                        result.errors[index] = (409, str(e))
+            return result
+        return await self.engine.run(work)
+
+class Storage(ABC):
+    """The repositories behind the API plus the analytics queries that span them."""
+    subscriptions: Repository
+    expenses: Repository
+    budgets: Repository
+    analytics: "Storage"  # Where the analytics endpoints read from
+    
+    def repository(self, collection_name: str) -> Repository:
+        return getattr(self, collection_name)
+    
+    async def prepare(self) -> None:
+        """Create or reconcile schema and indexes at startup."""
+    
+    @abstractmethod
+    async def apply_rollup_changes(self, changes) -> None:
+        """Record (old, new) expense pairs wherever expense totals are pre-aggregated."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def reconcile_rollup_changes(self, changes) -> None:
+        """Like apply_rollup_changes, for pairs that may already have been recorded."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def dashboard_facets(
+        self, user_id: str, windows: Dict[str, datetime], include_expenses: bool = True
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """The facets of build_dashboard_pipeline for dashboard_from_facets.
+
+        With include_expenses=False the expense facets are left out, for when
+        they are computed from expense_columns instead.
+        """
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def expense_totals(
+        self, user_id: str, buckets: List[TrendBucket], granularity: TrendGranularity
+    ) -> Dict[str, float]:
+        """Expense total per trend bucket key within `buckets`."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    async def explain_queries(self) -> List[Dict[str, Any]]:
+        """Plans for explain_query_shapes(), flagging the ones that scan a whole collection."""
+        raise NotImplementedError
+    
+    def close(self) -> None:
+        pass
+
+class MongoStorage(Storage):
+    def __init__(self, database, analytics_database=None):
+        self.database = database
+        self.subscriptions = MongoRepository(
+            database.subscriptions, {SubscriptionSortField.MONTHLY_COST.value: MONTHLY_COST_EXPR}
+        )
+        self.expenses = MongoRepository(database.expenses)
+        self.budgets = MongoRepository(database.budgets)
+        self.analytics = MongoStorage(analytics_database) if analytics_database is not None else self
+    
+    async def prepare(self):
+        await ensure_indexes(self.database)
+    
+    async def apply_rollup_changes(self, changes):
+        await apply_rollup_changes(self.database, changes)
+    
+    async def reconcile_rollup_changes(self, changes):
+        await refresh_rollups(self.database, changes)
+        if ANALYTICS_ENGINE == "columnar":
+            expense_columns.apply_changes(changes)  # Keyed by expense id, so replaying is harmless
+    
+    async def dashboard_facets(self, user_id, windows, include_expenses=True):
+        facets = await self.database.expenses.aggregate(
+            build_dashboard_pipeline(user_id, windows, include_rollups=include_expenses)
+        ).to_list(1)
+        return facets[0] if facets else {}
+    
+    async def expense_totals(self, user_id, buckets, granularity):
+        if granularity == TrendGranularity.MONTHLY:
+            pipeline = [
+                {"$match": owned_by(user_id, {"month": {"$gte": buckets[0][0], "$lte": buckets[-1][0]}})},
+                {"$group": {"_id": "$month", "total": {"$sum": "$total"}}},
+            ]
+            collection = self.database.monthly_rollups
+        else:
+            pipeline = [
+                {"$match": owned_by(user_id, {"date": {"$gte": buckets[0][2], "$lt": buckets[-1][3]}})},
+                {"$group": {
+                    "_id": {"$dateToString": {"format": TREND_KEY_FORMATS[granularity], "date": "$date"}},
+                    "total": {"$sum": "$amount"},
+                }},
+            ]
+            collection = self.database.expenses
+        return {row["_id"]: row["total"] async for row in collection.aggregate(pipeline)}
+    
+    async def explain_queries(self):
+        return await explain_queries(self.database)
+    
+    def close(self):
+        close_mongo()
+
+class SQLiteStorage(Storage):
+    """Everything in one SQLite file; see sqlite_store.
+
+    There is no monthly_rollups table: dashboard and trend totals are summed
+    straight from expenses over its (user_id, date) index, so writes have no
+    rollups to keep in step.
+    """
+    
+    def __init__(self, path: str):
+        self.engine = SQLiteStore(path, [
+            sqlite_table("subscriptions", Subscription, {SubscriptionSortField.MONTHLY_COST.value: MONTHLY_COST_SQL}),
+            sqlite_table("expenses", Expense),
+            sqlite_table("budgets", Budget),
+        ])
+        self.subscriptions = SQLiteRepository(self.engine, "subscriptions")
+        self.expenses = SQLiteRepository(self.engine, "expenses")
+        self.budgets = SQLiteRepository(self.engine, "budgets")
+        self.analytics = self
+    
+    async def apply_rollup_changes(self, changes):
+        if ANALYTICS_ENGINE == "columnar":
+            expense_columns.apply_changes(changes)
+    
+    async def reconcile_rollup_changes(self, changes):
+        await self.apply_rollup_changes(changes)
+    
+    async def dashboard_facets(self, user_id, windows, include_expenses=True):
+        cutoff = windows["upcoming_cutoff"]
+        subscriptions, upcoming_expenses, budgets = await asyncio.gather(
+            self.subscriptions.find(user_id, trend_subscription_filter(user_id, windows["trend_start"])),
+            self.expenses.find(user_id, {"is_recurring": True, "next_due_date": {"$lte": cutoff}}),
+            self.budgets.find(user_id, {"type": {"$in": [budget_type.value for budget_type in BudgetType]}}),
+        )
+        active = [sub for sub in subscriptions if sub["is_active"]]
+        categories = {}
+        for sub in active:
+            categories[sub["category"]] = (
+                categories.get(sub["category"], 0) + get_monthly_cost(sub["cost"], sub["billing_frequency"])
+            )
+        facets = {
+            "subscription_categories": [{"_id": category, "total": total} for category, total in categories.items()],
+            "upcoming_subscriptions": [sub for sub in active if sub["next_due_date"] <= cutoff],
+            "trend_subscriptions": subscriptions,
+            "upcoming_expenses": upcoming_expenses,
+            "budgets": budgets,
+        }
+        if include_expenses:
+            earliest = min(windows["current_year_start"], windows["last_month_start"], windows["trend_start"])
+            rows = await self.engine.query(
+                'SELECT substr("date", 1, 7) AS month, "category", SUM("amount") AS total FROM expenses '
+                'WHERE "user_id" = ? AND "date" >= ? GROUP BY month, "category"',
+                [user_id, to_sql(earliest)],
+            )
+            facets.update(rollup_expense_facets(rows, windows))
+        return facets
+    
+    async def expense_totals(self, user_id, buckets, granularity):
+        # Stored dates start with the month and the day; weeks are regrouped from days
+        prefix = 7 if granularity == TrendGranularity.MONTHLY else 10
+        rows = await self.engine.query(
+            f'SELECT substr("date", 1, {prefix}) AS period, SUM("amount") AS total FROM expenses '
+            'WHERE "user_id" = ? AND "date" >= ? AND "date" < ? GROUP BY period',
+            [user_id, to_sql(buckets[0][2]), to_sql(buckets[-1][3])],
+        )
+        if granularity != TrendGranularity.WEEKLY:
+            return {row["period"]: row["total"] for row in rows}
+        totals = {}
+        for row in rows:
+            key = trend_bucket_key(datetime.strptime(row["period"], "%Y-%m-%d"), granularity)
+            totals[key] = totals.get(key, 0) + row["total"]
+        return totals
+    
+    async def explain_queries(self):
+        results = []
+        for shape in explain_query_shapes():
+            if "pipeline" in shape:
+                continue
+            table = self.engine.tables[shape["collection"]]
+            try:
+                where = where_clause(table, shape["filter"])
+            except ValueError:
+                continue  # Filters on search_terms, which SQLite does without
+            stages = await self.engine.run(lambda connection: query_plan(connection, table, where, shape.get("sort")))
+            results.append({
+                "name": shape["name"],
+                "collection": shape["collection"],
+                "stages": stages,
+                "collscan": any(stage == f"SCAN {table.name}" for stage in stages),
+            })
+        return results
+    
+    def close(self):
+        self.engine.close()
+
+def open_storage() -> Storage:
+    """Open the STORAGE_BACKEND storage unless one is already installed."""
+    global storage
+    if storage is None:
+        if STORAGE_BACKEND == "sqlite":
+            storage = SQLiteStorage(SQLITE_PATH)
+        elif STORAGE_BACKEND == "mongo":
+            open_mongo()
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'")
+    return storage
+
+def close_storage() -> None:
+    global storage
+    if storage is not None:
+        storage.close()
+    storage = None
+
+# Batch writes
+MAX_BATCH_OPERATIONS = 1000
+
+async def run_batch(
+    repository: "Repository",
+    user_id: str,
+    operations: List[BatchOperation],
+    create_model: type,
+    update_model: type,
+    build_document,
+    soft_delete: bool,
+    track_rollups: bool = False,
+) -> BatchResult:
+    """Apply mixed create/update/delete operations on one user's documents with one write_many.
+
+    The targeted ids are read with a single $in query up front, to validate
+    operations and compute rollup changes. Each id may be targeted once per
+    batch: later operations on it fail with 409, since every change is
+    computed from the document as it was before the batch. A write that no
+    longer matched by the time it ran, because another request changed or
+    removed the document after the read, fails with 409 or 404.
+    """
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+    
+    report = BatchResult()
+    results = [None] * len(operations)
+    target_ids = {op.id for op in operations if op.op != BatchOperationType.CREATE and op.id}
+    existing = {}
+    if target_ids:
+        fields = ROLLUP_FIELDS + ["version"] if track_rollups else ["id", "version"]
+        for doc in await repository.find(user_id, {"id": {"$in": list(target_ids)}}, fields):
+            existing[doc["id"]] = doc
+    
+    writes = []
+    write_indexes = []
+    changes = []  # (old, new) document pair per write, for rollups
+    targeted = set()
+    for index, operation in enumerate(operations):
+        def fail(status: int, error: str, doc_id: Optional[str] = operation.id):
+            results[index] = BatchItemResult(index=index, op=operation.op, id=doc_id, status=status, error=error)
+        
+        if operation.op != BatchOperationType.CREATE and operation.id:
+            if operation.id in targeted:
+                fail(409, "id already targeted earlier in this batch")
+                continue
+            targeted.add(operation.id)
+        
+        try:
+            if operation.op == BatchOperationType.CREATE:
+                doc = build_document(create_model(**(operation.data or {})))
+                writes.append(("insert", doc))
+                changes.append((None, doc))
+                results[index] = BatchItemResult(index=index, op=operation.op, id=doc["id"], status=201)
+            elif operation.id not in existing:
+                fail(404, "Not found" if operation.id else "id is required")
+                continue
+            elif operation.op == BatchOperationType.UPDATE:
+                update_data = update_model(**(operation.data or {}))
+                if update_data.version is not None and update_data.version != existing[operation.id].get("version"):
+                    fail(409, "Modified by another request")
+                    continue
+                update_dict = build_update_dict(update_data)
+                results[index] = BatchItemResult(index=index, op=operation.op, id=operation.id, status=200)
+                if not update_dict:
+                    continue
+                expected = {"version": update_data.version} if update_data.version is not None else {}
+                writes.append(("update", operation.id, expected, update_dict))
+                changes.append((existing[operation.id], apply_update_locally(existing[operation.id], update_dict)))
+            elif soft_delete:
+                writes.append(("deactivate", operation.id))
+                changes.append((None, None))
+                results[index] = BatchItemResult(index=index, op=operation.op, id=operation.id, status=200)
+            else:
+                writes.append(("delete", operation.id))
+                changes.append((existing[operation.id], None))
+                results[index] = BatchItemResult(index=index, op=operation.op, id=operation.id, status=200)
+        except ValidationError as e:
+            fail(422, _format_validation_error(e))
+            continue
+        write_indexes.append(index)
+    
+    if writes:
+        outcome = await repository.write_many(user_id, writes)
+        for write_index, (status, message) in outcome.errors.items():
+            result = results[write_indexes[write_index]]
+            result.status = status
+            result.error = message
+        # The document changed or went away between the $in read and the write
+        for write_index in outcome.unmatched:
+            result = results[write_indexes[write_index]]
+            if writes[write_index][0] == "update" and writes[write_index][2]:
+                result.status, result.error = 409, "Modified by another request"
+            else:
+                result.status, result.error = 404, "Not found"
+        if track_rollups:
+            skipped = set(outcome.errors) | outcome.unmatched | outcome.uncertain
+            await storage.apply_rollup_changes([
+                change for i, change in enumerate(changes) if i not in skipped
+            ])
+            if outcome.uncertain:  # Gone either way, but maybe by another request that counted them
+                await storage.reconcile_rollup_changes([changes[i] for i in outcome.uncertain])
+    
+    for result in results:
+        if result.error:
+            report.failed += 1
+        elif result.op == BatchOperationType.CREATE:
+            report.created += 1
+        elif result.op == BatchOperationType.UPDATE:
+            report.updated += 1
+        else:
+            report.deleted += 1
+    report.results = results
+    return report
 
 # Subscription endpoints
 @api_router.post("/subscriptions", response_model=Subscription)
-async def create_subscription(subscription_data: SubscriptionCreate):
+async def create_subscription(subscription_data: SubscriptionCreate, user_id: str = Depends(get_user_id)):
     subscription = Subscription(**subscription_data.dict())
-    result = await db.subscriptions.insert_one(subscription.dict())
+    await storage.subscriptions.insert(subscription_document(subscription, user_id))
     return subscription
 
-@api_router.get("/subscriptions", response_model=List[Subscription])
+@api_router.post("/subscriptions/batch", response_model=BatchResult)
+async def batch_subscriptions(batch: BatchRequest, user_id: str = Depends(get_user_id)):
+    return await run_batch(
+        storage.subscriptions, user_id, batch.operations, SubscriptionCreate, SubscriptionUpdate,
+        lambda data: subscription_document(Subscription(**data.dict()), user_id),
+        soft_delete=True,
+    )
+
+@api_router.get("/subscriptions", response_model=List[Union[Subscription, PartialSubscription]])
 async def get_subscriptions(
     search: Optional[str] = Query(None, description="Search subscriptions by name"),
     category: Optional[str] = Query(None, description="Filter by category"),
-    active_only: bool = Query(True, description="Show only active subscriptions")
+    active_only: bool = Query(True, description="Show only active subscriptions"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,cost,next_due_date"),
+    sort: SubscriptionSortField = Query(SubscriptionSortField.NEXT_DUE_DATE, description="Sort field; monthly_cost is also returned on each row"),
+    order: SortOrder = Query(SortOrder.ASC, description="Sort direction"),
+    top: Optional[int] = Query(None, ge=1, le=MAX_TOP_N, description="Return only the top N rows by `by`, highest first"),
+    by: SubscriptionSortField = Query(SubscriptionSortField.MONTHLY_COST, description="Ranking field for `top`; monthly_cost is also returned on each row"),
+    user_id: str = Depends(get_user_id)
 ):
+    selected = select_fields(Subscription, fields)
     filter_dict = {}
     if active_only:
         filter_dict["is_active"] = True
     if category:
         filter_dict["category"] = category
+    if top:
+        sort, order = by, SortOrder.DESC
+    # Ordered by (sort, id); searches put the best matches first
+    sort_spec = build_sort(sort.value, order)
     
-    subscriptions = await db.subscriptions.find(filter_dict).to_list(1000)
+    def shape(docs):
+        rows = trusted_documents(Subscription, docs, selected)
+        if sort == SubscriptionSortField.MONTHLY_COST:  # Computed for the sort, so clients can see the ranking
+            for row, doc in zip(rows, docs):
+                row[sort.value] = doc[sort.value]
+        return rows
     
-    # Apply search filter
-    if search:
-        subscriptions = [
-            sub for sub in subscriptions 
-            if search.lower() in sub.get("name", "").lower()
-        ]
+    if top:
+        subscriptions = await storage.subscriptions.top(user_id, filter_dict, sort_spec, selected, top, search)
+        return ORJSONResponse(shape(subscriptions))
     
-    return [Subscription(**sub) for sub in subscriptions]
+    subscriptions, next_cursor = await storage.subscriptions.page(
+        user_id, filter_dict, sort_spec, selected, limit, cursor, search
+    )
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return ORJSONResponse(shape(subscriptions), headers=headers)
 
 @api_router.get("/subscriptions/{subscription_id}", response_model=Subscription)
-async def get_subscription(subscription_id: str):
-    subscription = await db.subscriptions.find_one({"id": subscription_id})
+async def get_subscription(subscription_id: str, user_id: str = Depends(get_user_id)):
+    subscription = await storage.subscriptions.find_one(user_id, subscription_id)
     if not subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
     return Subscription(**subscription)
 
 @api_router.put("/subscriptions/{subscription_id}", response_model=Subscription)
-async def update_subscription(subscription_id: str, update_data: SubscriptionUpdate):
-    existing = await db.subscriptions.find_one({"id": subscription_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Subscription not found")
-    
-    update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
-    if update_dict:
-        await db.subscriptions.update_one({"id": subscription_id}, {"$set": update_dict})
-    
-    updated = await db.subscriptions.find_one({"id": subscription_id})
+async def update_subscription(
+    subscription_id: str, update_data: SubscriptionUpdate, user_id: str = Depends(get_user_id)
+):
+    updated = await storage.subscriptions.update(user_id, subscription_id, update_data, "Subscription")
     return Subscription(**updated)
 
 @api_router.delete("/subscriptions/{subscription_id}")
-async def delete_subscription(subscription_id: str):
-    result = await db.subscriptions.update_one(
-        {"id": subscription_id}, 
-        {"$set": {"is_active": False}}
-    )
-    if result.matched_count == 0:
+async def delete_subscription(subscription_id: str, user_id: str = Depends(get_user_id)):
+    if not await storage.subscriptions.deactivate(user_id, subscription_id):
         raise HTTPException(status_code=404, detail="Subscription not found")
     return {"message": "Subscription deleted successfully"}
 
 # Expense endpoints
 @api_router.post("/expenses", response_model=Expense)
-async def create_expense(expense_data: ExpenseCreate):
-    expense_dict = expense_data.dict()
-    
-    # Set next due date for recurring expenses
-    if expense_dict.get("is_recurring") and expense_dict.get("recurring_frequency"):
-        expense_dict["next_due_date"] = calculate_next_expense_date(
-            expense_dict["date"], 
-            expense_dict["recurring_frequency"]
-        )
-    
-    expense = Expense(**expense_dict)
-    result = await db.expenses.insert_one(expense.dict())
+async def create_expense(expense_data: ExpenseCreate, user_id: str = Depends(get_user_id)):
+    expense = new_expense(expense_data)
+    doc = expense_document(expense, user_id)
+    await storage.expenses.insert(doc)
+    await storage.apply_rollup_changes([(None, doc)])
     return expense
 
-@api_router.get("/expenses", response_model=List[Expense])
+@api_router.post("/expenses/batch", response_model=BatchResult)
+async def batch_expenses(batch: BatchRequest, user_id: str = Depends(get_user_id)):
+    return await run_batch(
+        storage.expenses, user_id, batch.operations, ExpenseCreate, ExpenseUpdate,
+        lambda data: expense_document(new_expense(data), user_id),
+        soft_delete=False,
+        track_rollups=True,
+    )
+
+@api_router.get("/expenses", response_model=List[Union[Expense, PartialExpense]])
 async def get_expenses(
     search: Optional[str] = Query(None, description="Search expenses by name"),
     category: Optional[str] = Query(None, description="Filter by category"),
     start_date: Optional[datetime] = Query(None, description="Filter expenses from this date"),
     end_date: Optional[datetime] = Query(None, description="Filter expenses to this date"),
-    recurring_only: Optional[bool] = Query(None, description="Show only recurring expenses")
+    recurring_only: Optional[bool] = Query(None, description="Show only recurring expenses"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,amount,date"),
+    sort: ExpenseSortField = Query(ExpenseSortField.DATE, description="Sort field"),
+    order: SortOrder = Query(SortOrder.DESC, description="Sort direction"),
+    top: Optional[int] = Query(None, ge=1, le=MAX_TOP_N, description="Return only the top N rows by `by`, highest first"),
+    by: ExpenseSortField = Query(ExpenseSortField.AMOUNT, description="Ranking field for `top`"),
+    user_id: str = Depends(get_user_id)
 ):
+    selected = select_fields(Expense, fields)
     filter_dict = {}
     if category:
         filter_dict["category"] = category
@@ -311,130 +2275,431 @@ async def get_expenses(
             filter_dict["date"] = {"$lte": end_date}
     if recurring_only is not None:
         filter_dict["is_recurring"] = recurring_only
+    if top:
+        sort, order = by, SortOrder.DESC
+    # Ordered by (sort, id), newest first by default; searches put the best matches first
+    sort_spec = build_sort(sort.value, order)
     
-    expenses = await db.expenses.find(filter_dict).to_list(1000)
+    if top:
+        expenses = await storage.expenses.top(user_id, filter_dict, sort_spec, selected, top, search)
+        return ORJSONResponse(trusted_documents(Expense, expenses, selected))
     
-    # Apply search filter
-    if search:
-        expenses = [
-            exp for exp in expenses 
-            if search.lower() in exp.get("name", "").lower()
-        ]
-    
-    return [Expense(**exp) for exp in expenses]
+    expenses, next_cursor = await storage.expenses.page(
+        user_id, filter_dict, sort_spec, selected, limit, cursor, search
+    )
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return ORJSONResponse(trusted_documents(Expense, expenses, selected), headers=headers)
 
 @api_router.get("/expenses/{expense_id}", response_model=Expense)
-async def get_expense(expense_id: str):
-    expense = await db.expenses.find_one({"id": expense_id})
+async def get_expense(expense_id: str, user_id: str = Depends(get_user_id)):
+    expense = await storage.expenses.find_one(user_id, expense_id)
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     return Expense(**expense)
 
 @api_router.put("/expenses/{expense_id}", response_model=Expense)
-async def update_expense(expense_id: str, update_data: ExpenseUpdate):
-    existing = await db.expenses.find_one({"id": expense_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Expense not found")
-    
-    update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
-    if update_dict:
-        await db.expenses.update_one({"id": expense_id}, {"$set": update_dict})
-    
-    updated = await db.expenses.find_one({"id": expense_id})
+async def update_expense(expense_id: str, update_data: ExpenseUpdate, user_id: str = Depends(get_user_id)):
+    previous = []
+    updated = await storage.expenses.update(user_id, expense_id, update_data, "Expense", previous)
+    if previous:
+        await storage.apply_rollup_changes([(previous[0], updated)])
     return Expense(**updated)
 
 @api_router.delete("/expenses/{expense_id}")
-async def delete_expense(expense_id: str):
-    result = await db.expenses.delete_one({"id": expense_id})
-    if result.deleted_count == 0:
+async def delete_expense(expense_id: str, user_id: str = Depends(get_user_id)):
+    deleted = await storage.expenses.delete(user_id, expense_id, ROLLUP_FIELDS)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Expense not found")
+    await storage.apply_rollup_changes([(deleted, None)])
     return {"message": "Expense deleted successfully"}
 
 # Budget endpoints
 @api_router.post("/budgets", response_model=Budget)
-async def create_budget(budget_data: BudgetCreate):
-    # Delete existing budget of same type/category
+async def create_budget(budget_data: BudgetCreate, user_id: str = Depends(get_user_id)):
+    # Delete the user's existing budget of same type/category
     if budget_data.type == BudgetType.ANNUAL:
-        await db.budgets.delete_many({"type": "annual"})
+        await storage.budgets.delete_many(user_id, {"type": "annual"})
     else:
-        await db.budgets.delete_many({"type": "category", "category": budget_data.category})
+        await storage.budgets.delete_many(user_id, {"type": "category", "category": budget_data.category})
     
     budget = Budget(**budget_data.dict())
-    result = await db.budgets.insert_one(budget.dict())
+    await storage.budgets.insert(budget_document(budget, user_id))
     return budget
 
-@api_router.get("/budgets", response_model=List[Budget])
-async def get_budgets():
-    budgets = await db.budgets.find().to_list(1000)
-    return [Budget(**budget) for budget in budgets]
+@api_router.get("/budgets", response_model=List[Union[Budget, PartialBudget]])
+async def get_budgets(
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. type,amount,category"),
+    user_id: str = Depends(get_user_id)
+):
+    selected = select_fields(Budget, fields)
+    budgets = await storage.budgets.find(user_id, fields=selected)
+    return ORJSONResponse(trusted_documents(Budget, budgets, selected))
 
 @api_router.get("/budgets/{budget_id}", response_model=Budget)
-async def get_budget(budget_id: str):
-    budget = await db.budgets.find_one({"id": budget_id})
+async def get_budget(budget_id: str, user_id: str = Depends(get_user_id)):
+    budget = await storage.budgets.find_one(user_id, budget_id)
     if not budget:
         raise HTTPException(status_code=404, detail="Budget not found")
     return Budget(**budget)
 
 @api_router.put("/budgets/{budget_id}", response_model=Budget)
-async def update_budget(budget_id: str, update_data: BudgetUpdate):
-    existing = await db.budgets.find_one({"id": budget_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Budget not found")
-    
-    update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
-    if update_dict:
-        await db.budgets.update_one({"id": budget_id}, {"$set": update_dict})
-    
-    updated = await db.budgets.find_one({"id": budget_id})
+async def update_budget(budget_id: str, update_data: BudgetUpdate, user_id: str = Depends(get_user_id)):
+    updated = await storage.budgets.update(user_id, budget_id, update_data, "Budget")
     return Budget(**updated)
 
 @api_router.delete("/budgets/{budget_id}")
-async def delete_budget(budget_id: str):
-    result = await db.budgets.delete_one({"id": budget_id})
-    if result.deleted_count == 0:
+async def delete_budget(budget_id: str, user_id: str = Depends(get_user_id)):
+    if not await storage.budgets.delete(user_id, budget_id, ["id"]):
         raise HTTPException(status_code=404, detail="Budget not found")
     return {"message": "Budget deleted successfully"}
 
+# Response cache
+class CacheBackend(ABC):
+    """Storage for computed responses; subclass to plug in another store."""
+    
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        """Return the cached value, or CACHE_MISS."""
+        raise NotImplementedError
+    
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+    
+    @abstractmethod
+    def clear(self) -> None:
+        raise NotImplementedError
+    
+    def __len__(self) -> int:
+        return 0
+
+CACHE_MISS = object()
+
+class LRUCacheBackend(CacheBackend):
+    """In-process LRU with a per-entry TTL."""
+    
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+    
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return CACHE_MISS
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return CACHE_MISS
+        self._entries.move_to_end(key)
+        return value
+    
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self) -> None:
+        self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class ResponseCache:
+    """Caches computed analytics until the next write.
+
+    Every invalidation bumps a generation counter; a value computed while a
+    write landed is returned but not stored, so it cannot outlive the write.
+    Values cached for a user are keyed by that user's generation as well, so
+    a write by one user only invalidates their own entries; the superseded
+    ones are never read again and age out of the backend.
+    
+    User generations are numbered from one sequence shared by all users and
+    only the `max_users` most recent writers are tracked. A user dropped from
+    the tracking falls back to the highest generation dropped so far, which
+    is never lower than their own, so their stale entries stay unreachable.
+    """
+    
+    def __init__(self, backend: CacheBackend, max_users: int = 10000):
+        self.backend = backend
+        self.max_users = max_users
+        self.generation = 0
+        self.sequence = 0  # Last generation handed to a user
+        self.user_generations = OrderedDict()  # user_id -> generation, least recent writer first
+        self.dropped_generation = 0  # Highest generation dropped from user_generations
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def _generation(self, user_id: Optional[str]) -> Tuple[int, int]:
+        if not user_id:
+            return self.generation, 0
+        return self.generation, self.user_generations.get(user_id, self.dropped_generation)
+    
+    async def get_or_compute(self, key: str, compute, user_id: Optional[str] = None):
+        generation = self._generation(user_id)
+        if user_id:
+            key = f"{key}:{user_id}:{generation[1]}"
+        value = self.backend.get(key)
+        if value is not CACHE_MISS:
+            self.hits += 1
+            return value
+        
+        self.misses += 1
+        value = await compute()
+        if generation == self._generation(user_id):
+            self.backend.set(key, value)
+        return value
+    
+    def invalidate(self, user_id: Optional[str] = None) -> None:
+        """Drop one user's cached values, or everyone's when user_id is None."""
+        self.invalidations += 1
+        if user_id:
+            self.sequence += 1
+            self.user_generations[user_id] = self.sequence
+            self.user_generations.move_to_end(user_id)
+            while len(self.user_generations) > self.max_users:
+                _, dropped = self.user_generations.popitem(last=False)
+                self.dropped_generation = max(self.dropped_generation, dropped)
+            return
+        self.generation += 1
+        self.backend.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": getattr(self.backend, "evictions", 0),
+            "tracked_users": len(self.user_generations),
+        }
+
+response_cache = ResponseCache(
+    LRUCacheBackend(
+        max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256")),
+        ttl_seconds=float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "60")),
+    ),
+    max_users=int(os.environ.get("RESPONSE_CACHE_MAX_USERS", "10000")),
+)
+
+# Per-user, per-collection change counters behind weak ETags; the None user
+# counts writes made for everyone at once. They live in-process, so ETags
+# assume a single worker, like the response cache above (see check_single_worker).
+BOOT_ID = uuid.uuid4().hex[:8]
+ALL_COLLECTIONS = ("subscriptions", "expenses", "budgets")
+change_counters: Dict[Tuple[Optional[str], str], int] = {}
+
+# Non-GET requests under these prefixes write to the listed collections
+WRITE_PREFIXES = [
+    ("/api/subscriptions", ("subscriptions",)),
+    ("/api/expenses", ("expenses",)),
+    ("/api/budgets", ("budgets",)),
+    ("/api/import", ALL_COLLECTIONS),
+]
+
+# GET prefixes -> (collections the response depends on, whether it also moves with time)
+ETAG_PREFIXES = [
+    ("/api/dashboard", ALL_COLLECTIONS, True),
+    ("/api/suggestions", ALL_COLLECTIONS, True),
+    ("/api/trends", ("subscriptions", "expenses"), True),
+    ("/api/forecast", ("subscriptions", "expenses"), True),
+    ("/api/subscriptions", ("subscriptions",), False),
+    ("/api/expenses", ("expenses",), False),
+    ("/api/budgets", ("budgets",), False),
+    ("/api/export", ALL_COLLECTIONS, False),
+    ("/api/categories", (), False),
+]
+
+def record_write(user_id: Optional[str], *collections: str) -> None:
+    """Bump change counters and drop cached analytics after a write by `user_id`, or for everyone."""
+    for collection_name in collections:
+        change_counters[user_id, collection_name] = change_counters.get((user_id, collection_name), 0) + 1
+    response_cache.invalidate(user_id)
+
+def _match_prefix(path: str, prefixes):
+    for entry in prefixes:
+        prefix = entry[0]
+        if path == prefix or path.startswith(prefix + "/"):
+            return entry
+    return None
+
+def compute_etag(request: Request) -> Optional[str]:
+    """Weak ETag for a GET, computed without touching the database."""
+    entry = _match_prefix(request.url.path, ETAG_PREFIXES)
+    if entry is None:
+        return None
+    _, collections, time_sensitive = entry
+    user_id = request_user_id(request)
+    parts = [BOOT_ID, user_id, request.url.path, request.url.query]
+    parts += [
+        f"{name}:{change_counters.get((None, name), 0)}:{change_counters.get((user_id, name), 0)}"
+        for name in collections
+    ]
+    if time_sensitive:
+        # Date windows move with the clock; roll over with the response cache TTL
+        ttl = getattr(response_cache.backend, "ttl_seconds", 60) or 60
+        parts.append(str(int(time.time() // ttl)))
+    digest = hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" are equivalent
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == wanted:
+            return True
+    return False
+
 # Analytics endpoints
+def get_dashboard_windows(now: datetime) -> Dict[str, datetime]:
+    current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return {
+        "current_month_start": current_month_start,
+        "current_year_start": now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0),
+        "last_month_start": current_month_start - relativedelta(months=1),
+        "next_month_start": current_month_start + relativedelta(months=1),
+        "trend_start": current_month_start - relativedelta(months=5),
+        "upcoming_cutoff": now + timedelta(days=7),
+    }
+
+TREND_SUBSCRIPTION_FIELDS = ["cost", "billing_frequency", "created_at", "cancelled_at", "is_active"]
+
+def trend_subscription_filter(user_id: str, start: datetime) -> Dict[str, Any]:
+    """A user's subscriptions that were active at some point since `start`.
+
+    user_id is repeated in each branch so both can use a user_id-led index.
+    """
+    return {"$or": [
+        owned_by(user_id, {"is_active": True}),
+        owned_by(user_id, {"cancelled_at": {"$gte": start}}),
+    ]}
+
+def build_dashboard_pipeline(
+    user_id: str, windows: Dict[str, datetime], include_rollups: bool = True
+) -> List[Dict[str, Any]]:
+    """Single round-trip pipeline run against `expenses`, covering one user's documents.
+
+    Only recurring expenses due soon are read from `expenses` itself; spending
+    totals come from `monthly_rollups`, and subscriptions active during the
+    trend window and budgets are pulled in with $unionWith. Rows are tagged with `_kind` so one $facet
+    produces every dashboard figure, and the cost follows the number of
+    (month, category) buckets instead of the whole expense history.
+    With include_rollups=False the expense facets come back empty, for when
+    they are computed from expense_columns instead.
+    """
+    month = month_key(windows["current_month_start"])
+    year_start = month_key(windows["current_year_start"])
+    last_month = month_key(windows["last_month_start"])
+    trend_start = month_key(windows["trend_start"])
+    cutoff = windows["upcoming_cutoff"]
+    earliest = min(year_start, last_month, trend_start)
+
+    def total_where(condition):
+        return {"$sum": {"$cond": [condition, "$total", 0]}}
+
+    rollups = [
+        {"$unionWith": {"coll": "monthly_rollups", "pipeline": [
+            {"$match": owned_by(user_id, {"month": {"$gte": earliest}})},
+            {"$set": {"_kind": "rollup"}},
+        ]}},
+    ] if include_rollups else []
+
+    return [
+        {"$match": owned_by(user_id, {"is_recurring": True, "next_due_date": {"$lte": cutoff}})},
+        {"$set": {"_kind": "expense"}},
+        *rollups,
+        {"$unionWith": {"coll": "subscriptions", "pipeline": [
+            {"$match": trend_subscription_filter(user_id, windows["trend_start"])},
+            {"$set": {"_kind": "subscription"}},
+        ]}},
+        {"$unionWith": {"coll": "budgets", "pipeline": [
+            {"$match": owned_by(user_id, {"type": {"$in": [budget_type.value for budget_type in BudgetType]}})},
+            {"$set": {"_kind": "budget"}},
+        ]}},
+        {"$facet": {
+            "subscription_categories": [
+                {"$match": {"_kind": "subscription", "is_active": True}},
+                {"$group": {"_id": "$category", "total": {"$sum": MONTHLY_COST_EXPR}}},
+            ],
+            "upcoming_subscriptions": [
+                {"$match": {"_kind": "subscription", "is_active": True, "next_due_date": {"$lte": cutoff}}},
+                {"$project": {"_id": 0, "_kind": 0}},
+            ],
+            "trend_subscriptions": [
+                {"$match": {"_kind": "subscription"}},
+                {"$project": model_projection(Subscription, TREND_SUBSCRIPTION_FIELDS)},
+            ],
+            "expense_totals": [
+                {"$match": {"_kind": "rollup"}},
+                {"$group": {
+                    "_id": None,
+                    "month": total_where({"$gte": ["$month", month]}),
+                    "year": total_where({"$gte": ["$month", year_start]}),
+                    "last_month": total_where({"$eq": ["$month", last_month]}),
+                }},
+            ],
+            "expense_categories": [
+                {"$match": {"_kind": "rollup", "month": {"$gte": month}}},
+                {"$group": {"_id": "$category", "total": {"$sum": "$total"}}},
+            ],
+            "expense_trends": [
+                {"$match": {"_kind": "rollup", "month": {"$gte": trend_start, "$lte": month}}},
+                {"$group": {"_id": "$month", "total": {"$sum": "$total"}}},
+            ],
+            "upcoming_expenses": [
+                {"$match": {"_kind": "expense"}},
+                {"$project": {"_id": 0, "_kind": 0}},
+            ],
+            "budgets": [
+                {"$match": {"_kind": "budget"}},
+                {"$project": {"_id": 0, "_kind": 0}},
+            ],
+        }},
+    ]
+
 @api_router.get("/dashboard", response_model=DashboardStats)
-async def get_dashboard_stats():
-    # Get current month and year
+async def get_dashboard_stats(user_id: str = Depends(get_user_id)):
+    return ORJSONResponse(await response_cache.get_or_compute(
+        "dashboard", lambda: compute_dashboard_stats(user_id), user_id
+    ))
+
+async def compute_dashboard_stats(user_id: str) -> Dict[str, Any]:
+    """DashboardStats as a plain dict, built from trusted documents without model validation."""
     now = datetime.utcnow()
-    current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    current_year_start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-    last_month_start = (current_month_start - relativedelta(months=1))
-    last_month_end = current_month_start - timedelta(seconds=1)
-    
-    # Get all active subscriptions
-    subscriptions = await db.subscriptions.find({"is_active": True}).to_list(1000)
-    subscription_objects = [Subscription(**sub) for sub in subscriptions]
-    
-    # Get all expenses
-    expenses = await db.expenses.find().to_list(1000)
-    expense_objects = [Expense(**exp) for exp in expenses]
+    windows = get_dashboard_windows(now)
     
+    columnar = expense_columns.loaded
+    facets = await storage.analytics.dashboard_facets(user_id, windows, include_expenses=not columnar)
+    if columnar:
+        facets.update(columnar_expense_facets(expense_columns.for_user(user_id), windows))
+    return dashboard_from_facets(facets, now)
+
+def dashboard_from_facets(facets: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """Every dashboard figure from the $facet output, with no I/O."""
     # Calculate subscription spending
-    monthly_subscription_cost = sum(
-        get_monthly_cost(sub.cost, sub.billing_frequency) 
-        for sub in subscription_objects
-    )
+    subscription_categories = {
+        row["_id"]: row["total"] for row in facets.get("subscription_categories", [])
+    }
+    monthly_subscription_cost = sum(subscription_categories.values())
     yearly_subscription_cost = monthly_subscription_cost * 12
     
     # Calculate expense spending
-    monthly_expenses = sum(
-        exp.amount for exp in expense_objects 
-        if exp.date >= current_month_start
-    )
-    yearly_expenses = sum(
-        exp.amount for exp in expense_objects 
-        if exp.date >= current_year_start
-    )
+    expense_totals = (facets.get("expense_totals") or [{}])[0]
+    monthly_expenses = expense_totals.get("month", 0)
+    yearly_expenses = expense_totals.get("year", 0)
     
     # Calculate last month's spending for savings calculation
-    last_month_expenses = sum(
-        exp.amount for exp in expense_objects 
-        if last_month_start <= exp.date <= last_month_end
-    )
+    last_month_expenses = expense_totals.get("last_month", 0)
     last_month_total = monthly_subscription_cost + last_month_expenses
     current_month_total = monthly_subscription_cost + monthly_expenses
     savings_this_month = last_month_total - current_month_total
@@ -444,56 +2709,38 @@ async def get_dashboard_stats():
     total_yearly_spending = yearly_subscription_cost + yearly_expenses
     yearly_projection = total_monthly_spending * 12
     
-    # Upcoming subscriptions (next 7 days)
-    upcoming_cutoff = now + timedelta(days=7)
-    upcoming_subscriptions = [
-        sub for sub in subscription_objects 
-        if sub.next_due_date <= upcoming_cutoff
-    ]
-    
-    # Upcoming recurring expenses (next 7 days)
-    upcoming_expenses = [
-        exp for exp in expense_objects 
-        if exp.is_recurring and exp.next_due_date and exp.next_due_date <= upcoming_cutoff
-    ]
-    
-    # Category breakdown
-    category_breakdown = {}
+    # Upcoming subscriptions and recurring expenses (next 7 days)
+    upcoming_subscriptions = trusted_documents(Subscription, facets.get("upcoming_subscriptions", []))
+    upcoming_expenses = trusted_documents(Expense, facets.get("upcoming_expenses", []))
     
-    # Add subscription categories
-    for sub in subscription_objects:
-        monthly_cost = get_monthly_cost(sub.cost, sub.billing_frequency)
-        if sub.category.value not in category_breakdown:
-            category_breakdown[sub.category.value] = 0
-        category_breakdown[sub.category.value] += monthly_cost
-    
-    # Add expense categories (current month)
-    for exp in expense_objects:
-        if exp.date >= current_month_start:
-            if exp.category.value not in category_breakdown:
-                category_breakdown[exp.category.value] = 0
-            category_breakdown[exp.category.value] += exp.amount
+    # Category breakdown (subscriptions monthly + expenses current month)
+    category_breakdown = dict(subscription_categories)
+    for row in facets.get("expense_categories", []):
+        category_breakdown[row["_id"]] = category_breakdown.get(row["_id"], 0) + row["total"]
     
     # Budget alerts
     budget_alerts = []
-    budgets = await db.budgets.find().to_list(1000)
-    
-    for budget_doc in budgets:
-        budget = Budget(**budget_doc)
-        if budget.type == BudgetType.ANNUAL:
-            if budget.period == "yearly" and yearly_projection > budget.amount:
-                budget_alerts.append(f"⚠️ Annual budget exceeded! Projected: ₹{yearly_projection:,.0f}, Budget: ₹{budget.amount:,.0f}")
-            elif budget.period == "monthly" and total_monthly_spending > budget.amount:
-                budget_alerts.append(f"⚠️ Monthly budget exceeded! Spent: ₹{total_monthly_spending:,.0f}, Budget: ₹{budget.amount:,.0f}")
+    
+    for budget in trusted_documents(Budget, facets.get("budgets", [])):
+        if budget["type"] == BudgetType.ANNUAL:
+            if budget["period"] == "yearly" and yearly_projection > budget["amount"]:
+                budget_alerts.append(f"⚠️ Annual budget exceeded! Projected: ₹{yearly_projection:,.0f}, Budget: ₹{budget['amount']:,.0f}")
+            elif budget["period"] == "monthly" and total_monthly_spending > budget["amount"]:
+                budget_alerts.append(f"⚠️ Monthly budget exceeded! Spent: ₹{total_monthly_spending:,.0f}, Budget: ₹{budget['amount']:,.0f}")
         else:  # Category budget
-            category_spending = category_breakdown.get(budget.category, 0)
-            if category_spending > budget.amount:
-                budget_alerts.append(f"⚠️ {budget.category.title()} budget exceeded! Spent: ₹{category_spending:,.0f}, Budget: ₹{budget.amount:,.0f}")
+            category_spending = category_breakdown.get(budget["category"], 0)
+            if category_spending > budget["amount"]:
+                budget_alerts.append(f"⚠️ {budget['category'].title()} budget exceeded! Spent: ₹{category_spending:,.0f}, Budget: ₹{budget['amount']:,.0f}")
     
-    # Get spending trends
-    spending_trends = get_spending_trends(subscription_objects, expense_objects)
+    # Get spending trends (last 6 months)
+    buckets = build_trend_buckets(now, 6, TrendGranularity.MONTHLY)
+    spending_trends = assemble_trends(
+        buckets,
+        {row["_id"]: row["total"] for row in facets.get("expense_trends", [])},
+        subscription_bucket_costs(facets.get("trend_subscriptions", []), buckets, TrendGranularity.MONTHLY),
+    )
     
-    return DashboardStats(
+    return dict(
         total_monthly_spending=total_monthly_spending,
         total_yearly_spending=total_yearly_spending,
         yearly_projection=yearly_projection,
@@ -504,35 +2751,90 @@ async def get_dashboard_stats():
         category_breakdown=category_breakdown,
         budget_alerts=budget_alerts,
         savings_this_month=savings_this_month,
-        spending_trends=spending_trends
+        spending_trends=[trend.model_dump() for trend in spending_trends]
+    )
+
+@api_router.get("/trends", response_model=List[SpendingTrend])
+async def get_trends(
+    months: int = Query(6, ge=1, le=MAX_TREND_MONTHS, description="Number of calendar months to cover"),
+    granularity: TrendGranularity = Query(TrendGranularity.MONTHLY, description="Bucket size"),
+    user_id: str = Depends(get_user_id)
+):
+    buckets = build_trend_buckets(datetime.utcnow(), months, granularity)
+    analytics = storage.analytics
+    subscription_filter = trend_subscription_filter(user_id, buckets[0][2])
+    
+    if expense_columns.loaded:
+        subscriptions = await analytics.subscriptions.find(user_id, subscription_filter, TREND_SUBSCRIPTION_FIELDS)
+        totals = expense_columns.for_user(user_id).bucket_totals([bucket[2] for bucket in buckets], granularity.value)
+        return assemble_trends(
+            buckets,
+            {bucket[0]: float(total) for bucket, total in zip(buckets, totals)},
+            subscription_bucket_costs(subscriptions, buckets, granularity),
+        )
+    
+    expense_totals, subscriptions = await asyncio.gather(
+        analytics.expense_totals(user_id, buckets, granularity),
+        analytics.subscriptions.find(user_id, subscription_filter, TREND_SUBSCRIPTION_FIELDS),
+    )
+    return assemble_trends(buckets, expense_totals, subscription_bucket_costs(subscriptions, buckets, granularity))
+
+MAX_FORECAST_MONTHS = 60
+
+@api_router.get("/forecast", response_model=Forecast)
+async def get_forecast(
+    months: int = Query(12, ge=1, le=MAX_FORECAST_MONTHS, description="Number of calendar months to project, starting with the current one"),
+    user_id: str = Depends(get_user_id)
+):
+    fields = ["next_due_date", "category"]
+    subscriptions, expenses = await asyncio.gather(
+        storage.analytics.subscriptions.find(
+            user_id, {"is_active": True}, fields + ["cost", "billing_frequency"]
+        ),
+        storage.analytics.expenses.find(
+            user_id, {"is_recurring": True, "next_due_date": {"$ne": None}}, fields + ["amount", "recurring_frequency"]
+        ),
+    )
+    expenses = [exp for exp in expenses if exp.get("recurring_frequency")]
+    
+    return project_cash_flow(
+        anchors=[sub["next_due_date"] for sub in subscriptions] + [exp["next_due_date"] for exp in expenses],
+        frequencies=[sub["billing_frequency"] for sub in subscriptions] + [exp["recurring_frequency"] for exp in expenses],
+        amounts=[sub["cost"] for sub in subscriptions] + [exp["amount"] for exp in expenses],
+        categories=[sub["category"] for sub in subscriptions] + [exp["category"] for exp in expenses],
+        is_subscription=[True] * len(subscriptions) + [False] * len(expenses),
+        start=datetime.utcnow(),
+        months=months,
     )
 
 # Smart suggestions endpoint
 @api_router.get("/suggestions")
-async def get_smart_suggestions():
+async def get_smart_suggestions(user_id: str = Depends(get_user_id)):
+    return await response_cache.get_or_compute("suggestions", lambda: compute_smart_suggestions(user_id), user_id)
+
+async def compute_smart_suggestions(user_id: str) -> Dict[str, List[str]]:
     # Get dashboard stats for analysis
-    stats = await get_dashboard_stats()
+    stats = await response_cache.get_or_compute("dashboard", lambda: compute_dashboard_stats(user_id), user_id)
     suggestions = []
     
-    # Get subscriptions sorted by cost
-    subscriptions = await db.subscriptions.find({"is_active": True}).to_list(1000)
-    subscription_objects = [Subscription(**sub) for sub in subscriptions]
-    
-    # Sort by monthly cost (highest first)
-    subscription_objects.sort(
-        key=lambda x: get_monthly_cost(x.cost, x.billing_frequency), 
-        reverse=True
+    # Most expensive subscriptions by monthly cost; four rows are enough to
+    # know whether there are more than three
+    subscriptions = await storage.analytics.subscriptions.top(
+        user_id,
+        {"is_active": True},
+        build_sort(SubscriptionSortField.MONTHLY_COST.value, SortOrder.DESC),
+        ["name", SubscriptionSortField.MONTHLY_COST.value],
+        4,
     )
     
     # Suggest canceling expensive subscriptions
-    if len(subscription_objects) > 3:
-        expensive_sub = subscription_objects[0]
-        monthly_cost = get_monthly_cost(expensive_sub.cost, expensive_sub.billing_frequency)
-        yearly_savings = monthly_cost * 12
-        suggestions.append(f"💡 Consider canceling '{expensive_sub.name}' to save ₹{yearly_savings:,.0f} per year")
+    if len(subscriptions) > 3:
+        expensive_sub = subscriptions[0]
+        yearly_savings = expensive_sub["monthly_cost"] * 12
+        suggestions.append(f"💡 Consider canceling '{expensive_sub['name']}' to save ₹{yearly_savings:,.0f} per year")
     
     # Analyze spending patterns
-    category_breakdown = stats.category_breakdown
+    category_breakdown = stats["category_breakdown"]
     if category_breakdown:
         # Find highest spending category
         highest_category = max(category_breakdown, key=category_breakdown.get)
@@ -542,24 +2844,101 @@ async def get_smart_suggestions():
             suggestions.append(f"📊 High spending detected in {highest_category.title()}: ₹{highest_amount:,.0f} this month")
     
     # Budget suggestions
-    if stats.yearly_projection > 100000:  # If yearly projection is high
+    if stats["yearly_projection"] > 100000:  # If yearly projection is high
         suggestions.append("💰 Consider setting category-wise budgets to better control spending")
     
     # Savings suggestions
-    if stats.savings_this_month > 0:
-        suggestions.append(f"🎉 Great job! You've saved ₹{stats.savings_this_month:,.0f} this month compared to last month")
-    elif stats.savings_this_month < -1000:
-        suggestions.append(f"⚠️ You're spending ₹{abs(stats.savings_this_month):,.0f} more this month than last month")
+    if stats["savings_this_month"] > 0:
+        suggestions.append(f"🎉 Great job! You've saved ₹{stats['savings_this_month']:,.0f} this month compared to last month")
+    elif stats["savings_this_month"] < -1000:
+        suggestions.append(f"⚠️ You're spending ₹{abs(stats['savings_this_month']):,.0f} more this month than last month")
     
     return {"suggestions": suggestions}
 
 # Export/Import endpoints
+EXPORT_BATCH_SIZE = 500
+RECORD_TYPE_FIELD = "record_type"
+CSV_LIST_SEPARATOR = ";"
+
+def get_export_collections() -> List[Tuple[str, str, type]]:
+    return [
+        ("subscription", "subscriptions", Subscription),
+        ("expense", "expenses", Expense),
+        ("budget", "budgets", Budget),
+    ]
+
+def get_export_columns() -> List[str]:
+    columns = [RECORD_TYPE_FIELD]
+    for _, _, model in get_export_collections():
+        columns += [field for field in model.model_fields if field not in columns]
+    return columns
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return CSV_LIST_SEPARATOR.join(str(item) for item in value)
+    return value
+
+async def iter_export_records(user_id: str):
+    """Yield a user's (record_type, document) pairs, reading each collection batch by batch."""
+    for record_type, collection_name, model in get_export_collections():
+        repository = storage.repository(collection_name)
+        async for doc in repository.scan(user_id, list(model.model_fields), EXPORT_BATCH_SIZE):
+            yield record_type, doc
+
+async def stream_ndjson_export(user_id: str):
+    lines = []
+    async for record_type, doc in iter_export_records(user_id):
+        lines.append(json.dumps({RECORD_TYPE_FIELD: record_type, **doc}, default=_json_default))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+async def stream_csv_export(user_id: str):
+    columns = get_export_columns()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    rows = 0
+    async for record_type, doc in iter_export_records(user_id):
+        doc[RECORD_TYPE_FIELD] = record_type
+        writer.writerow([_csv_value(doc.get(column)) for column in columns])
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
 @api_router.get("/export", response_model=ExportData)
-async def export_data():
+async def export_data(
+    format: DataFormat = Query(DataFormat.JSON, description="json, or ndjson/csv to stream rows as they are read"),
+    user_id: str = Depends(get_user_id)
+):
+    if format != DataFormat.JSON:
+        filename = f"nbntracker-export-{datetime.utcnow().strftime('%Y-%m-%d')}.{format.value}"
+        media_type = "application/x-ndjson" if format == DataFormat.NDJSON else "text/csv"
+        stream = stream_ndjson_export(user_id) if format == DataFormat.NDJSON else stream_csv_export(user_id)
+        return StreamingResponse(
+            stream,
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+    
     # Get all data
-    subscriptions = await db.subscriptions.find().to_list(1000)
-    expenses = await db.expenses.find().to_list(1000)
-    budgets = await db.budgets.find().to_list(1000)
+    subscriptions = await storage.subscriptions.find(user_id)
+    expenses = await storage.expenses.find(user_id)
+    budgets = await storage.budgets.find(user_id)
     
     subscription_objects = [Subscription(**sub) for sub in subscriptions]
     expense_objects = [Expense(**exp) for exp in expenses]
@@ -573,6 +2952,347 @@ async def export_data():
         total_records=len(subscription_objects) + len(expense_objects) + len(budget_objects)
     )
 
+MAX_IMPORT_ERRORS = 100
+IMPORT_SPOOL_SIZE = 8 * 1024 * 1024
+CSV_LIST_FIELDS = {"tags"}
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in item['loc'])}: {item['msg']}" for item in error.errors()
+    )
+
+def build_import_document(record_type: str, row: Dict[str, Any], user_id: str) -> Tuple[str, Dict[str, Any]]:
+    """Validate an imported row and return (collection name, document to store for `user_id`)."""
+    if record_type == "subscription":
+        create = SubscriptionCreate(**row)
+        return "subscriptions", subscription_document(Subscription(**{**row, **create.dict()}), user_id)
+    if record_type == "expense":
+        create = ExpenseCreate(**row)
+        return "expenses", expense_document(new_expense(create, **row), user_id)
+    if record_type == "budget":
+        create = BudgetCreate(**row)
+        return "budgets", budget_document(Budget(**{**row, **create.dict()}), user_id)
+    raise ValueError(f"Unknown record type '{record_type}'")
+
+def detect_import_format(request: Request) -> DataFormat:
+    content_type = request.headers.get("content-type", "")
+    if "csv" in content_type:
+        return DataFormat.CSV
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return DataFormat.NDJSON
+    if "json" in content_type:
+        return DataFormat.JSON
+    return DataFormat.NDJSON
+
+async def iter_ndjson_rows(request: Request):
+    buffer = b""
+    row_number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                row_number += 1
+                yield row_number, _parse_json_line(line)
+    if buffer.strip():
+        yield row_number + 1, _parse_json_line(buffer)
+
+def _parse_json_line(line: bytes) -> Any:
+    try:
+        row = json.loads(line)
+    except ValueError as e:
+        return ValueError(f"Invalid JSON: {e}")
+    return row if isinstance(row, dict) else ValueError("Row is not a JSON object")
+
+async def iter_csv_rows(request: Request):
+    # csv needs a file-like source for quoted multi-line fields, so the body is
+    # spooled (to disk past IMPORT_SPOOL_SIZE) and then read row by row.
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        reader = csv.DictReader(io.TextIOWrapper(spool, encoding="utf-8-sig", newline=""))
+        for row_number, row in enumerate(reader, start=1):
+            cleaned = {}
+            for key, value in row.items():
+                if key is None or value in (None, ""):
+                    continue
+                cleaned[key] = value.split(CSV_LIST_SEPARATOR) if key in CSV_LIST_FIELDS else value
+            yield row_number, cleaned
+
+async def iter_export_data_rows(request: Request):
+    try:
+        data = json.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Expected an ExportData object")
+    
+    row_number = 0
+    for record_type, collection_name, _ in get_export_collections():
+        for row in data.get(collection_name, []):
+            row_number += 1
+            if isinstance(row, dict):
+                row = {RECORD_TYPE_FIELD: record_type, **row}
+            else:
+                row = ValueError("Row is not a JSON object")
+            yield row_number, row
+
+@api_router.post("/import", response_model=ImportResult)
+async def import_data(
+    request: Request,
+    format: Optional[DataFormat] = Query(None, description="json (ExportData), ndjson or csv; inferred from Content-Type if omitted"),
+    default_record_type: str = Query("expense", description="Record type for rows without a record_type column"),
+    batch_size: int = Query(1000, ge=1, le=10000, description="Documents per bulk write"),
+    user_id: str = Depends(get_user_id)
+):
+    format = format or detect_import_format(request)
+    if format == DataFormat.CSV:
+        rows = iter_csv_rows(request)
+    elif format == DataFormat.NDJSON:
+        rows = iter_ndjson_rows(request)
+    else:
+        rows = iter_export_data_rows(request)
+    
+    report = ImportResult()
+    pending = {}  # collection name -> (writes, source row numbers, documents, ids)
+    
+    def record_error(row_number: int, message: str):
+        report.failed += 1
+        if len(report.errors) < MAX_IMPORT_ERRORS:
+            report.errors.append(ImportRowError(row=row_number, error=message))
+    
+    async def flush(collection_name: str):
+        writes, row_numbers, docs, _ = pending.pop(collection_name)
+        repository = storage.repository(collection_name)
+        
+        # Upserts may replace existing documents: their version moves past the
+        # stored one so updates based on the old document fail with 409, and
+        # replaced expenses take their old amounts out of the rollups
+        previous = {}
+        replaced_ids = [doc["id"] for doc, write in zip(docs, writes) if write[0] == "replace"]
+        if replaced_ids:
+            fields = ROLLUP_FIELDS + ["version"] if collection_name == "expenses" else ["id", "version"]
+            for doc in await repository.find(user_id, {"id": {"$in": replaced_ids}}, fields):
+                previous[doc["id"]] = doc
+        for doc in docs:
+            if doc["id"] in previous:
+                doc["version"] = previous[doc["id"]].get("version", 1) + 1
+        
+        result = await repository.write_many(user_id, writes)
+        report.created += result.created
+        report.updated += result.updated
+        for index, (_, message) in result.errors.items():
+            record_error(row_numbers[index], message)
+        
+        if collection_name == "expenses":
+            await storage.apply_rollup_changes([
+                (previous.get(doc["id"]), doc)
+                for i, doc in enumerate(docs)
+                if i not in result.errors
+            ])
+    
+    async for row_number, row in rows:
+        if isinstance(row, Exception):
+            record_error(row_number, str(row))
+            continue
+        
+        record_type = row.pop(RECORD_TYPE_FIELD, None) or default_record_type
+        has_id = bool(row.get("id"))
+        try:
+            collection_name, doc = build_import_document(record_type, row, user_id)
+        except ValidationError as e:
+            record_error(row_number, _format_validation_error(e))
+            continue
+        except (ValueError, TypeError) as e:
+            record_error(row_number, str(e))
+            continue
+        
+        # Rows carrying an id are upserted so re-importing an export is idempotent;
+        # an id owned by another user fails as a duplicate instead of replacing theirs.
+        # A repeated id flushes the batch first, so the later row replaces the
+        # earlier one as its previous document instead of both counting.
+        if collection_name in pending and doc["id"] in pending[collection_name][3]:
+            await flush(collection_name)
+        writes, row_numbers, docs, ids = pending.setdefault(collection_name, ([], [], [], set()))
+        ids.add(doc["id"])
+        writes.append(("replace", doc) if has_id else ("insert", doc))
+        row_numbers.append(row_number)
+        docs.append(doc)
+        if len(writes) >= batch_size:
+            await flush(collection_name)
+    
+    for collection_name in list(pending):
+        await flush(collection_name)
+    
+    return report
+
+# Diagnostics
+def _winning_plan_stages(explain: Any) -> List[str]:
+    """Collect every stage name below each winningPlan in an explain document."""
+    stages = []
+    
+    def walk_plan(plan):
+        if isinstance(plan, dict):
+            if "stage" in plan:
+                stages.append(plan["stage"])
+            for key in ("inputStage", "queryPlan"):
+                if key in plan:
+                    walk_plan(plan[key])
+            for child in plan.get("inputStages", []):
+                walk_plan(child)
+    
+    def find_plans(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "winningPlan":
+                    walk_plan(value)
+                else:
+                    find_plans(value)
+        elif isinstance(node, list):
+            for item in node:
+                find_plans(item)
+    
+    find_plans(explain)
+    return stages
+
+def explain_query_shapes() -> List[Dict[str, Any]]:
+    """Representative query shapes for each endpoint, with sample parameters."""
+    now = datetime.utcnow()
+    windows = get_dashboard_windows(now)
+    sample_id = str(uuid.uuid4())
+    user_id = LEGACY_USER_ID
+    return [
+        {"name": "get_subscription", "collection": "subscriptions", "filter": owned_by(user_id, {"id": sample_id})},
+        {"name": "get_subscriptions", "collection": "subscriptions",
+         "filter": owned_by(user_id, {"is_active": True}), "sort": [("next_due_date", 1), ("id", 1)]},
+        {"name": "get_subscriptions[category]", "collection": "subscriptions",
+         "filter": owned_by(user_id, {"is_active": True, "category": SubscriptionCategory.STREAMING.value}),
+         "sort": [("next_due_date", 1), ("id", 1)]},
+        {"name": "get_subscriptions[all]", "collection": "subscriptions",
+         "filter": owned_by(user_id), "sort": [("next_due_date", 1), ("id", 1)]},
+        {"name": "get_subscriptions[sort=cost]", "collection": "subscriptions",
+         "filter": owned_by(user_id, {"is_active": True}), "sort": build_sort("cost", SortOrder.DESC)},
+        {"name": "get_subscriptions[sort=name]", "collection": "subscriptions",
+         "filter": owned_by(user_id, {"is_active": True}), "sort": build_sort("name", SortOrder.ASC)},
+        {"name": "get_subscriptions[top=5&by=monthly_cost]", "collection": "subscriptions",
+         "pipeline": top_n_pipeline(
+             owned_by(user_id, {"is_active": True}), build_sort("monthly_cost", SortOrder.DESC), 5,
+             {"monthly_cost": MONTHLY_COST_EXPR},
+         )},
+        {"name": "get_trends[subscriptions]", "collection": "subscriptions",
+         "filter": trend_subscription_filter(user_id, windows["trend_start"])},
+        {"name": "get_expense", "collection": "expenses", "filter": owned_by(user_id, {"id": sample_id})},
+        {"name": "get_expenses", "collection": "expenses",
+         "filter": owned_by(user_id), "sort": [("date", -1), ("id", -1)]},
+        {"name": "get_expenses[sort=amount]", "collection": "expenses",
+         "filter": owned_by(user_id), "sort": build_sort("amount", SortOrder.DESC)},
+        {"name": "get_expenses[sort=name]", "collection": "expenses",
+         "filter": owned_by(user_id), "sort": build_sort("name", SortOrder.ASC)},
+        {"name": "get_expenses[top=5&by=amount]", "collection": "expenses",
+         "pipeline": top_n_pipeline(owned_by(user_id), build_sort("amount", SortOrder.DESC), 5)},
+        {"name": "get_expenses[date_range]", "collection": "expenses",
+         "filter": owned_by(user_id, {"date": {"$gte": windows["last_month_start"], "$lte": now}}),
+         "sort": [("date", -1), ("id", -1)]},
+        {"name": "get_expenses[category]", "collection": "expenses",
+         "filter": owned_by(user_id, {
+             "category": ExpenseCategory.FOOD.value, "date": {"$gte": windows["current_month_start"]},
+         }),
+         "sort": [("date", -1), ("id", -1)]},
+        {"name": "get_subscriptions[search]", "collection": "subscriptions",
+         "filter": owned_by(user_id, {"is_active": True, **name_search_filter("net")})},
+        {"name": "get_expenses[search]", "collection": "expenses",
+         "filter": owned_by(user_id, name_search_filter("grocery shop"))},
+        {"name": "get_expenses[recurring]", "collection": "expenses",
+         "filter": owned_by(user_id, {"is_recurring": True}), "sort": [("date", -1), ("id", -1)]},
+        {"name": "materialise_recurring_expenses", "collection": "expenses",
+         "filter": {"is_recurring": True, "next_due_date": {"$lte": now}, "recurring_frequency": {"$ne": None}},
+         "sort": [("next_due_date", 1)]},
+        {"name": "advance_due_subscriptions", "collection": "subscriptions",
+         "filter": {"is_active": True, "next_due_date": {"$lte": now}}, "sort": [("next_due_date", 1)]},
+        {"name": "get_forecast[expenses]", "collection": "expenses",
+         "filter": owned_by(user_id, {"is_recurring": True, "next_due_date": {"$ne": None}})},
+        {"name": "get_budget", "collection": "budgets", "filter": owned_by(user_id, {"id": sample_id})},
+        {"name": "create_budget[category]", "collection": "budgets",
+         "filter": owned_by(user_id, {"type": BudgetType.CATEGORY.value, "category": "food"})},
+        {"name": "get_dashboard_stats", "collection": "expenses",
+         "pipeline": build_dashboard_pipeline(user_id, windows)},
+    ]
+
+async def explain_queries(database) -> List[Dict[str, Any]]:
+    results = []
+    for shape in explain_query_shapes():
+        collection = database[shape["collection"]]
+        if "pipeline" in shape:
+            explain = await database.command(
+                "aggregate", shape["collection"], pipeline=shape["pipeline"], explain=True
+            )
+        else:
+            cursor = collection.find(shape["filter"])
+            if shape.get("sort"):
+                cursor = cursor.sort(shape["sort"])
+            explain = await cursor.explain()
+        stages = _winning_plan_stages(explain)
+        results.append({
+            "name": shape["name"],
+            "collection": shape["collection"],
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return results
+
+def require_debug_token(request: Request) -> None:
+    """Dependency guarding the /_debug routes: only requests sending PROFILE_TOKEN get in.
+
+    Without a configured token the routes do not exist.
+    """
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not compare_digest(request.headers.get(PROFILE_TOKEN_HEADER, ""), PROFILE_TOKEN):
+        raise HTTPException(status_code=403, detail=f"{PROFILE_TOKEN_HEADER} header required")
+
+@api_router.get("/_debug/cache", dependencies=[Depends(require_debug_token)])
+async def get_cache_stats():
+    return {
+        **response_cache.stats(),
+        "storage_backend": STORAGE_BACKEND,
+        "analytics_engine": ANALYTICS_ENGINE,
+        "expense_columns": {
+            "loaded": expense_columns.loaded, "rows": len(expense_columns), "users": len(expense_columns.users),
+        },
+    }
+
+@api_router.get("/_debug/pool", dependencies=[Depends(require_debug_token)])
+async def get_pool_stats():
+    if client is None:
+        raise HTTPException(status_code=404, detail="No MongoDB connection pool with STORAGE_BACKEND=sqlite")
+    pool = client.options.pool_options
+    return {
+        "max_pool_size": pool.max_pool_size,
+        "min_pool_size": pool.min_pool_size,
+        "max_connecting": pool.max_connecting,
+        "max_idle_time_seconds": pool.max_idle_time_seconds,
+        "wait_queue_timeout_seconds": pool.wait_queue_timeout,
+        "connect_timeout_seconds": pool.connect_timeout,
+        "socket_timeout_seconds": pool.socket_timeout,
+        "write_concern": db.write_concern.document,
+        "read_preference": db.read_preference.document,
+        "analytics_read_preference": analytics_db.read_preference.document,
+        "pools": pool_snapshot(),
+    }
+
+@api_router.get("/_debug/profiles", dependencies=[Depends(require_debug_token)])
+async def get_profiles():
+    return {
+        "slow_request_ms": PROFILE_SLOW_MS or None,
+        "profiles": profile_store.list(),
+    }
+
+@api_router.get("/_debug/explain", dependencies=[Depends(require_debug_token)])
+async def get_query_plans():
+    plans = await storage.explain_queries()
+    return {"plans": plans, "collscans": [plan["name"] for plan in plans if plan["collscan"]]}
+
 @api_router.get("/categories")
 async def get_categories():
     return {
@@ -590,14 +3310,129 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
+@app.middleware("http")
+async def http_caching(request: Request, call_next):
+    if request.method in ("GET", "HEAD"):
+        etag = compute_etag(request)
+        if etag and etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        response = await call_next(request)
+        if etag and response.status_code == 200:
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+    
+    response = await call_next(request)
+    if request.method != "OPTIONS":
+        entry = _match_prefix(request.url.path, WRITE_PREFIXES)
+        if entry:
+            record_write(request_user_id(request), *entry[1])
+    return response
+
+def route_label(request: Request) -> str:
+    """The matched route's path template, so ids do not explode label cardinality."""
+    partial = None
+    for route in request.app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+# Added last so it wraps http_caching and times 304s as well
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    stats = RequestStats(route_label(request))
+    token = current_request.set(stats)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics_registry.observe_request(request.method, 500, time.perf_counter() - started, 0, stats)
+        raise
+    finally:
+        current_request.reset(token)
+    elapsed = time.perf_counter() - started
+    response.headers["Server-Timing"] = (
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.db_commands} commands", app;dur={elapsed * 1000:.1f}'
+    )
+    
+    body = response.body_iterator
+    async def observed_body():
+        size = 0
+        try:
+            async for chunk in body:
+                size += len(chunk)
+                yield chunk
+        finally:
+            metrics_registry.observe_request(request.method, response.status_code, elapsed, size, stats)
+    response.body_iterator = observed_body()
+    return response
+
+# Profiling, off unless PROFILE_SLOW_MS or PROFILE_TOKEN is set; the
+# middleware is only installed when one of them is
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))  # Sample and keep requests slower than this
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")  # Requests sending it in the header are cProfiled; also admits /_debug
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "25"))
+profile_store = ProfileStore(int(os.environ.get("PROFILE_MAX_STORED", "50")))
+stack_sampler = (
+    StackSampler(float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000) if PROFILE_SLOW_MS > 0 else None
+)
+cprofile_active = False  # cProfile hooks the whole thread, so one request at a time
+
+async def profile_requests(request: Request, call_next):
+    global cprofile_active
+    token = request.headers.get(PROFILE_TOKEN_HEADER)
+    if PROFILE_TOKEN and token and compare_digest(token, PROFILE_TOKEN) and not cprofile_active:
+        cprofile_active = True
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            response = await call_next(request)
+        finally:
+            profile.disable()
+            cprofile_active = False
+        captured = profile_store.add(
+            request.method, request.url.path, response.status_code, time.perf_counter() - started,
+            "cprofile", summarize_cprofile(profile, PROFILE_TOP_N),
+        )
+        response.headers[PROFILE_ID_HEADER] = captured["id"]
+        return response
+    
+    if stack_sampler is None:
+        return await call_next(request)
+    started = time.monotonic()
+    response = await call_next(request)
+    elapsed = time.monotonic() - started
+    if elapsed * 1000 >= PROFILE_SLOW_MS:
+        stacks = stack_sampler.samples_between(started, started + elapsed)
+        captured = profile_store.add(
+            request.method, request.url.path, response.status_code, elapsed,
+            "sampling", summarize_samples(stacks, PROFILE_TOP_N), len(stacks),
+        )
+        response.headers[PROFILE_ID_HEADER] = captured["id"]
+    return response
+
+if PROFILE_SLOW_MS > 0 or PROFILE_TOKEN:
+    app.middleware("http")(profile_requests)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -605,6 +3440,108 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def ensure_indexes(database):
+    try:
+        changed = await reconcile_indexes(database)
+    except OperationFailure as e:
+        # The backfills below do not depend on the indexes, and skipping them
+        # would leave legacy documents unreachable
+        logger.error(f"Index reconciliation failed, continuing with backfills: {e}")
+        changed = {}
+    for collection_name, names in changed.items():
+        logger.info(f"Updated indexes on {collection_name}: {', '.join(names)}")
+    
+    backfilled = await backfill_search_terms(database)
+    if backfilled:
+        logger.info(f"Backfilled search terms on {backfilled} documents")
+    backfilled = await backfill_versions(database)
+    if backfilled:
+        logger.info(f"Backfilled versions on {backfilled} documents")
+    backfilled = await backfill_user_ids(database, LEGACY_USER_ID)
+    if backfilled:
+        logger.info(f"Assigned {backfilled} documents written before tenancy to user '{LEGACY_USER_ID}'")
+    
+    # Rollups built before tenancy have no user_id and are rebuilt per user
+    stale_rollups = await database.monthly_rollups.find_one({"user_id": {"$exists": False}})
+    if (stale_rollups or not await database.monthly_rollups.find_one()) and await database.expenses.find_one():
+        rows = await rebuild_rollups(database)
+        logger.info(f"Built {rows} monthly rollup rows from existing expenses")
+    record_write(None, *ALL_COLLECTIONS)
+
+def start_expense_columns():
+    if ANALYTICS_ENGINE != "columnar":
+        return
+    
+    async def load():
+        started = time.perf_counter()
+        rows = await load_expense_columns(storage)
+        logger.info(f"Loaded {rows} expenses into the columnar analytics store in {time.perf_counter() - started:.1f}s")
+    app.state.expense_columns_task = asyncio.create_task(load())
+
+def start_stack_sampler():
+    if stack_sampler:
+        stack_sampler.start(threading.get_ident())  # The event loop's thread
+
+def start_recurrence_scheduler():
+    if RECURRENCE_INTERVAL_SECONDS > 0:
+        app.state.recurrence_task = asyncio.create_task(run_recurrence_scheduler(storage))
+
+def configured_workers(argv: Optional[List[str]] = None) -> Tuple[int, str]:
+    """The worker count the server was started with, and where it came from.
+
+    uvicorn and gunicorn both default --workers to WEB_CONCURRENCY; gunicorn
+    also takes options from GUNICORN_CMD_ARGS. uvicorn workers are spawned
+    with the parent's sys.argv, so every worker sees the same command line.
+    """
+    argv = sys.argv if argv is None else argv
+    program = Path(argv[0] if argv else "")
+    server_name = program.parent.name if program.name == "__main__.py" else program.name  # python -m uvicorn
+    args = argv[1:] if server_name in ("uvicorn", "gunicorn") else []
+    if server_name == "gunicorn":
+        args = shlex.split(os.environ.get("GUNICORN_CMD_ARGS", "")) + args
+    workers, source = int(os.environ.get("WEB_CONCURRENCY") or 1), "WEB_CONCURRENCY"
+    for i, arg in enumerate(args):  # Later options win, as they do for the servers
+        if arg in ("--workers", "-w") and i + 1 < len(args):
+            value = args[i + 1]
+        elif arg.startswith("--workers="):
+            value = arg.split("=", 1)[1]
+        elif arg.startswith("-w") and arg[2:].isdigit():
+            value = arg[2:]
+        else:
+            continue
+        if value.isdigit():
+            workers, source = int(value), f"{server_name} --workers"
+    return workers, source
+
+def check_single_worker() -> None:
+    """Refuse to start as one of several workers sharing a deployment.
+
+    ETag change counters, the response cache and expense_columns are kept in
+    this process and only see its own writes, so a sibling worker would keep
+    answering 304 or serving cached figures after another one wrote. Run one
+    process per database.
+    """
+    workers, source = configured_workers()
+    if workers > 1:
+        raise RuntimeError(
+            f"{source}={workers}: ETags, the response cache and the columnar expense store are per process; "
+            "run a single worker"
+        )
+
+async def start_app(app: FastAPI) -> None:
+    check_single_worker()
+    await open_storage().prepare()
+    start_expense_columns()
+    start_stack_sampler()
+    start_recurrence_scheduler()
+
+async def stop_app(app: FastAPI) -> None:
+    recurrence_task = getattr(app.state, "recurrence_task", None)
+    if recurrence_task:
+        recurrence_task.cancel()
+    if stack_sampler:
+        stack_sampler.stop()
+    expense_columns_task = getattr(app.state, "expense_columns_task", None)
+    if expense_columns_task:
+        expense_columns_task.cancel()
+    close_storage()
\ No newline at end of file
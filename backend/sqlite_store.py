@@ -0,0 +1,298 @@
+"""
+Embedded SQLite engine behind STORAGE_BACKEND=sqlite.
+
+Each collection is a table holding one document per row, with a column per
+field. Datetimes are stored as fixed-width ISO-8601 text in UTC, so they sort
+and range-compare correctly as strings; booleans are 0/1 and lists are JSON.
+Rows are decoded back into the same dicts Motor returns.
+
+The database runs in WAL mode with synchronous=NORMAL: readers never wait for
+the writer, and a commit appends to the WAL without waiting for a checkpoint.
+sqlite3 connections belong to the thread that opened them and every call
+blocks, so all statements run on one dedicated thread that owns the
+connection and the event loop only awaits the results. Running them one at a
+time also makes each unit of work atomic without further locking.
+
+Filters use the subset of Mongo's query language the API builds (field
+equality, $gt/$gte/$lt/$lte/$ne/$in and $and/$or); where_clause translates
+them into SQL.
+"""
+
+import asyncio
+import json
+import sqlite3
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+TEXT = "text"
+REAL = "real"
+INTEGER = "integer"
+BOOLEAN = "boolean"
+DATETIME = "datetime"
+JSON = "json"
+SQL_TYPES = {TEXT: "TEXT", REAL: "REAL", INTEGER: "INTEGER", BOOLEAN: "INTEGER", DATETIME: "TEXT", JSON: "TEXT"}
+COMPARISONS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+Expression = Tuple[str, List[Any]]  # SQL fragment and its parameters
+IndexKey = Sequence[Tuple[str, int]]  # (field, 1 or -1)
+
+
+def column_kind(annotation: Any) -> str:
+    """Storage kind for a pydantic field annotation."""
+    if typing.get_origin(annotation) is typing.Union:
+        annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+    if typing.get_origin(annotation) is list:
+        return JSON
+    if annotation is datetime:
+        return DATETIME
+    if annotation is bool:
+        return BOOLEAN
+    if annotation is int:
+        return INTEGER
+    if annotation is float:
+        return REAL
+    return TEXT
+
+
+def to_sql(value: Any) -> Any:
+    """A Python value as stored: datetimes as naive UTC text, enums by value, lists as JSON."""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat(timespec="microseconds")
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (list, tuple)):
+        return json.dumps([to_sql(item) for item in value])
+    return value
+
+
+def from_sql(kind: Optional[str], value: Any) -> Any:
+    if value is None:
+        return None
+    if kind == DATETIME:
+        return datetime.fromisoformat(value)
+    if kind == BOOLEAN:
+        return bool(value)
+    if kind == JSON:
+        return json.loads(value)
+    return value
+
+
+class Table:
+    """A collection stored one document per row, keyed by its unique `id`.
+
+    `computed` fields are SQL expressions over the columns; they can be
+    selected, filtered and sorted on like columns but are never stored.
+    """
+
+    def __init__(self, name: str, columns: Dict[str, str], indexes: Dict[str, IndexKey],
+                 computed: Optional[Dict[str, Expression]] = None):
+        self.name = name
+        self.columns = columns
+        self.indexes = indexes
+        self.computed = computed or {}
+
+    def schema(self, existing_columns: Iterable[str]) -> List[str]:
+        """Statements creating the table and its indexes, or adding columns it lacks."""
+        existing_columns = set(existing_columns)
+        if existing_columns:
+            statements = [
+                f'ALTER TABLE {self.name} ADD COLUMN "{name}" {SQL_TYPES[kind]}'
+                for name, kind in self.columns.items()
+                if name not in existing_columns
+            ]
+        else:
+            columns = ", ".join(
+                f'"{name}" {SQL_TYPES[kind]}' + (" PRIMARY KEY" if name == "id" else "")
+                for name, kind in self.columns.items()
+            )
+            statements = [f"CREATE TABLE {self.name} ({columns})"]
+        for index_name, key in self.indexes.items():
+            fields = ", ".join(f'"{field}"' + (" DESC" if direction < 0 else "") for field, direction in key)
+            statements.append(f"CREATE INDEX IF NOT EXISTS {self.name}_{index_name} ON {self.name} ({fields})")
+        return statements
+
+    def expression(self, field: str, extra: Optional[Dict[str, Expression]] = None) -> Expression:
+        """SQL for a field: a per-query expression from `extra`, a computed field or a column."""
+        if extra and field in extra:
+            return extra[field]
+        if field in self.computed:
+            return self.computed[field]
+        if field in self.columns:
+            return f'"{field}"', []
+        raise ValueError(f"{self.name} has no field '{field}'")
+
+    def values(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """The stored column values for the fields of `doc` this table has."""
+        return {name: to_sql(value) for name, value in doc.items() if name in self.columns}
+
+    def decode(self, row: sqlite3.Row) -> Dict[str, Any]:
+        return {key: from_sql(self.columns.get(key), row[key]) for key in row.keys()}
+
+
+def where_clause(table: Table, filter_dict: Dict[str, Any], extra: Optional[Dict[str, Expression]] = None) -> Expression:
+    """Translate a Mongo-style filter on `table` into a WHERE condition."""
+    clauses: List[str] = []
+    params: List[Any] = []
+    for key, condition in filter_dict.items():
+        if key in ("$and", "$or"):
+            parts = [where_clause(table, branch, extra) for branch in condition]
+            if not parts:
+                clauses.append("1" if key == "$and" else "0")
+                continue
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(f"({sql})" for sql, _ in parts) + ")")
+            for _, part_params in parts:
+                params += part_params
+            continue
+
+        column, column_params = table.expression(key, extra)
+        operators = condition if isinstance(condition, dict) else {"$eq": condition}
+        for operator, value in operators.items():
+            if operator == "$in":
+                if not value:
+                    clauses.append("0")
+                    continue
+                clauses.append(f"{column} IN ({', '.join(['?'] * len(value))})")
+                params += column_params + [to_sql(item) for item in value]
+            elif operator in ("$eq", "$ne") and value is None:
+                clauses.append(f"{column} IS {'NOT ' if operator == '$ne' else ''}NULL")
+                params += column_params
+            elif operator == "$eq":
+                clauses.append(f"{column} = ?")
+                params += column_params + [to_sql(value)]
+            elif operator == "$ne":
+                # Like Mongo, documents without a value match $ne
+                clauses.append(f"{column} IS NOT ?")
+                params += column_params + [to_sql(value)]
+            elif operator in COMPARISONS:
+                clauses.append(f"{column} {COMPARISONS[operator]} ?")
+                params += column_params + [to_sql(value)]
+            else:
+                raise ValueError(f"Unsupported operator {operator}")
+    return " AND ".join(clauses) or "1", params
+
+
+def and_where(first: Expression, second: Expression) -> Expression:
+    return f"({first[0]}) AND ({second[0]})", first[1] + second[1]
+
+
+def select_sql(
+    table: Table,
+    where: Expression,
+    fields: Optional[Iterable[str]] = None,
+    sort: Optional[Sequence[Tuple[str, int]]] = None,
+    limit: Optional[int] = None,
+    extra: Optional[Dict[str, Expression]] = None,
+) -> Expression:
+    columns = []
+    params: List[Any] = []
+    for field in fields or table.columns:
+        sql, field_params = table.expression(field, extra)
+        columns.append(f'{sql} AS "{field}"')
+        params += field_params
+    query = f"SELECT {', '.join(columns)} FROM {table.name} WHERE {where[0]}"
+    params += where[1]
+    if sort:
+        order = []
+        for field, direction in sort:
+            sql, field_params = table.expression(field, extra)
+            order.append(f"{sql} {'DESC' if direction < 0 else 'ASC'}")
+            params += field_params
+        query += " ORDER BY " + ", ".join(order)
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+
+def select_documents(
+    connection: sqlite3.Connection,
+    table: Table,
+    where: Expression,
+    fields: Optional[Iterable[str]] = None,
+    sort: Optional[Sequence[Tuple[str, int]]] = None,
+    limit: Optional[int] = None,
+    extra: Optional[Dict[str, Expression]] = None,
+) -> List[Dict[str, Any]]:
+    """Documents matching `where`, with `fields` (default: every column), in `sort` order."""
+    query, params = select_sql(table, where, fields, sort, limit, extra)
+    return [table.decode(row) for row in connection.execute(query, params)]
+
+
+def query_plan(connection: sqlite3.Connection, table: Table, where: Expression,
+               sort: Optional[Sequence[Tuple[str, int]]] = None) -> List[str]:
+    """EXPLAIN QUERY PLAN details for select_documents(table, where, sort=sort)."""
+    query, params = select_sql(table, where, sort=sort)
+    return [row["detail"] for row in connection.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+def insert_row(connection: sqlite3.Connection, table: Table, values: Dict[str, Any]) -> None:
+    names = ", ".join(f'"{name}"' for name in values)
+    connection.execute(
+        f"INSERT INTO {table.name} ({names}) VALUES ({', '.join(['?'] * len(values))})", list(values.values())
+    )
+
+
+def update_rows(connection: sqlite3.Connection, table: Table, where: Expression, assignments: Dict[str, Any],
+                raw: Sequence[Expression] = ()) -> int:
+    """Set columns to `assignments` plus `raw` SQL assignments on matching rows; returns the row count."""
+    parts = [f'"{name}" = ?' for name in assignments] + [sql for sql, _ in raw]
+    params = list(assignments.values()) + [param for _, raw_params in raw for param in raw_params] + where[1]
+    return connection.execute(f"UPDATE {table.name} SET {', '.join(parts)} WHERE {where[0]}", params).rowcount
+
+
+def delete_rows(connection: sqlite3.Connection, table: Table, where: Expression) -> int:
+    return connection.execute(f"DELETE FROM {table.name} WHERE {where[0]}", where[1]).rowcount
+
+
+@contextmanager
+def transaction(connection: sqlite3.Connection):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+class SQLiteStore:
+    """One SQLite database file, used from a single dedicated thread."""
+
+    def __init__(self, path: str, tables: Iterable[Table]):
+        self.path = path
+        self.tables = {table.name: table for table in tables}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._connection = self._executor.submit(self._open).result()
+
+    def _open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, isolation_level=None)  # Autocommit; transaction() groups writes
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with transaction(connection):
+            for table in self.tables.values():
+                existing = [row["name"] for row in connection.execute(f"PRAGMA table_info({table.name})")]
+                for statement in table.schema(existing):
+                    connection.execute(statement)
+        connection.execute("PRAGMA optimize")
+        return connection
+
+    async def run(self, work: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run `work(connection)` on the database thread and return its result."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, work, self._connection)
+
+    async def query(self, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        return await self.run(lambda connection: connection.execute(sql, list(params)).fetchall())
+
+    def close(self) -> None:
+        self._executor.submit(self._connection.close).result()
+        self._executor.shutdown()
@@ -14,6 +14,23 @@ import './App.css';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// The backend scopes every document to the caller's X-User-Id. In a
+// multi-user deployment the auth proxy overwrites it; otherwise the app acts
+// as the single default user.
+axios.defaults.headers.common['X-User-Id'] = process.env.REACT_APP_USER_ID || 'default';
+
+// Follow X-Next-Cursor until the list endpoint has returned every page
+const fetchAllPages = async (url, params = {}) => {
+  let items = [];
+  let cursor = null;
+  do {
+    const response = await axios.get(url, { params: { ...params, limit: 1000, cursor } });
+    items = items.concat(response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return items;
+};
+
 // Utility function to format currency
 const formatCurrency = (amount) => {
   return new Intl.NumberFormat('en-IN', {
@@ -835,8 +852,7 @@ function App() {
   // Fetch subscriptions
   const fetchSubscriptions = async () => {
     try {
-      const response = await axios.get(`${API}/subscriptions`);
-      setSubscriptions(response.data);
+      setSubscriptions(await fetchAllPages(`${API}/subscriptions`));
     } catch (error) {
       console.error('Error fetching subscriptions:', error);
     }
@@ -845,8 +861,7 @@ function App() {
   // Fetch expenses
   const fetchExpenses = async () => {
     try {
-      const response = await axios.get(`${API}/expenses`);
-      setExpenses(response.data);
+      setExpenses(await fetchAllPages(`${API}/expenses`));
     } catch (error) {
       console.error('Error fetching expenses:', error);
     }
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Settings read when server is imported: no background recurrence task, and
+# an embedded SQLite store instead of MongoDB
+os.environ["RECURRENCE_INTERVAL_SECONDS"] = "0"
+os.environ["STORAGE_BACKEND"] = "sqlite"
+
+import server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "nbntracker.db")
+    monkeypatch.setattr(server, "SQLITE_PATH", path)
+    return path
+
+
+@pytest.fixture
+def user_id():
+    # The response cache and change counters are per process, so each test
+    # acts as its own user
+    return f"user-{uuid.uuid4().hex}"
+
+
+@pytest.fixture
+def client(sqlite_path, user_id):
+    with TestClient(server.app, headers={server.USER_ID_HEADER: user_id}) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def mongo_database():
+    # mongomock behind the Mongo storage, for rollups and bulk writes, which
+    # the SQLite store does not have
+    database = server.install_client(AsyncMongoMockClient(), "nbntracker")
+    asyncio.run(server.storage.prepare())
+    yield database
+    server.close_mongo()
+
+
+@pytest.fixture
+def mongo_client(mongo_database, user_id):
+    with TestClient(server.app, headers={server.USER_ID_HEADER: user_id}) as test_client:
+        yield test_client
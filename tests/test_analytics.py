@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta, timezone
+
+import server
+from analytics import ExpenseColumns, day_number, month_number
+
+EASTERN = timezone(timedelta(hours=-5))
+
+
+def test_aware_dates_land_on_their_utc_day_and_month():
+    late = datetime(2026, 3, 31, 22, 30, tzinfo=EASTERN)
+    assert day_number(late) == day_number(datetime(2026, 4, 1))
+    assert month_number(late) == month_number(datetime(2026, 4, 1))
+    assert month_number(datetime(2026, 3, 31, 22, 30)) == month_number(datetime(2026, 3, 1))
+
+
+def test_monthly_buckets_agree_with_rollup_months():
+    columns = ExpenseColumns()
+    columns.load([
+        ("a", datetime(2026, 3, 31, 22, 30, tzinfo=EASTERN), 10.0, "food"),
+        ("b", datetime(2026, 3, 15), 4.0, "food"),
+    ])
+    columns.upsert("c", datetime(2026, 4, 2, tzinfo=timezone.utc), 1.0, "food")
+    columns.remove("b")
+
+    totals = columns.bucket_totals([datetime(2026, 3, 1), datetime(2026, 4, 1)], "monthly")
+    rollups = server.rollup_deltas([(None, {
+        "user_id": "u", "date": date, "amount": amount, "category": "food",
+    }) for date, amount in [(datetime(2026, 3, 31, 22, 30, tzinfo=EASTERN), 10.0), (datetime(2026, 4, 2), 1.0)]])
+    assert list(totals) == [0.0, 11.0]
+    assert rollups == {("u", "2026-04", "food"): [11.0, 2]}
@@ -0,0 +1,192 @@
+import asyncio
+from datetime import datetime
+
+import mongomock
+import pytest
+
+import server
+
+NOW = datetime(2026, 3, 15, 12, 0)
+USER = "alice"
+
+
+def expense(name, amount, category, date, user_id=USER, **extra):
+    return server.expense_document(
+        server.Expense(name=name, amount=amount, category=category, date=date, **extra), user_id
+    )
+
+
+def subscription(name, cost, billing_frequency, category, next_due_date, **extra):
+    doc = server.subscription_document(
+        server.Subscription(
+            name=name, cost=cost, billing_frequency=billing_frequency, category=category,
+            next_due_date=next_due_date,
+        ),
+        USER,
+    )
+    doc.update(extra)
+    return doc
+
+
+def budget(type, amount, category=None, period="monthly"):
+    return server.budget_document(server.Budget(type=type, amount=amount, category=category, period=period), USER)
+
+
+EXPENSES = [
+    expense("Groceries", 10, "food", datetime(2026, 3, 2)),
+    expense("Bus pass", 5, "transportation", datetime(2026, 3, 10, 8)),
+    expense("Dinner", 7, "food", datetime(2026, 2, 20)),
+    expense("Shoes", 20, "shopping", datetime(2026, 1, 5)),
+    expense("Party", 100, "food", datetime(2025, 12, 31, 23)),
+    expense("Old", 50, "food", datetime(2025, 6, 1)),
+    expense(
+        "Power", 30, "utilities", datetime(2026, 3, 1), is_recurring=True, recurring_frequency="monthly",
+        next_due_date=datetime(2026, 3, 18),
+    ),
+    expense("Someone else's", 999, "food", datetime(2026, 3, 3), user_id="bob"),
+]
+SUBSCRIPTIONS = [
+    subscription("Music", 10, "monthly", "streaming", datetime(2026, 3, 20)),
+    subscription("Editor", 120, "yearly", "software", datetime(2026, 6, 1)),
+    subscription(
+        "Paper", 5, "monthly", "news", datetime(2026, 2, 1),
+        is_active=False, cancelled_at=datetime(2026, 2, 1),
+    ),
+]
+BUDGETS = [
+    budget("annual", 50),
+    budget("category", 5, category="food"),
+]
+
+
+def reference_dashboard(expenses, subscriptions, now):
+    """Every figure the way the original per-document loop computed it."""
+    windows = server.get_dashboard_windows(now)
+    expenses = [doc for doc in expenses if doc["user_id"] == USER]
+    active = [doc for doc in subscriptions if doc["is_active"]]
+    monthly_subscriptions = sum(server.get_monthly_cost(doc["cost"], doc["billing_frequency"]) for doc in active)
+    month = sum(doc["amount"] for doc in expenses if doc["date"] >= windows["current_month_start"])
+    year = sum(doc["amount"] for doc in expenses if doc["date"] >= windows["current_year_start"])
+    last_month = sum(
+        doc["amount"] for doc in expenses
+        if windows["last_month_start"] <= doc["date"] < windows["current_month_start"]
+    )
+    categories = {}
+    for doc in active:
+        categories[doc["category"]] = (
+            categories.get(doc["category"], 0) + server.get_monthly_cost(doc["cost"], doc["billing_frequency"])
+        )
+    for doc in expenses:
+        if doc["date"] >= windows["current_month_start"]:
+            categories[doc["category"]] = categories.get(doc["category"], 0) + doc["amount"]
+    cutoff = windows["upcoming_cutoff"]
+    return {
+        "subscription_spending": monthly_subscriptions,
+        "expense_spending": month,
+        "total_monthly_spending": monthly_subscriptions + month,
+        "total_yearly_spending": monthly_subscriptions * 12 + year,
+        "savings_this_month": last_month - month,
+        "category_breakdown": categories,
+        "upcoming_subscriptions": sorted(doc["id"] for doc in active if doc["next_due_date"] <= cutoff),
+        "upcoming_expenses": sorted(
+            doc["id"] for doc in expenses
+            if doc["is_recurring"] and doc["next_due_date"] and doc["next_due_date"] <= cutoff
+        ),
+        "budget_alerts": 2,  # Over the monthly budget (65 > 50) and the food one (10 > 5)
+    }
+
+
+def summarize(dashboard):
+    return {
+        **{key: dashboard[key] for key in (
+            "subscription_spending", "expense_spending", "total_monthly_spending",
+            "total_yearly_spending", "savings_this_month",
+        )},
+        "category_breakdown": {str(server._enum_value(k)): v for k, v in dashboard["category_breakdown"].items()},
+        "upcoming_subscriptions": sorted(doc["id"] for doc in dashboard["upcoming_subscriptions"]),
+        "upcoming_expenses": sorted(doc["id"] for doc in dashboard["upcoming_expenses"]),
+        "budget_alerts": len(dashboard["budget_alerts"]),
+    }
+
+
+def normalize_reference():
+    return {
+        key: (pytest.approx(value) if isinstance(value, float) else value)
+        for key, value in reference_dashboard(EXPENSES, SUBSCRIPTIONS, NOW).items()
+    }
+
+
+def aggregate(database, collection_name, pipeline):
+    """Run `pipeline` on mongomock, expanding the $unionWith stages it lacks."""
+    docs = list(database[collection_name].find())
+    for stage in pipeline:
+        if "$unionWith" in stage:
+            union = stage["$unionWith"]
+            docs += list(database[union["coll"]].aggregate(union["pipeline"]))
+            continue
+        scratch = database["_scratch"]
+        scratch.drop()
+        if docs:
+            scratch.insert_many([{key: value for key, value in doc.items() if key != "_id"} for doc in docs])
+        docs = list(scratch.aggregate([stage]))
+    return docs
+
+
+@pytest.fixture
+def database():
+    database = mongomock.MongoClient().db
+    database.expenses.insert_many([dict(doc) for doc in EXPENSES])
+    database.subscriptions.insert_many([dict(doc) for doc in SUBSCRIPTIONS])
+    database.budgets.insert_many([dict(doc) for doc in BUDGETS])
+    rollups = server.rollup_deltas([(None, doc) for doc in EXPENSES])
+    database.monthly_rollups.insert_many([
+        {"user_id": user_id, "month": month, "category": category, "total": total, "count": count}
+        for (user_id, month, category), (total, count) in rollups.items()
+    ])
+    return database
+
+
+def test_facet_pipeline_matches_per_document_totals(database):
+    windows = server.get_dashboard_windows(NOW)
+    facets = aggregate(database, "expenses", server.build_dashboard_pipeline(USER, windows))[0]
+    dashboard = server.dashboard_from_facets(facets, NOW)
+
+    assert summarize(dashboard) == normalize_reference()
+    assert dashboard["expense_spending"] == 45
+    assert dashboard["subscription_spending"] == 20
+    assert [trend["expense_spending"] for trend in dashboard["spending_trends"]] == [0, 0, 100, 20, 7, 45]
+
+
+def test_pipeline_only_reads_the_users_documents(database):
+    windows = server.get_dashboard_windows(NOW)
+    for stage in server.build_dashboard_pipeline(USER, windows):
+        match = stage.get("$match") or stage.get("$unionWith", {}).get("pipeline", [{}])[0].get("$match")
+        if match is None:
+            continue
+        branches = match.get("$or", [match])
+        assert all(next(iter(branch)) == "user_id" and branch["user_id"] == USER for branch in branches)
+
+
+def test_empty_facets_give_a_zero_dashboard():
+    dashboard = server.dashboard_from_facets({}, NOW)
+    assert dashboard["total_monthly_spending"] == 0
+    assert dashboard["category_breakdown"] == {}
+    assert dashboard["budget_alerts"] == []
+    assert len(dashboard["spending_trends"]) == 6
+
+
+def test_sqlite_facets_give_the_same_dashboard(tmp_path):
+    storage = server.SQLiteStorage(str(tmp_path / "dashboard.db"))
+
+    async def facets():
+        await storage.prepare()
+        await storage.expenses.write_many(None, [("insert", dict(doc)) for doc in EXPENSES])
+        await storage.subscriptions.write_many(None, [("insert", dict(doc)) for doc in SUBSCRIPTIONS])
+        await storage.budgets.write_many(None, [("insert", dict(doc)) for doc in BUDGETS])
+        return await storage.dashboard_facets(USER, server.get_dashboard_windows(NOW))
+
+    try:
+        dashboard = server.dashboard_from_facets(asyncio.run(facets()), NOW)
+    finally:
+        storage.close()
+    assert summarize(dashboard) == normalize_reference()
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import pytest
+
+import server
+from forecast import expand_recurrences, project_cash_flow
+
+START = datetime(2024, 1, 1)
+END = datetime(2027, 1, 1)
+# Month ends and leap days, where relativedelta clamps and then keeps the clamped day
+ANCHORS = [
+    datetime(2024, 1, 31), datetime(2024, 1, 30), datetime(2024, 1, 29), datetime(2024, 2, 29),
+    datetime(2024, 3, 31), datetime(2024, 8, 31), datetime(2024, 5, 15), datetime(2023, 12, 31),
+]
+
+
+def stepped(anchor, frequency, start, end):
+    """Occurrences in [start, end) by repeated calculate_next_expense_date, like the recurrence engine."""
+    dates, due = [], anchor
+    while due < end:
+        if due >= start:
+            dates.append(due.date())
+        due = server.calculate_next_expense_date(due, server.RecurringExpenseFrequency(frequency))
+    return dates
+
+
+def expanded(anchors, frequencies, start, end):
+    items, dates = expand_recurrences(anchors, frequencies, start, end)
+    occurrences = {}
+    for item, date in zip(items.tolist(), dates.astype(datetime).tolist()):
+        occurrences.setdefault(item, []).append(date)
+    return [sorted(occurrences.get(i, [])) for i in range(len(anchors))]
+
+
+@pytest.mark.parametrize("frequency", ["monthly", "yearly", "weekly"])
+def test_expansion_matches_relativedelta_stepping(frequency):
+    result = expanded(ANCHORS, [frequency] * len(ANCHORS), START, END)
+    for anchor, dates in zip(ANCHORS, result):
+        assert dates == stepped(anchor, frequency, START, END), anchor
+
+
+def test_month_end_clamping_is_sticky():
+    [dates] = expanded([datetime(2024, 1, 31)], ["monthly"], START, datetime(2024, 6, 1))
+    assert [date.day for date in dates] == [31, 29, 29, 29, 29]
+
+    [dates] = expanded([datetime(2024, 2, 29)], ["yearly"], START, datetime(2029, 1, 1))
+    assert [date.isoformat() for date in dates] == ["2024-02-29", "2025-02-28", "2026-02-28", "2027-02-28", "2028-02-28"]
+
+
+def test_mixed_frequencies_expand_independently():
+    anchors = [datetime(2024, 1, 31), datetime(2024, 1, 31), datetime(2024, 1, 31)]
+    frequencies = ["weekly", "monthly", "yearly"]
+    result = expanded(anchors, frequencies, START, END)
+    for anchor, frequency, dates in zip(anchors, frequencies, result):
+        assert dates == stepped(anchor, frequency, START, END)
+
+
+def test_window_is_half_open():
+    items, dates = expand_recurrences([datetime(2024, 3, 1)], ["monthly"], datetime(2024, 3, 1), datetime(2024, 5, 1))
+    assert dates.astype(str).tolist() == ["2024-03-01", "2024-04-01"]
+    assert items.tolist() == [0, 0]
+
+
+def test_unknown_frequency_is_rejected():
+    with pytest.raises(ValueError):
+        expand_recurrences([datetime(2024, 1, 1)], ["daily"], START, END)
+
+
+def test_cash_flow_buckets_occurrences_by_month_and_category():
+    forecast = project_cash_flow(
+        anchors=[datetime(2024, 1, 31), datetime(2024, 1, 10), datetime(2024, 2, 1)],
+        frequencies=["monthly", "weekly", "yearly"],
+        amounts=[100.0, 5.0, 1200.0],
+        categories=["utilities", "food", "software"],
+        is_subscription=[False, False, True],
+        start=datetime(2024, 1, 15),
+        months=3,
+    )
+    months = forecast["months"]
+    assert [month["month"] for month in months] == ["2024-01", "2024-02", "2024-03"]
+    # January only counts from the 15th: the 17th, 24th and 31st for the weekly item
+    assert months[0]["category_breakdown"] == {"utilities": 100.0, "food": 15.0}
+    assert months[1]["category_breakdown"] == {"utilities": 100.0, "food": 20.0, "software": 1200.0}
+    assert months[2]["category_breakdown"] == {"utilities": 100.0, "food": 20.0}
+    assert [month["subscription_spending"] for month in months] == [0.0, 1200.0, 0.0]
+    assert [month["expense_spending"] for month in months] == [115.0, 120.0, 120.0]
+    assert forecast["category_totals"] == {"utilities": 300.0, "food": 55.0, "software": 1200.0}
+    assert forecast["total_spending"] == pytest.approx(1555.0)
+
+
+def test_cash_flow_with_nothing_recurring():
+    forecast = project_cash_flow([], [], [], [], [], datetime(2024, 1, 1), 2)
+    assert [month["total_spending"] for month in forecast["months"]] == [0.0, 0.0]
+    assert forecast["category_totals"] == {}
+    assert forecast["total_spending"] == 0.0
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+def test_etag_matching_is_weak():
+    assert server.etag_matches('W/"abc"', 'W/"abc"')
+    assert server.etag_matches('"abc"', 'W/"abc"')
+    assert server.etag_matches('"x", W/"abc"', 'W/"abc"')
+    assert server.etag_matches("*", 'W/"abc"')
+    assert not server.etag_matches('W/"abd"', 'W/"abc"')
+    assert not server.etag_matches(None, 'W/"abc"')
+
+
+def revalidate(client, path, etag, **kwargs):
+    return client.get(path, headers={"If-None-Match": etag, **kwargs.pop("headers", {})}, **kwargs)
+
+
+def test_unchanged_list_is_answered_with_304(client):
+    client.post("/api/budgets", json={"type": "annual", "amount": 100})
+    first = client.get("/api/budgets")
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    again = revalidate(client, "/api/budgets", etag)
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+
+
+def test_write_changes_the_etag(client):
+    etag = client.get("/api/budgets").headers["ETag"]
+    client.post("/api/budgets", json={"type": "annual", "amount": 100})
+
+    after = revalidate(client, "/api/budgets", etag)
+    assert after.status_code == 200
+    assert after.headers["ETag"] != etag
+    assert len(after.json()) == 1
+
+
+def test_writes_only_change_dependent_etags(client):
+    budgets = client.get("/api/budgets").headers["ETag"]
+    dashboard = client.get("/api/dashboard").headers["ETag"]
+    client.post("/api/expenses", json={
+        "name": "Coffee", "amount": 3, "category": "food", "date": datetime.utcnow().isoformat(),
+    })
+
+    assert revalidate(client, "/api/budgets", budgets).status_code == 304
+    refreshed = revalidate(client, "/api/dashboard", dashboard)
+    assert refreshed.status_code == 200
+    assert refreshed.json()["expense_spending"] == 3
+
+
+def test_etags_are_per_user_and_per_query(client, user_id):
+    etag = client.get("/api/expenses").headers["ETag"]
+    assert client.get("/api/expenses", params={"limit": 5}).headers["ETag"] != etag
+
+    other = {server.USER_ID_HEADER: f"{user_id}-other"}
+    assert client.get("/api/expenses", headers=other).headers["ETag"] != etag
+    client.post("/api/expenses", headers=other, json={
+        "name": "Tea", "amount": 2, "category": "food", "date": datetime.utcnow().isoformat(),
+    })
+    assert revalidate(client, "/api/expenses", etag).status_code == 304
+
+
+@pytest.mark.parametrize("path", ["/api/expenses/missing", "/api/_debug/cache"])
+def test_routes_without_a_cacheable_200_get_no_etag(client, path):
+    assert "ETag" not in client.get(path).headers
+
+
+def test_startup_refuses_several_workers(sqlite_path, monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    with pytest.raises(RuntimeError, match="WEB_CONCURRENCY=4"):
+        with TestClient(server.app):
+            pass
+
+
+@pytest.mark.parametrize("argv, env, expected", [
+    (["/venv/bin/uvicorn", "server:app", "--workers", "4"], {}, (4, "uvicorn --workers")),
+    (["/venv/lib/python3.11/site-packages/uvicorn/__main__.py", "server:app", "--workers=3"], {}, (3, "uvicorn --workers")),
+    (["/venv/bin/gunicorn", "-w4", "-k", "uvicorn.workers.UvicornWorker", "server:app"], {}, (4, "gunicorn --workers")),
+    (["/venv/bin/gunicorn", "server:app"], {"GUNICORN_CMD_ARGS": "--workers 2"}, (2, "gunicorn --workers")),
+    (["/venv/bin/gunicorn", "server:app"], {"WEB_CONCURRENCY": "3"}, (3, "WEB_CONCURRENCY")),
+    (["/venv/bin/uvicorn", "server:app", "--reload"], {}, (1, "WEB_CONCURRENCY")),
+    (["/venv/bin/other", "-w", "5"], {}, (1, "WEB_CONCURRENCY")),
+])
+def test_worker_count_is_read_from_the_server_command_line(argv, env, expected, monkeypatch):
+    monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    assert server.configured_workers(argv) == expected
@@ -0,0 +1,150 @@
+import asyncio
+import csv
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+def import_rows(client, rows, **params):
+    body = "\n".join(json.dumps(row) for row in rows)
+    response = client.post(
+        "/api/import", params=params, content=body, headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def expense_row(id, amount, **extra):
+    return {
+        "record_type": "expense", "id": id, "name": "Coffee", "amount": amount, "category": "food",
+        "date": "2026-03-10T12:00:00", **extra,
+    }
+
+
+def test_a_repeated_id_in_one_batch_is_imported_as_an_update(mongo_client, mongo_database, user_id):
+    report = import_rows(mongo_client, [expense_row("dup-1", 10), expense_row("dup-1", 30)])
+
+    assert (report["created"], report["updated"], report["failed"]) == (1, 1, 0)
+    assert mongo_client.get("/api/expenses/dup-1").json()["amount"] == 30
+    assert asyncio.run(server.verify_rollups(mongo_database)) == []
+    [row] = asyncio.run(mongo_database.monthly_rollups.find({"user_id": user_id}).to_list(None))
+    assert (row["total"], row["count"]) == (30, 1)
+
+
+def test_rows_with_an_id_are_upserted_and_bump_the_version(client):
+    assert import_rows(client, [expense_row("e-1", 10)])["created"] == 1
+    stale = client.get("/api/expenses/e-1").json()
+
+    report = import_rows(client, [expense_row("e-1", 12, name="Espresso")])
+    assert (report["created"], report["updated"]) == (0, 1)
+    replaced = client.get("/api/expenses/e-1").json()
+    assert (replaced["name"], replaced["amount"], replaced["version"]) == ("Espresso", 12, stale["version"] + 1)
+
+    response = client.put("/api/expenses/e-1", json={"amount": 1, "version": stale["version"]})
+    assert response.status_code == 409
+
+
+def test_rows_without_an_id_are_always_inserted(client):
+    row = expense_row(None, 5)
+    del row["id"]
+    assert import_rows(client, [row, row])["created"] == 2
+    assert import_rows(client, [row])["created"] == 1
+    assert len(client.get("/api/expenses").json()) == 3
+
+
+def test_an_id_owned_by_another_user_is_not_replaced(client, user_id):
+    import_rows(client, [expense_row("shared", 10)])
+
+    other = {server.USER_ID_HEADER: f"{user_id}-other"}
+    response = client.post(
+        "/api/import", content=json.dumps(expense_row("shared", 99)),
+        headers={**other, "Content-Type": "application/x-ndjson"},
+    ).json()
+    assert (response["created"], response["updated"], response["failed"]) == (0, 0, 1)
+    assert client.get("/api/expenses/shared").json()["amount"] == 10
+
+
+def test_batches_flush_per_collection_and_report_row_numbers(client):
+    rows = [
+        expense_row("e-1", 1),
+        {"record_type": "subscription", "id": "s-1", "name": "Music", "cost": 10, "billing_frequency": "monthly",
+         "next_due_date": "2026-04-01T00:00:00", "category": "streaming"},
+        expense_row("e-2", "lots"),
+        expense_row("e-3", 3),
+        {"record_type": "budget", "id": "b-1", "type": "annual", "amount": 1000},
+        expense_row("e-4", 4),
+        {"record_type": "unknown"},
+        expense_row("e-5", 5),
+    ]
+    report = import_rows(client, rows, batch_size=2)
+
+    assert (report["created"], report["updated"], report["failed"]) == (6, 0, 2)
+    assert [error["row"] for error in report["errors"]] == [3, 7]
+    assert sorted(row["id"] for row in client.get("/api/expenses").json()) == ["e-1", "e-3", "e-4", "e-5"]
+    assert [row["id"] for row in client.get("/api/subscriptions").json()] == ["s-1"]
+    assert [row["id"] for row in client.get("/api/budgets").json()] == ["b-1"]
+
+
+def test_imports_keep_the_rollups_in_step(mongo_client, mongo_database):
+    rows = [expense_row(f"e-{i}", i, category=["food", "transportation"][i % 2]) for i in range(7)]
+    assert import_rows(mongo_client, rows, batch_size=3)["created"] == 7
+    assert asyncio.run(server.verify_rollups(mongo_database)) == []
+
+    # Replacements move amounts between months and categories, some twice in one batch
+    moved = [
+        expense_row("e-1", 50, category="food", date="2026-04-02T00:00:00"),
+        expense_row("e-2", 20),
+        expense_row("e-1", 60, category="transportation", date="2026-05-02T00:00:00"),
+        expense_row("e-9", 9),
+    ]
+    report = import_rows(mongo_client, moved, batch_size=3)
+    assert (report["created"], report["updated"], report["failed"]) == (1, 3, 0)
+    assert asyncio.run(server.verify_rollups(mongo_database)) == []
+    assert mongo_client.get("/api/expenses/e-1").json()["amount"] == 60
+
+
+def seed_records(client):
+    for i in range(9):
+        response = client.post("/api/expenses", json={
+            "name": f"Expense, \"{i}\"", "amount": i + 0.25, "category": "food", "date": f"2026-03-{i + 1:02d}T08:30:00",
+            "tags": ["a", "b"] if i % 2 else [], "notes": "line one\nline two" if i == 3 else None,
+            "is_recurring": i == 4, "recurring_frequency": "monthly" if i == 4 else None,
+        })
+        assert response.status_code == 200, response.text
+    for i in range(3):
+        client.post("/api/subscriptions", json={
+            "name": f"Service {i}", "cost": 10 * (i + 1), "billing_frequency": "monthly",
+            "next_due_date": "2026-04-01T00:00:00", "category": "streaming",
+        })
+    client.delete(f"/api/subscriptions/{client.get('/api/subscriptions').json()[0]['id']}")
+    client.post("/api/budgets", json={"type": "annual", "amount": 1000})
+
+
+def export_rows(client, format):
+    response = client.get("/api/export", params={"format": format})
+    assert response.status_code == 200
+    if format == "ndjson":
+        rows = [json.loads(line) for line in response.text.splitlines()]
+    else:
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+    return response.text, sorted(rows, key=lambda row: row["id"])
+
+
+@pytest.mark.parametrize("format, content_type", [("ndjson", "application/x-ndjson"), ("csv", "text/csv")])
+def test_export_then_import_round_trips(format, content_type, user_id, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_BATCH_SIZE", 2)  # Many pages per collection
+    monkeypatch.setattr(server, "SQLITE_PATH", str(tmp_path / "source.db"))
+    with TestClient(server.app, headers={server.USER_ID_HEADER: user_id}) as source:
+        seed_records(source)
+        body, exported = export_rows(source, format)
+    assert len(exported) == 13
+
+    monkeypatch.setattr(server, "SQLITE_PATH", str(tmp_path / "target.db"))
+    with TestClient(server.app, headers={server.USER_ID_HEADER: user_id}) as target:
+        response = target.post("/api/import", content=body, params={"batch_size": 5}, headers={"Content-Type": content_type})
+        assert response.json() == {"created": 13, "updated": 0, "failed": 0, "errors": []}
+        assert export_rows(target, format)[1] == exported
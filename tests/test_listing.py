@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+BACKENDS = ["client", "mongo_client"]
+
+
+def add_expenses(client, amounts):
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=len(amounts))
+    ids = []
+    for i, amount in enumerate(amounts):
+        response = client.post("/api/expenses", json={
+            "name": f"Expense {i}", "amount": amount, "category": "food", "date": (start + timedelta(days=i)).isoformat(),
+        })
+        ids.append(response.json()["id"])
+    return ids
+
+
+def add_subscription(client, name, cost, billing_frequency, **extra):
+    return client.post("/api/subscriptions", json={
+        "name": name, "cost": cost, "billing_frequency": billing_frequency,
+        "next_due_date": "2026-04-01T00:00:00", "category": "streaming", **extra,
+    }).json()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_top_expenses_by_amount(request, backend):
+    client = request.getfixturevalue(backend)
+    ids = add_expenses(client, [5, 40, 12, 40, 3])
+
+    response = client.get("/api/expenses", params={"top": 3})
+    assert server.NEXT_CURSOR_HEADER not in response.headers
+    rows = response.json()
+    assert [row["amount"] for row in rows] == [40, 40, 12]
+    assert [row["id"] for row in rows[:2]] == sorted([ids[1], ids[3]], reverse=True)  # Ties by id, highest first
+
+    rows = client.get("/api/expenses", params={"top": 2, "by": "date", "fields": "amount"}).json()
+    assert rows == [{"id": ids[4], "amount": 3}, {"id": ids[3], "amount": 40}]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_top_subscriptions_by_monthly_cost_return_it(request, backend):
+    client = request.getfixturevalue(backend)
+    add_subscription(client, "Yearly", 240, "yearly")
+    add_subscription(client, "Cheap", 15, "monthly")
+    add_subscription(client, "Dear", 25, "monthly")
+    cancelled = add_subscription(client, "Gone", 99, "monthly")
+    client.delete(f"/api/subscriptions/{cancelled['id']}")
+
+    rows = client.get("/api/subscriptions", params={"top": 2, "fields": "name,cost"}).json()
+    assert [(row["name"], row["cost"], row["monthly_cost"]) for row in rows] == [("Dear", 25, 25), ("Yearly", 240, 20)]
+
+    page = client.get("/api/subscriptions", params={"sort": "monthly_cost", "order": "asc", "limit": 1})
+    assert page.headers[server.NEXT_CURSOR_HEADER]
+    assert [(row["name"], row["monthly_cost"]) for row in page.json()] == [("Cheap", 15)]
+
+    rows = client.get("/api/subscriptions", params={"top": 1, "by": "cost", "active_only": False}).json()
+    assert [row["name"] for row in rows] == ["Yearly"]
+    assert "monthly_cost" not in rows[0]
+
+
+def test_top_is_capped(client):
+    assert client.get("/api/expenses", params={"top": server.MAX_TOP_N + 1}).status_code == 422
+
+
+def test_select_fields_keeps_model_order_and_always_includes_id():
+    assert server.select_fields(server.Expense, None) == list(server.Expense.model_fields)
+    assert server.select_fields(server.Expense, " amount,name ,,") == ["id", "name", "amount"]
+    assert server.select_fields(server.Expense, "id") == ["id"]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_fields_limit_the_returned_fields(request, backend):
+    client = request.getfixturevalue(backend)
+    [expense_id] = add_expenses(client, [7])
+    subscription = add_subscription(client, "Music", 10, "monthly")
+
+    assert client.get("/api/expenses", params={"fields": "name,amount"}).json() == [
+        {"id": expense_id, "name": "Expense 0", "amount": 7},
+    ]
+    assert client.get("/api/subscriptions", params={"fields": "cost"}).json() == [
+        {"id": subscription["id"], "cost": 10},
+    ]
+
+
+def test_fields_apply_to_searches_and_paging(client):
+    ids = add_expenses(client, [7, 8])
+
+    rows = client.get("/api/expenses", params={"fields": "amount", "search": "expense"}).json()
+    assert sorted(rows, key=lambda row: row["amount"]) == [{"id": ids[0], "amount": 7}, {"id": ids[1], "amount": 8}]
+    page = client.get("/api/expenses", params={"fields": "name", "sort": "amount", "limit": 1})
+    assert page.json() == [{"id": ids[1], "name": "Expense 1"}]
+    cursor = page.headers[server.NEXT_CURSOR_HEADER]
+    assert client.get("/api/expenses", params={"fields": "name", "sort": "amount", "limit": 1, "cursor": cursor}).json() == [
+        {"id": ids[0], "name": "Expense 0"},
+    ]
+
+
+def test_unknown_fields_are_rejected(client):
+    response = client.get("/api/expenses", params={"fields": "name,user_id,password"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown fields: password, user_id"
+    assert client.get("/api/subscriptions", params={"fields": "search_terms"}).status_code == 400
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import metrics
+import server
+
+
+def sample(text, name, **labels):
+    """The value of one series in Prometheus text output, or 0 if it is absent."""
+    label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    prefix = f"{name}{{{label_text}}} " if labels else f"{name} "
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("latency_seconds", "Latency.", ("route",), (0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(('/api/"x"',), value)
+    text = "\n".join(histogram.render())
+
+    assert "# TYPE latency_seconds histogram" in text
+    route = '/api/\\"x\\"'
+    assert [sample(text, "latency_seconds_bucket", route=route, le=le) for le in ("0.1", "1", "+Inf")] == [1, 3, 4]
+    assert sample(text, "latency_seconds_sum", route=route) == 4.05
+    assert sample(text, "latency_seconds_count", route=route) == 4
+
+
+def test_mongo_commands_are_charged_to_the_current_route():
+    listener = metrics.CommandMetrics()
+    event = SimpleNamespace(command_name="find", duration_micros=2000, reply={"cursor": {"firstBatch": [{}, {}]}})
+    labels = {"route": "/api/test-route", "command": "find"}
+    before = metrics.registry.render()
+
+    stats = metrics.RequestStats("/api/test-route")
+    token = metrics.current_request.set(stats)
+    try:
+        listener.succeeded(event)
+    finally:
+        metrics.current_request.reset(token)
+    listener.succeeded(event)  # Outside a request
+
+    after = metrics.registry.render()
+    assert (stats.db_commands, stats.db_documents, stats.db_seconds) == (1, 2, 0.002)
+    assert sample(after, "nbntracker_mongo_commands_total", **labels) - sample(before, "nbntracker_mongo_commands_total", **labels) == 1
+    assert sample(after, "nbntracker_mongo_documents_total", **labels) - sample(before, "nbntracker_mongo_documents_total", **labels) == 2
+    background = {"route": metrics.BACKGROUND_ROUTE, "command": "find"}
+    assert sample(after, "nbntracker_mongo_commands_total", **background) > sample(before, "nbntracker_mongo_commands_total", **background)
+
+
+def request_count(client, method, route, status):
+    text = client.get("/metrics").text
+    return sample(text, "nbntracker_http_request_duration_seconds_count", method=method, route=route, status=status)
+
+
+def test_requests_are_labelled_by_route_template(client):
+    routes = [
+        ("GET", "/api/expenses/{expense_id}", "404"),
+        ("GET", "/api/expenses", "200"),
+        ("GET", "unmatched", "404"),
+    ]
+    before = [request_count(client, *route) for route in routes]
+
+    client.get("/api/expenses/first-missing-id")
+    client.get("/api/expenses/second-missing-id")
+    client.get("/api/expenses")
+    client.get("/no/such/path")
+
+    assert [request_count(client, *route) - count for route, count in zip(routes, before)] == [2, 1, 1]
+    text = client.get("/metrics").text
+    assert "missing-id" not in text
+    assert sample(text, "nbntracker_http_response_size_bytes_count", method="GET", route="/api/expenses") >= 1
+
+
+def test_metrics_endpoint_serves_prometheus_text(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE nbntracker_http_request_duration_seconds histogram" in response.text
+    assert "Server-Timing" in response.headers
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime
+
+from pymongo.errors import OperationFailure
+
+import server
+
+
+def insert_expenses(database, user_id, *amounts):
+    async def insert():
+        docs = []
+        for amount in amounts:
+            doc = server.expense_document(
+                server.Expense(name="Coffee", amount=amount, category="food", date=datetime(2026, 3, 10)), user_id
+            )
+            await server.storage.expenses.insert(dict(doc))
+            docs.append(doc)
+        await server.storage.apply_rollup_changes([(None, doc) for doc in docs])
+        return docs
+    return asyncio.run(insert())
+
+
+def test_write_many_sorts_a_short_bulk_write_into_unmatched_writes(mongo_database, user_id):
+    [expense, other] = insert_expenses(mongo_database, user_id, 3, 4)
+
+    result = asyncio.run(server.storage.expenses.write_many(user_id, [
+        ("update", expense["id"], {"version": 1}, {"amount": 4.0}),
+        ("update", expense["id"], {"version": 1}, {"amount": 5.0}),
+        ("update", other["id"], {}, {"amount": 6.0}),
+        ("deactivate", "missing"),
+        ("delete", "missing"),
+    ]))
+    assert result.updated == 2
+    assert result.unmatched == {1, 3, 4}
+    assert result.uncertain == set()
+    assert result.errors == {}
+
+
+def test_write_many_does_not_reread_when_every_write_matched(mongo_database, user_id, monkeypatch):
+    [expense, other] = insert_expenses(mongo_database, user_id, 3, 4)
+
+    async def reread(*args):
+        raise AssertionError("no re-read expected")
+    monkeypatch.setattr(server.storage.expenses, "_unmatched_updates", reread)
+    result = asyncio.run(server.storage.expenses.write_many(user_id, [
+        ("update", expense["id"], {"version": 1}, {"amount": 4.0}),
+        ("delete", other["id"]),
+    ]))
+    assert (result.updated, result.unmatched, result.uncertain) == (1, set(), set())
+
+
+def test_deletes_racing_another_request_recount_their_rollups(mongo_database, user_id):
+    [kept, deleted, raced] = insert_expenses(mongo_database, user_id, 3, 4, 5)
+
+    async def race():
+        # Another request deletes `raced` between the batch's read and its write
+        fields = server.ROLLUP_FIELDS + ["version"]
+        existing = await server.storage.expenses.find(user_id, {"id": {"$in": [deleted["id"], raced["id"]]}}, fields)
+        await server.storage.expenses.delete(user_id, raced["id"])
+        await server.storage.apply_rollup_changes([(raced, None)])
+        result = await server.storage.expenses.write_many(user_id, [("delete", doc["id"]) for doc in existing])
+        await server.storage.reconcile_rollup_changes([(doc, None) for doc in existing])
+        return result
+
+    result = asyncio.run(race())
+    assert result.uncertain == {0, 1}
+    assert asyncio.run(server.verify_rollups(mongo_database)) == []
+    [row] = asyncio.run(mongo_database.monthly_rollups.find({"user_id": user_id}).to_list(None))
+    assert (row["total"], row["count"]) == (3, 1)
+
+
+def test_startup_backfills_run_when_index_reconciliation_fails(mongo_database, monkeypatch):
+    async def fail(database):
+        raise OperationFailure("index build failed")
+    monkeypatch.setattr(server, "reconcile_indexes", fail)
+
+    async def legacy_start():
+        await mongo_database.expenses.insert_one({
+            "id": "legacy", "name": "Coffee", "amount": 3.0, "category": "food", "date": datetime(2026, 3, 10),
+        })
+        await mongo_database.monthly_rollups.delete_many({})
+        await server.ensure_indexes(mongo_database)
+        return await mongo_database.expenses.find_one({"id": "legacy"})
+
+    legacy = asyncio.run(legacy_start())
+    assert legacy["user_id"] == server.LEGACY_USER_ID
+    assert legacy["version"] == 1
+    assert asyncio.run(server.verify_rollups(mongo_database)) == []
+    assert asyncio.run(mongo_database.monthly_rollups.count_documents({})) == 1
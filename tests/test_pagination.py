@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+def test_cursor_round_trips_sort_values():
+    values = [datetime(2026, 3, 1, 12, 30, 15, 250000), 12.5, "Coffee", None, "3f2c-id"]
+    cursor = server.encode_cursor(values)
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+    assert server.decode_cursor(cursor) == values
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor!", "e30", server.encode_cursor([])[:-1] + "@"])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        server.keyset_filter([("date", -1), ("id", -1)], cursor)
+    assert error.value.status_code == 400
+
+
+def test_cursor_for_another_sort_is_a_400():
+    cursor = server.encode_cursor([12.5, "id"])
+    with pytest.raises(HTTPException) as error:
+        server.keyset_filter([("date", -1), ("name", 1), ("id", -1)], cursor)
+    assert error.value.status_code == 400
+
+
+def test_keyset_filter_selects_rows_after_the_cursor():
+    sort = [("amount", -1), ("id", -1)]
+    assert server.keyset_filter(sort, None) == {}
+    assert server.keyset_filter(sort, server.encode_cursor([5.0, "m"])) == {"$or": [
+        {"amount": {"$lt": 5.0}},
+        {"amount": 5.0, "id": {"$lt": "m"}},
+    ]}
+
+
+def test_trim_page_only_returns_a_cursor_when_more_rows_exist():
+    sort = [("date", 1), ("id", 1)]
+    docs = [{"id": str(i), "date": datetime(2026, 1, 1) + timedelta(days=i)} for i in range(3)]
+
+    assert server.trim_page(docs[:2], sort, 2) == (docs[:2], None)
+    page, cursor = server.trim_page(docs, sort, 2)
+    assert page == docs[:2]
+    assert server.decode_cursor(cursor) == [docs[1]["date"], "1"]
+
+
+def walk_pages(collection, sort, limit, computed=None):
+    async def walk():
+        rows, cursor = [], None
+        while True:
+            page, cursor = await server.fetch_page(collection, {}, sort, limit, cursor, computed)
+            rows += page
+            if not cursor:
+                return rows
+    return asyncio.run(walk())
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+def test_pages_visit_every_document_once_despite_ties(direction):
+    collection = AsyncMongoMockClient().db.expenses
+    docs = [{"id": f"{i:02d}", "amount": float(i % 3)} for i in range(10)]
+    asyncio.run(collection.insert_many([dict(doc) for doc in docs]))
+
+    sort = [("amount", direction), ("id", direction)]
+    rows = walk_pages(collection, sort, 3)
+    expected = sorted(docs, key=lambda doc: (doc["amount"], doc["id"]), reverse=direction < 0)
+    assert [row["id"] for row in rows] == [doc["id"] for doc in expected]
+
+
+def test_pages_sorted_on_a_computed_field():
+    collection = AsyncMongoMockClient().db.subscriptions
+    docs = [
+        {"id": "a", "cost": 120.0, "billing_frequency": "yearly"},
+        {"id": "b", "cost": 20.0, "billing_frequency": "monthly"},
+        {"id": "c", "cost": 10.0, "billing_frequency": "monthly"},
+        {"id": "d", "cost": 240.0, "billing_frequency": "yearly"},
+    ]
+    asyncio.run(collection.insert_many([dict(doc) for doc in docs]))
+
+    sort = [("monthly_cost", 1), ("id", 1)]
+    rows = walk_pages(collection, sort, 1, {"monthly_cost": server.MONTHLY_COST_EXPR})
+    assert [row["id"] for row in rows] == ["a", "c", "b", "d"]
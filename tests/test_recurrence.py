@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import server
+
+
+def add_template(user_id, date, frequency="monthly", amount=10.0):
+    template = server.expense_document(server.new_expense(server.ExpenseCreate(
+        name="Rent", amount=amount, category="utilities", date=date,
+        is_recurring=True, recurring_frequency=frequency,
+    )), user_id)
+
+    async def insert():
+        await server.storage.expenses.insert(dict(template))
+        await server.storage.apply_rollup_changes([(None, template)])
+    asyncio.run(insert())
+    return template
+
+
+def occurrence_dates(template):
+    docs = asyncio.run(server.storage.expenses.find(None, {"recurrence_of": template["id"]}, ["date"]))
+    return sorted(doc["date"] for doc in docs)
+
+
+def next_due_date(template):
+    return asyncio.run(server.storage.expenses.find_one(template["user_id"], template["id"]))["next_due_date"]
+
+
+def materialise(now):
+    return asyncio.run(server.materialise_recurring_expenses(server.storage, now))
+
+
+def assert_rollups_match(database):
+    assert asyncio.run(server.verify_rollups(database)) == []
+
+
+def test_catch_up_inserts_every_missed_period(mongo_database, user_id):
+    template = add_template(user_id, datetime(2024, 1, 10))
+
+    stats = materialise(datetime(2024, 5, 15))
+    assert stats == {"occurrences": 4, "expenses_advanced": 1}
+    assert occurrence_dates(template) == [datetime(2024, month, 10) for month in (2, 3, 4, 5)]
+    assert next_due_date(template) == datetime(2024, 6, 10)
+    assert_rollups_match(mongo_database)
+
+    assert materialise(datetime(2024, 5, 15)) == {"occurrences": 0, "expenses_advanced": 0}
+
+
+def test_month_end_dates_stay_clamped(mongo_database, user_id):
+    template = add_template(user_id, datetime(2024, 1, 31))
+
+    materialise(datetime(2024, 5, 31))
+    assert [date.day for date in occurrence_dates(template)] == [29, 29, 29, 29]
+    assert next_due_date(template) == datetime(2024, 6, 29)
+    assert_rollups_match(mongo_database)
+
+
+def test_rerun_after_a_crash_before_the_rollups_counts_each_occurrence_once(mongo_database, user_id, monkeypatch):
+    template = add_template(user_id, datetime(2024, 1, 10))
+
+    async def crash(changes):
+        raise RuntimeError("stopped before the rollups")
+    with monkeypatch.context() as patch:
+        patch.setattr(server.storage, "apply_rollup_changes", crash)
+        with pytest.raises(RuntimeError):
+            materialise(datetime(2024, 3, 15))
+    assert len(occurrence_dates(template)) == 2
+    assert asyncio.run(server.verify_rollups(mongo_database)) != []
+
+    assert materialise(datetime(2024, 3, 15)) == {"occurrences": 0, "expenses_advanced": 1}
+    assert len(occurrence_dates(template)) == 2
+    assert_rollups_match(mongo_database)
+
+
+def test_rerun_after_a_crash_before_the_advance_counts_each_occurrence_once(mongo_database, user_id):
+    template = add_template(user_id, datetime(2024, 1, 10))
+    materialise(datetime(2024, 3, 15))
+
+    # As if the run had stopped between the rollups and moving the template on
+    asyncio.run(mongo_database.expenses.update_one(
+        {"id": template["id"]}, {"$set": {"next_due_date": datetime(2024, 2, 10)}}
+    ))
+    assert materialise(datetime(2024, 4, 15)) == {"occurrences": 1, "expenses_advanced": 1}
+    assert occurrence_dates(template) == [datetime(2024, month, 10) for month in (2, 3, 4)]
+    assert_rollups_match(mongo_database)
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+def cached(cache, user_id, value):
+    """get_or_compute for one user, computing `value` on a miss."""
+    async def compute():
+        return value
+    return asyncio.run(cache.get_or_compute("dashboard", compute, user_id))
+
+
+def test_cache_backend_is_abstract():
+    class Incomplete(server.CacheBackend):
+        def get(self, key):
+            return server.CACHE_MISS
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_write_invalidates_only_the_writers_entries():
+    cache = server.ResponseCache(server.LRUCacheBackend())
+    assert cached(cache, "alice", 1) == 1
+    assert cached(cache, "bob", 1) == 1
+
+    cache.invalidate("alice")
+    assert cached(cache, "alice", 2) == 2
+    assert cached(cache, "bob", 2) == 1
+
+
+def test_tracked_users_are_bounded():
+    cache = server.ResponseCache(server.LRUCacheBackend(), max_users=3)
+    for i in range(10):
+        cache.invalidate(f"user-{i}")
+    assert list(cache.user_generations) == ["user-7", "user-8", "user-9"]
+    assert cache.stats()["tracked_users"] == 3
+
+
+def test_dropped_user_never_reads_stale_entries():
+    cache = server.ResponseCache(server.LRUCacheBackend(), max_users=1)
+    assert cached(cache, "alice", "before") == "before"
+    cache.invalidate("alice")
+    assert cached(cache, "alice", "after") == "after"
+
+    # bob's write pushes alice out of the tracked users
+    cache.invalidate("bob")
+    assert "alice" not in cache.user_generations
+    # Nothing was written since "after", so it is still the current value
+    assert cached(cache, "alice", "recomputed") == "after"
+
+    cache.invalidate("alice")
+    cache.invalidate("bob")
+    assert cached(cache, "alice", "latest") == "latest"
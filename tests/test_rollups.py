@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+
+import server
+
+EASTERN = timezone(timedelta(hours=-5))
+
+
+def test_month_key_uses_the_utc_month():
+    assert server.month_key(datetime(2026, 3, 31, 22, 30)) == "2026-03"
+    assert server.month_key(datetime(2026, 3, 31, 22, 30, tzinfo=EASTERN)) == "2026-04"
+    assert server.month_key(datetime(2026, 4, 1, 1, 0, tzinfo=timezone(timedelta(hours=3)))) == "2026-03"
+
+
+def test_rollup_deltas_net_out_per_month_and_category():
+    old = {"user_id": "alice", "date": datetime(2026, 3, 31, 22, 30, tzinfo=EASTERN), "amount": 10.0, "category": "food"}
+    moved = {**old, "date": datetime(2026, 3, 15), "amount": 4.0}
+    added = {**old, "user_id": "bob", "category": server.ExpenseCategory.SHOPPING}
+
+    deltas = server.rollup_deltas([(old, moved), (None, added), (None, None)])
+    assert deltas == {
+        ("alice", "2026-04", "food"): [-10.0, -1],
+        ("alice", "2026-03", "food"): [4.0, 1],
+        ("bob", "2026-04", "shopping"): [10.0, 1],
+    }
+
+
+def test_batch_rejects_a_second_operation_on_the_same_id(client):
+    expense = client.post("/api/expenses", json={
+        "name": "Coffee", "amount": 10, "category": "food", "date": datetime.utcnow().isoformat(),
+    }).json()
+
+    response = client.post("/api/expenses/batch", json={"operations": [
+        {"op": "update", "id": expense["id"], "data": {"amount": 1}},
+        {"op": "update", "id": expense["id"], "data": {"amount": 2}},
+        {"op": "delete", "id": expense["id"]},
+    ]}).json()
+    assert [(result["status"], result["error"] is None) for result in response["results"]] == [
+        (200, True), (409, False), (409, False),
+    ]
+    assert client.get(f"/api/expenses/{expense['id']}").json()["amount"] == 1
+    assert client.get("/api/dashboard").json()["expense_spending"] == 1
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import server
+
+
+def test_search_terms_are_lowercase_word_prefixes():
+    assert server.name_search_terms("Big Mac") == ["b", "bi", "big", "m", "ma", "mac"]
+    terms = server.name_search_terms("Supercalifragilistic")
+    assert max(len(term) for term in terms) == server.MAX_SEARCH_PREFIX
+
+
+def test_search_filter_needs_every_word():
+    assert server.name_search_filter("Grocery  SHOP!") == {"search_terms": {"$all": ["grocery", "shop"]}}
+    assert server.name_search_filter("  ") == {}
+
+
+def create_expenses(client, names):
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=len(names))
+    ids = {}
+    for i, name in enumerate(names):
+        response = client.post("/api/expenses", json={
+            "name": name, "amount": 1, "category": "food", "date": (start + timedelta(days=i)).isoformat(),
+        })
+        ids[name] = response.json()["id"]
+    return ids
+
+
+def search(client, query, **params):
+    response = client.get("/api/expenses", params={"search": query, **params})
+    assert response.status_code == 200, response.text
+    return [row["name"] for row in response.json()]
+
+
+def test_exact_then_prefix_then_word_matches(client):
+    create_expenses(client, ["Iced coffee", "Coffee beans", "Tea", "Cofactor", "Coffee", "Decaf coffee"])
+
+    # Within a rank the list keeps its own order, newest first
+    assert search(client, "coffee") == ["Coffee", "Coffee beans", "Decaf coffee", "Iced coffee"]
+    assert search(client, "COF") == ["Coffee", "Cofactor", "Coffee beans", "Decaf coffee", "Iced coffee"]
+    assert search(client, "ice cof") == ["Iced coffee"]
+    assert search(client, "latte") == []
+
+
+def test_search_results_page_in_rank_order(client):
+    create_expenses(client, ["Coffee beans", "Iced coffee", "Coffee", "Coffee filter"])
+    expected = search(client, "coffee")
+
+    names, cursor = [], None
+    while True:
+        params = {"search": "coffee", "limit": 1, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/expenses", params=params)
+        names += [row["name"] for row in response.json()]
+        cursor = response.headers.get(server.NEXT_CURSOR_HEADER)
+        if not cursor:
+            break
+    assert names == expected
+
+
+def test_renamed_documents_are_found_by_their_new_name(client):
+    ids = create_expenses(client, ["Coffee"])
+    client.put(f"/api/expenses/{ids['Coffee']}", json={"name": "Green tea"})
+
+    assert search(client, "coffee") == []
+    assert search(client, "gre") == ["Green tea"]
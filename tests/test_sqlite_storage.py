@@ -0,0 +1,172 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+
+def this_month(day: int) -> str:
+    return datetime.utcnow().replace(day=day, hour=12, minute=0, second=0, microsecond=0).isoformat()
+
+
+def create_expense(client, name="Coffee", amount=3.5, category="food", date=None, **extra):
+    response = client.post("/api/expenses", json={
+        "name": name, "amount": amount, "category": category, "date": date or this_month(1), **extra,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def fetch_all(client, path, **params):
+    rows, cursor = [], None
+    while True:
+        response = client.get(path, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        rows += response.json()
+        cursor = response.headers.get(server.NEXT_CURSOR_HEADER)
+        if not cursor:
+            return rows
+
+
+def test_repository_and_storage_are_abstract():
+    with pytest.raises(TypeError):
+        server.Repository()
+    with pytest.raises(TypeError):
+        server.Storage()
+
+
+def test_expense_crud(client):
+    expense = create_expense(client, tags=["morning"])
+    assert expense["version"] == 1
+
+    fetched = client.get(f"/api/expenses/{expense['id']}").json()
+    assert fetched["name"] == "Coffee" and fetched["tags"] == ["morning"]
+
+    response = client.put(f"/api/expenses/{expense['id']}", json={"amount": 4.0, "version": 1})
+    assert response.status_code == 200
+    assert response.json()["amount"] == 4.0 and response.json()["version"] == 2
+
+    stale = client.put(f"/api/expenses/{expense['id']}", json={"amount": 5.0, "version": 1})
+    assert stale.status_code == 409
+
+    assert client.delete(f"/api/expenses/{expense['id']}").status_code == 200
+    assert client.get(f"/api/expenses/{expense['id']}").status_code == 404
+    assert client.delete(f"/api/expenses/{expense['id']}").status_code == 404
+
+
+def test_subscription_crud_soft_deletes(client):
+    response = client.post("/api/subscriptions", json={
+        "name": "Music", "cost": 120, "billing_frequency": "yearly",
+        "next_due_date": this_month(1), "category": "streaming",
+    })
+    assert response.status_code == 200
+    subscription = response.json()
+
+    assert client.delete(f"/api/subscriptions/{subscription['id']}").status_code == 200
+    assert client.get(f"/api/subscriptions/{subscription['id']}").json()["is_active"] is False
+
+
+def test_documents_are_scoped_to_their_user(client, user_id):
+    expense = create_expense(client)
+    other = {server.USER_ID_HEADER: f"{user_id}-other"}
+
+    assert client.get(f"/api/expenses/{expense['id']}", headers=other).status_code == 404
+    assert client.get("/api/expenses", headers=other).json() == []
+
+
+def test_requests_without_a_user_act_as_the_default_user(client, monkeypatch):
+    expense = create_expense(client)
+    anonymous = {server.USER_ID_HEADER: ""}
+    response = client.get("/api/expenses", headers=anonymous)
+    assert response.status_code == 200
+    assert expense["id"] not in [row["id"] for row in response.json()]
+
+    monkeypatch.setattr(server, "DEFAULT_USER_ID", "")
+    assert client.get("/api/expenses", headers=anonymous).status_code == 401
+
+
+def test_pages_cover_every_row_once_in_order(client):
+    start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for i in range(7):
+        # Pairs of equal amounts and dates exercise the id tie-breaker
+        create_expense(client, name=f"Item {i}", amount=float(i // 2), date=(start + timedelta(hours=i // 2)).isoformat())
+
+    everything = client.get("/api/expenses").json()
+    assert len(everything) == 7
+
+    for sort, order in [("date", "desc"), ("amount", "asc"), ("name", "asc")]:
+        paged = fetch_all(client, "/api/expenses", limit=2, sort=sort, order=order)
+        unpaged = client.get("/api/expenses", params={"sort": sort, "order": order}).json()
+        assert [row["id"] for row in paged] == [row["id"] for row in unpaged]
+        assert len({row["id"] for row in paged}) == 7
+
+    by_amount = fetch_all(client, "/api/expenses", limit=3, sort="amount", order="asc")
+    assert [row["amount"] for row in by_amount] == sorted(row["amount"] for row in everything)
+
+
+def test_last_page_has_no_cursor(client):
+    for i in range(2):
+        create_expense(client, name=f"Item {i}")
+    response = client.get("/api/expenses", params={"limit": 2})
+    assert len(response.json()) == 2
+    assert server.NEXT_CURSOR_HEADER not in response.headers
+
+
+def test_dashboard_totals_follow_writes(client):
+    food = create_expense(client, amount=10, category="food", date=this_month(1))
+    create_expense(client, amount=5, category="transportation", date=this_month(1))
+    last_month = (datetime.utcnow().replace(day=1) - timedelta(days=1)).replace(hour=12).isoformat()
+    create_expense(client, amount=7, category="food", date=last_month)
+
+    dashboard = client.get("/api/dashboard").json()
+    assert dashboard["expense_spending"] == 15
+    assert dashboard["category_breakdown"] == {"food": 10, "transportation": 5}
+
+    client.put(f"/api/expenses/{food['id']}", json={"amount": 2})
+    response = client.post("/api/expenses/batch", json={"operations": [
+        {"op": "create", "data": {"name": "Bus", "amount": 1, "category": "transportation", "date": this_month(1)}},
+    ]})
+    assert response.json()["failed"] == 0
+
+    dashboard = client.get("/api/dashboard").json()
+    assert dashboard["expense_spending"] == 8
+    assert dashboard["category_breakdown"] == {"food": 2, "transportation": 6}
+    assert dashboard["savings_this_month"] == pytest.approx(7 - 8)
+
+    client.delete(f"/api/expenses/{food['id']}")
+    assert client.get("/api/dashboard").json()["category_breakdown"] == {"transportation": 6}
+
+
+def test_trend_totals_match_raw_expenses(client):
+    create_expense(client, amount=4, date=this_month(1))
+    create_expense(client, amount=6, date=this_month(1))
+
+    trends = client.get("/api/trends", params={"months": 3}).json()
+    assert len(trends) == 3
+    assert trends[-1]["expense_spending"] == 10
+    assert sum(trend["expense_spending"] for trend in trends) == 10
+
+
+def test_write_many_reports_unmatched_targeted_writes(sqlite_path, user_id):
+    storage = server.SQLiteStorage(sqlite_path)
+
+    async def scenario():
+        await storage.prepare()
+        expense = server.expense_document(
+            server.Expense(name="Coffee", amount=3, category="food", date=datetime.utcnow()), user_id
+        )
+        await storage.expenses.insert(expense)
+        return await storage.expenses.write_many(user_id, [
+            ("update", expense["id"], {"version": 1}, {"amount": 4.0}),
+            ("update", expense["id"], {"version": 1}, {"amount": 5.0}),
+            ("delete", "missing"),
+        ])
+
+    try:
+        result = asyncio.run(scenario())
+    finally:
+        storage.close()
+    assert result.updated == 1
+    assert result.unmatched == {1, 2}
+    assert result.errors == {}
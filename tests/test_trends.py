@@ -0,0 +1,98 @@
+from datetime import datetime
+
+import pytest
+
+import server
+
+DAILY = server.TrendGranularity.DAILY
+WEEKLY = server.TrendGranularity.WEEKLY
+MONTHLY = server.TrendGranularity.MONTHLY
+NOW = datetime(2026, 3, 10, 14, 0)
+
+
+def subscription(created_at, cancelled_at=None, is_active=None, cost=30.0):
+    return {
+        "cost": cost, "billing_frequency": "monthly", "created_at": created_at, "cancelled_at": cancelled_at,
+        "is_active": cancelled_at is None if is_active is None else is_active,
+    }
+
+
+def test_daily_buckets_run_from_the_window_start_to_today():
+    buckets = server.build_trend_buckets(NOW, 1, DAILY)
+    assert [bucket[0] for bucket in buckets] == [f"2026-03-{day:02d}" for day in range(1, 11)]
+    assert buckets[-1][1:] == ("10 Mar 2026", datetime(2026, 3, 10), datetime(2026, 3, 11))
+
+
+def test_weekly_buckets_are_iso_weeks_starting_on_monday():
+    buckets = server.build_trend_buckets(NOW, 1, WEEKLY)
+    assert [bucket[0] for bucket in buckets] == ["2026-W09", "2026-W10", "2026-W11"]
+    assert [bucket[2] for bucket in buckets] == [datetime(2026, 2, 23), datetime(2026, 3, 2), datetime(2026, 3, 9)]
+
+
+@pytest.mark.parametrize("granularity, expected", [
+    (DAILY, {"01 Mar 2026": 5.0, "08 Mar 2026": 7.0, "09 Mar 2026": 1.0}),
+    (WEEKLY, {"Week of 23 Feb 2026": 5.0, "Week of 02 Mar 2026": 7.0, "Week of 09 Mar 2026": 1.0}),
+])
+def test_expenses_land_in_their_bucket(granularity, expected):
+    expenses = [
+        {"date": datetime(2026, 3, 1, 23, 59), "amount": 5.0},  # A Sunday, the end of ISO week 9
+        {"date": datetime(2026, 3, 8), "amount": 7.0},
+        {"date": datetime(2026, 3, 9), "amount": 1.0},
+        {"date": datetime(2026, 2, 20), "amount": 100.0},  # Before either window
+    ]
+    trends = server.get_spending_trends([], expenses, 1, granularity, NOW)
+    assert {trend.month: trend.expense_spending for trend in trends if trend.expense_spending} == expected
+
+
+def test_subscriptions_count_from_creation_until_cancellation_by_month():
+    subscriptions = [
+        subscription(datetime(2025, 12, 15), cancelled_at=datetime(2026, 2, 5)),
+        subscription(datetime(2026, 2, 20), cost=12.0),
+        subscription(datetime(2025, 1, 1), is_active=False),  # Cancelled before dates were recorded
+    ]
+    trends = server.get_spending_trends(subscriptions, [], 4, MONTHLY, NOW)
+    assert [trend.month for trend in trends] == ["Dec 2025", "Jan 2026", "Feb 2026", "Mar 2026"]
+    assert [trend.subscription_spending for trend in trends] == [30.0, 30.0, 42.0, 12.0]
+
+
+def test_subscriptions_count_per_active_day_by_day_and_week():
+    sub = subscription(datetime(2026, 3, 3, 9, 0), cancelled_at=datetime(2026, 3, 6, 18, 0), cost=36.5)
+    daily_rate = 36.5 * 12 / 365
+
+    daily = server.get_spending_trends([sub], [], 1, DAILY, NOW)
+    assert [trend.subscription_spending for trend in daily] == pytest.approx(
+        [0, 0] + [daily_rate] * 4 + [0] * 4
+    )
+    weekly = server.get_spending_trends([sub], [], 1, WEEKLY, NOW)
+    assert [trend.subscription_spending for trend in weekly] == pytest.approx([0, 7 * daily_rate, 0])
+
+
+@pytest.mark.parametrize("granularity", ["daily", "weekly", "monthly"])
+def test_trends_endpoint_buckets_todays_expenses(client, granularity):
+    client.post("/api/expenses", json={
+        "name": "Coffee", "amount": 4, "category": "food", "date": datetime.utcnow().isoformat(),
+    })
+    trends = client.get("/api/trends", params={"months": 1, "granularity": granularity}).json()
+    assert trends[-1]["expense_spending"] == 4
+    assert sum(trend["expense_spending"] for trend in trends) == 4
+
+
+@pytest.mark.parametrize("backend", ["client", "mongo_client"])
+def test_deactivating_again_keeps_the_first_cancellation(request, backend):
+    client = request.getfixturevalue(backend)
+    sub = client.post("/api/subscriptions", json={
+        "name": "Music", "cost": 10, "billing_frequency": "monthly",
+        "next_due_date": "2026-04-01T00:00:00", "category": "streaming",
+    }).json()
+    path = f"/api/subscriptions/{sub['id']}"
+
+    cancelled_at = client.put(path, json={"is_active": False}).json()["cancelled_at"]
+    assert cancelled_at is not None
+    assert client.put(path, json={"is_active": False, "cost": 12}).json()["cancelled_at"] == cancelled_at
+    client.post("/api/subscriptions/batch", json={"operations": [
+        {"op": "update", "id": sub["id"], "data": {"is_active": False}},
+    ]})
+    stored = client.get(path).json()
+    assert (stored["cancelled_at"], stored["cost"], stored["version"]) == (cancelled_at, 12, 4)
+
+    assert client.put(path, json={"is_active": True}).json()["cancelled_at"] is None